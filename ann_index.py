@@ -0,0 +1,210 @@
+# Приближённый поиск ближайших соседей (IVF) по нормированным факторам треков ALS.
+# Векторы разбиваются сферическим k-means на n_lists кластеров; при поиске просматриваются
+# только n_probe ближайших к запросу кластеров вместо полного перебора всех треков.
+#
+# Построение индекса рядом с моделью (als_model.npz -> als_model_ivf.npz):
+# python ann_index.py als_model.npz --n-lists 1024
+
+import argparse
+import os
+
+import numpy as np
+
+
+def normalize_factors(factors):
+    """
+    Нормирует векторы факторов на единичную длину (косинусная близость, как в similar_items)
+    """
+
+    factors = np.asarray(factors, dtype=np.float32)
+    norms = np.linalg.norm(factors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+
+    return factors / norms
+
+
+def ann_index_path(model_path):
+    """
+    Путь к файлу индекса рядом с файлом модели: als_model.npz -> als_model_ivf.npz
+    """
+
+    root, _ = os.path.splitext(model_path)
+
+    return f"{root}_ivf.npz"
+
+
+def _assign(vectors, centroids, chunk_size=65536):
+    """
+    Возвращает номер ближайшего центроида для каждого вектора (по частям, чтобы ограничить память)
+    """
+
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk_size):
+        chunk = vectors[start : start + chunk_size]
+        assignment[start : start + chunk_size] = np.argmax(chunk @ centroids.T, axis=1)
+
+    return assignment
+
+
+def _spherical_kmeans(vectors, n_lists, n_iter, rng):
+    """
+    Сферический k-means: центроиды - нормированные средние векторов кластера
+    """
+
+    centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+    for _ in range(n_iter):
+        assignment = _assign(vectors, centroids)
+        counts = np.bincount(assignment, minlength=n_lists)
+        sums = np.stack(
+            [
+                np.bincount(assignment, weights=vectors[:, j], minlength=n_lists)
+                for j in range(vectors.shape[1])
+            ],
+            axis=1,
+        )
+        # пустые кластеры заново инициализируем случайными векторами
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = vectors[rng.choice(len(vectors), empty.sum(), replace=False)]
+        centroids = normalize_factors(sums)
+
+    return centroids
+
+
+class IVFIndex:
+    """
+    Методы:
+
+    build - строит индекс по нормированным факторам треков.
+    search - возвращает N ближайших треков для каждого запроса, просматривая n_probe кластеров.
+    save / load - сохраняет индекс в npz-файл и загружает его.
+    """
+
+    def __init__(self, centroids, list_offsets, list_items, list_vectors):
+
+        self.centroids = centroids  # центроиды кластеров (n_lists x factors)
+        self.list_offsets = list_offsets  # границы кластеров в list_items / list_vectors
+        self.list_items = list_items  # track_id_enc, сгруппированные по кластерам
+        self.list_vectors = list_vectors  # векторы треков в том же порядке
+
+    @classmethod
+    def build(cls, factors_normed, n_lists=None, n_iter=10, sample_size=200_000, random_state=0):
+        """
+        Строит индекс: k-means обучается на подвыборке, затем в кластеры раскладываются все треки
+        """
+
+        factors_normed = np.asarray(factors_normed, dtype=np.float32)
+        n_items = len(factors_normed)
+        if n_lists is None:
+            n_lists = max(1, int(np.sqrt(n_items)))
+        n_lists = min(n_lists, n_items)
+
+        rng = np.random.default_rng(random_state)
+        sample = factors_normed
+        if n_items > sample_size:
+            sample = factors_normed[rng.choice(n_items, sample_size, replace=False)]
+        centroids = _spherical_kmeans(sample, n_lists, n_iter, rng)
+
+        assignment = _assign(factors_normed, centroids)
+        list_items = np.argsort(assignment, kind="stable")
+        list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        list_offsets[1:] = np.cumsum(np.bincount(assignment, minlength=n_lists))
+
+        return cls(centroids, list_offsets, list_items, factors_normed[list_items])
+
+    @property
+    def n_lists(self):
+
+        return len(self.centroids)
+
+    def search(self, queries, N, n_probe=8, exclude=None, exclude_items=None):
+        """
+        Возвращает матрицы track_id_enc и scores размером len(queries) x N, строки отсортированы
+        по убыванию score. Если кандидатов меньше N, хвост заполняется -1 / -inf.
+        exclude - track_id_enc, который нужно исключить из выдачи каждого запроса (сам трек),
+        exclude_items - булева маска по track_id_enc: треки, исключённые из выдачи всех запросов
+        """
+
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        n_probe = min(n_probe, self.n_lists)
+
+        ids = np.full((len(queries), N), -1, dtype=np.int64)
+        scores = np.full((len(queries), N), -np.inf, dtype=np.float32)
+        if N <= 0:
+            return ids, scores
+
+        centroid_scores = queries @ self.centroids.T
+        probes = np.argpartition(centroid_scores, -n_probe, axis=1)[:, -n_probe:]
+
+        for row, (query, probe) in enumerate(zip(queries, probes)):
+            candidates = np.concatenate(
+                [
+                    np.arange(self.list_offsets[i], self.list_offsets[i + 1])
+                    for i in probe
+                ]
+            )
+            candidate_items = self.list_items[candidates]
+            candidate_scores = self.list_vectors[candidates] @ query
+            if exclude is not None:
+                candidate_scores[candidate_items == exclude[row]] = -np.inf
+            if exclude_items is not None:
+                candidate_scores[exclude_items[candidate_items]] = -np.inf
+
+            n_top = min(N, len(candidates))
+            if n_top == 0:
+                continue
+            top = np.argpartition(candidate_scores, -n_top)[-n_top:]
+            top = top[np.argsort(-candidate_scores[top], kind="stable")]
+            ids[row, :n_top] = candidate_items[top]
+            scores[row, :n_top] = candidate_scores[top]
+
+        # исключённые элементы не возвращаем
+        ids[np.isneginf(scores)] = -1
+
+        return ids, scores
+
+    def to_arrays(self):
+        """
+        Возвращает данные индекса в виде словаря массивов (ключи совпадают с аргументами конструктора)
+        """
+
+        return {
+            "centroids": self.centroids,
+            "list_offsets": self.list_offsets,
+            "list_items": self.list_items,
+            "list_vectors": self.list_vectors,
+        }
+
+    def save(self, file):
+        """
+        Сохраняет индекс в npz-файл (путь или файловый объект)
+        """
+
+        np.savez(file, **self.to_arrays())
+
+    @classmethod
+    def load(cls, file):
+        """
+        Загружает индекс из npz-файла (путь или файловый объект)
+        """
+
+        with np.load(file) as data:
+            return cls(**{name: data[name] for name in data.files})
+
+
+if __name__ == "__main__":
+
+    from implicit.als import AlternatingLeastSquares
+
+    parser = argparse.ArgumentParser(description="Построение IVF-индекса по модели ALS")
+    parser.add_argument("model_path", help="путь к als_model.npz")
+    parser.add_argument("--n-lists", type=int, default=None)
+    parser.add_argument("--n-iter", type=int, default=10)
+    args = parser.parse_args()
+
+    als_model = AlternatingLeastSquares().load(args.model_path)
+    index = IVFIndex.build(
+        normalize_factors(als_model.item_factors), n_lists=args.n_lists, n_iter=args.n_iter
+    )
+    index.save(ann_index_path(args.model_path))
+    print(f"Saved {ann_index_path(args.model_path)}: {index.n_lists} lists")
@@ -0,0 +1,267 @@
+# Локальный кэш артефактов сервиса (модель ALS, items.parquet, файлы рекомендаций).
+#
+# Файлы из хранилища (S3 или папка на диске вместо него) скачиваются в папку кэша один раз:
+# путь к файлу в кэше зависит от ключа и его версии (ETag), поэтому при повторном запуске
+# сервиса файл не скачивается заново, пока он не изменился в хранилище.
+# Производные данные (например, массивы из npz-модели) сохраняются рядом в .npy-файлах
+# и открываются через memory map.
+#
+# ArtifactGenerations - общая для всех воркеров папка с поколениями уже готовых массивов:
+# один процесс материализует артефакты в поколение, остальные открывают его через memory map.
+
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import threading
+
+import numpy as np
+
+from metrics import stage_seconds
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def save_arrays(arrays, path):
+    """
+    Сохраняет словарь массивов в папку path как .npy-файлы
+    (сначала во временную папку, затем атомарно переименовывает).
+    Если папку path уже собрал другой процесс или поток, остаётся она, а временная папка удаляется:
+    готовая папка не пропадает из-под читателей и не перезаписывается
+    """
+
+    tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    os.makedirs(tmp_path, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_path, f"{name}.npy"), np.asarray(array))
+
+    try:
+        # rename папки поверх непустой папки не выполняется (ENOTEMPTY / EEXIST)
+        os.rename(tmp_path, path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def load_arrays(path, mmap_mode="r"):
+    """
+    Открывает все .npy-файлы из папки path (по умолчанию через memory map, только для чтения)
+    """
+
+    return {
+        name[: -len(".npy")]: np.load(os.path.join(path, name), mmap_mode=mmap_mode)
+        for name in sorted(os.listdir(path))
+        if name.endswith(".npy")
+    }
+
+
+class LocalStorage:
+    """
+    Хранилище артефактов в папке на диске (вместо S3 - для тестов и бенчмарков)
+    """
+
+    def __init__(self, root):
+
+        self.root = root
+
+    def etag(self, key):
+        """
+        Версия файла: время изменения и размер
+        """
+
+        stat = os.stat(os.path.join(self.root, key))
+
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+    def download(self, key, path):
+
+        shutil.copyfile(os.path.join(self.root, key), path)
+
+
+class S3Storage:
+    """
+    Хранилище артефактов в бакете S3
+    """
+
+    def __init__(self, client, bucket):
+
+        self.client = client
+        self.bucket = bucket
+
+    def etag(self, key):
+        """
+        Версия файла: ETag объекта в S3
+        """
+
+        return self.client.head_object(Bucket=self.bucket, Key=key)["ETag"].strip('"')
+
+    def download(self, key, path):
+
+        self.client.download_file(self.bucket, key, path)
+
+
+class ArtifactCache:
+    """
+    Методы:
+
+    entry_dir - папка кэша для текущей версии ключа (версия запрашивается в хранилище один раз).
+    refresh - забывает запомненные версии ключей: следующее обращение снова спросит хранилище.
+    fetch - возвращает путь к локальной копии файла (скачивает, если версии ещё нет в кэше).
+    arrays - возвращает производные массивы для текущей версии ключа (строит и сохраняет при первом обращении).
+    """
+
+    def __init__(self, storage, cache_dir):
+
+        self.storage = storage
+        self.cache_dir = cache_dir
+        self._etags = {}  # key -> версия, полученная от хранилища (head_object для S3)
+
+    def entry_dir(self, key):
+
+        etag = self._etags.get(key)
+        if etag is None:
+            etag = self._etags[key] = self.storage.etag(key)
+        digest = hashlib.sha256(f"{key}\0{etag}".encode("utf-8")).hexdigest()[:32]
+
+        return os.path.join(self.cache_dir, digest)
+
+    def refresh(self, key=None):
+        """
+        Забывает запомненную версию ключа key (или всех ключей)
+        """
+
+        if key is None:
+            self._etags = {}
+        else:
+            self._etags.pop(key, None)
+
+    def fetch(self, key):
+
+        entry_dir = self.entry_dir(key)
+        path = os.path.join(entry_dir, os.path.basename(key))
+        if not os.path.exists(path):
+            logger.info(f"Downloading artifact: {key}")
+            os.makedirs(entry_dir, exist_ok=True)
+            tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+            with stage_seconds.time(stage="s3_load"):
+                self.storage.download(key, tmp_path)
+            os.replace(tmp_path, path)
+
+        return path
+
+    def arrays(self, key, name, build):
+        """
+        build(local_path) -> словарь массивов; результат сохраняется в папку name рядом с файлом
+        """
+
+        path = os.path.join(self.entry_dir(key), name)
+        if not os.path.exists(path):
+            logger.info(f"Building cached arrays: {key} -> {name}")
+            save_arrays(build(self.fetch(key)), path)
+
+        return load_arrays(path)
+
+
+def _link_tree(src, dst):
+    """
+    Переносит папку src в dst жёсткими ссылками на файлы (копирует, если ссылки не поддерживаются)
+    """
+
+    os.makedirs(dst, exist_ok=True)
+    for name in os.listdir(src):
+        try:
+            os.link(os.path.join(src, name), os.path.join(dst, name))
+        except OSError:
+            shutil.copy2(os.path.join(src, name), os.path.join(dst, name))
+
+
+class ArtifactGenerations:
+    """
+    Поколения массивов в общей папке root: gen-<N>/<name>/*.npy, файл CURRENT - номер текущего поколения.
+    Поколение после публикации не меняется, поэтому его можно открывать через memory map из многих
+    процессов сразу: страницы файлов общие (page cache ОС), а память процессов не растёт с их числом.
+
+    Методы:
+
+    current - номер текущего поколения (None, если ещё ничего не опубликовано).
+    publish - под файловой блокировкой собирает новое поколение и атомарно делает его текущим.
+    attach - открывает массивы поколения через memory map (только для чтения).
+    """
+
+    def __init__(self, root, keep=2):
+
+        self.root = root
+        self.keep = keep  # сколько последних поколений хранить на диске
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, gen):
+
+        return os.path.join(self.root, f"gen-{gen:08d}")
+
+    def current(self):
+
+        current_path = os.path.join(self.root, "CURRENT")
+        if not os.path.exists(current_path):
+            return None
+
+        with open(current_path) as f:
+            return int(f.read())
+
+    def publish(self, arrays, if_missing=False):
+        """
+        arrays - словарь name -> словарь массивов или функция без аргументов, которая его возвращает
+        (функции вызываются уже под блокировкой, поэтому строит массивы только один процесс).
+        Массивы текущего поколения, которых нет в arrays, переносятся в новое жёсткими ссылками.
+        if_missing - публиковать, только если поколений ещё нет (иначе вернуть номер текущего)
+        """
+
+        with open(os.path.join(self.root, "lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            current = self.current()
+            if if_missing and current is not None:
+                return current
+
+            gen = (current or 0) + 1
+            tmp_path = f"{self.path(gen)}.tmp-{os.getpid()}"
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            os.makedirs(tmp_path)
+
+            if current is not None:
+                for name in os.listdir(self.path(current)):
+                    if name not in arrays:
+                        _link_tree(
+                            os.path.join(self.path(current), name), os.path.join(tmp_path, name)
+                        )
+
+            for name, value in arrays.items():
+                save_arrays(value() if callable(value) else value, os.path.join(tmp_path, name))
+
+            os.replace(tmp_path, self.path(gen))
+            current_tmp_path = os.path.join(self.root, f"CURRENT.tmp-{os.getpid()}")
+            with open(current_tmp_path, "w") as f:
+                f.write(str(gen))
+            os.replace(current_tmp_path, os.path.join(self.root, "CURRENT"))
+
+            # старые поколения удаляем: уже открытые в других процессах memory map остаются валидными
+            for old_gen in range(max(0, gen - 100), gen - self.keep + 1):
+                shutil.rmtree(self.path(old_gen), ignore_errors=True)
+
+        logger.info(f"Published artifacts generation {gen}: {sorted(arrays)}")
+
+        return gen
+
+    def attach(self, gen):
+        """
+        Возвращает словарь name -> словарь массивов поколения gen (memory map, только для чтения)
+        """
+
+        path = self.path(gen)
+
+        return {
+            name: load_arrays(os.path.join(path, name))
+            for name in sorted(os.listdir(path))
+            if os.path.isdir(os.path.join(path, name))
+        }
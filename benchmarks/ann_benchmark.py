@@ -0,0 +1,129 @@
+# Бенчмарк приближённого поиска похожих треков: recall@N и задержка IVF-индекса
+# относительно точного перебора для разных n_probe (для выбора рабочей точки ALS_ANN_N_PROBE).
+#
+# Запуск из корня репозитория:
+# python -m benchmarks.ann_benchmark --model als_model.npz --n-lists 1024 --output ann_benchmark.json
+# без --model используются случайные факторы заданного размера (--n-items, --factors)
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from ann_index import IVFIndex, normalize_factors
+
+
+def exact_search(factors_normed, queries_enc, N):
+    """
+    Точные N ближайших треков (без самого трека) полным перебором
+    """
+
+    scores = factors_normed[queries_enc] @ factors_normed.T
+    scores[np.arange(len(queries_enc)), queries_enc] = -np.inf
+    top = np.argpartition(scores, -N, axis=1)[:, -N:]
+
+    return top
+
+
+def recall_at_n(exact_ids, approx_ids):
+    """
+    Средняя доля точных соседей, найденных приближённым поиском
+    """
+
+    hits = [
+        len(np.intersect1d(exact_row, approx_row[approx_row >= 0]))
+        for exact_row, approx_row in zip(exact_ids, approx_ids)
+    ]
+
+    return float(np.mean(hits) / exact_ids.shape[1])
+
+
+def run(factors_normed, N, n_lists, n_probes, n_queries, random_state=0):
+    """
+    Возвращает список результатов: режим, n_probe, recall@N, задержка на запрос (мс)
+    """
+
+    rng = np.random.default_rng(random_state)
+    queries_enc = rng.choice(len(factors_normed), n_queries, replace=False)
+
+    start = time.perf_counter()
+    index = IVFIndex.build(factors_normed, n_lists=n_lists, random_state=random_state)
+    build_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    exact_ids = np.stack(
+        [exact_search(factors_normed, queries_enc[i : i + 1], N)[0] for i in range(n_queries)]
+    )
+    exact_ms = 1000 * (time.perf_counter() - start) / n_queries
+
+    results = [
+        {"mode": "exact", "n_probe": None, "recall": 1.0, "latency_ms": exact_ms},
+    ]
+    for n_probe in n_probes:
+        start = time.perf_counter()
+        approx_ids = np.concatenate(
+            [
+                index.search(
+                    factors_normed[queries_enc[i : i + 1]],
+                    N,
+                    n_probe=n_probe,
+                    exclude=queries_enc[i : i + 1],
+                )[0]
+                for i in range(n_queries)
+            ]
+        )
+        approx_ms = 1000 * (time.perf_counter() - start) / n_queries
+        results.append(
+            {
+                "mode": "approx",
+                "n_probe": n_probe,
+                "recall": recall_at_n(exact_ids, approx_ids),
+                "latency_ms": approx_ms,
+            }
+        )
+
+    return {
+        "n_items": len(factors_normed),
+        "factors": factors_normed.shape[1],
+        "N": N,
+        "n_lists": index.n_lists,
+        "build_seconds": build_seconds,
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Recall@N vs latency для IVF-индекса")
+    parser.add_argument("--model", default=None, help="путь к als_model.npz")
+    parser.add_argument("--n-items", type=int, default=200_000)
+    parser.add_argument("--factors", type=int, default=50)
+    parser.add_argument("--N", type=int, default=10)
+    parser.add_argument("--n-lists", type=int, default=None)
+    parser.add_argument("--n-probes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--n-queries", type=int, default=200)
+    parser.add_argument("--output", default=None, help="куда сохранить результаты в json")
+    args = parser.parse_args()
+
+    if args.model:
+        from implicit.als import AlternatingLeastSquares
+
+        factors = AlternatingLeastSquares().load(args.model).item_factors
+    else:
+        factors = np.random.default_rng(0).standard_normal((args.n_items, args.factors))
+
+    report = run(
+        normalize_factors(factors), args.N, args.n_lists, args.n_probes, args.n_queries
+    )
+
+    print(f"items: {report['n_items']}, lists: {report['n_lists']}, build: {report['build_seconds']:.1f}s")
+    for result in report["results"]:
+        print(
+            f"{result['mode']:<7} n_probe={str(result['n_probe']):<5} "
+            f"recall@{args.N}={result['recall']:.3f} latency={result['latency_ms']:.2f}ms"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
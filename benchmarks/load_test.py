@@ -0,0 +1,362 @@
+# Нагрузочный тест сервиса на синтетических данных.
+#
+# Сервис запускается (uvicorn в отдельном процессе) на синтетических артефактах из папки вместо S3
+# (см. benchmarks/synthetic.py), или тестируется уже запущенный сервис (--url). Каждый эндпоинт
+# нагружается с заданной параллельностью; результат - json с p50/p95/p99, пропускной способностью,
+# числом ошибок и памятью (RSS) процесса сервиса, который можно сравнить с результатом другого запуска.
+#
+# Запуск из корня репозитория:
+# python -m benchmarks.load_test run --n-items 100000 --n-users 10000 --concurrency 1 8 32 --output base.json
+# python -m benchmarks.load_test run --env ALS_I2I_MODE=approx --output approx.json
+# python -m benchmarks.load_test compare base.json approx.json --threshold 0.2
+
+import argparse
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import requests
+
+from benchmarks.synthetic import ARTIFACT_KEYS, generate, service_env
+
+ENDPOINTS = (
+    "recommendations",
+    "recommendations_batch",
+    "get_online_u2i",
+    "put_user_event",
+    "load_recommendations",
+)
+
+
+class Workload:
+    """
+    Случайные запросы к эндпоинтам по синтетическим пользователям и трекам
+    """
+
+    def __init__(self, user_ids, track_ids, cold_share=0.1, k=100, batch_size=100, random_state=0):
+
+        self.user_ids = np.asarray(user_ids)
+        self.track_ids = np.asarray(track_ids)
+        self.cold_share = cold_share  # доля запросов от пользователей без персональных рекомендаций
+        self.k = k
+        self.batch_size = batch_size
+        self._rng = np.random.default_rng(random_state)
+        self._lock = threading.Lock()
+
+    def user_id(self):
+
+        with self._lock:
+            if self._rng.random() < self.cold_share:
+                return int(self.user_ids.max() + 1 + self._rng.integers(0, 10**6))
+            return int(self._rng.choice(self.user_ids))
+
+    def track_id(self):
+
+        with self._lock:
+            return int(self._rng.choice(self.track_ids))
+
+    def request(self, session, url, endpoint):
+        """
+        Выполняет один запрос к эндпоинту и возвращает код ответа
+        """
+
+        if endpoint == "recommendations":
+            params = {"user_id": self.user_id(), "k": self.k}
+            return session.post(f"{url}/recommendations", params=params).status_code
+
+        if endpoint == "recommendations_batch":
+            body = {"user_ids": [self.user_id() for _ in range(self.batch_size)], "k": self.k}
+            response = session.post(f"{url}/recommendations/batch", json=body)
+            response.content  # дочитываем поток NDJSON до конца
+            return response.status_code
+
+        if endpoint == "get_online_u2i":
+            params = {"user_id": self.user_id(), "k": 10, "N": 10}
+            return session.post(f"{url}/get_online_u2i", params=params).status_code
+
+        if endpoint == "put_user_event":
+            params = {"user_id": self.user_id(), "item_id": self.track_id()}
+            return session.post(f"{url}/put_user_event", params=params).status_code
+
+        if endpoint == "load_recommendations":
+            # время от постановки перезагрузки до её окончания
+            params = {"rec_type": "default", "file_path": ARTIFACT_KEYS["KEY_TOP_POPULAR_PARQUET"]}
+            response = session.get(f"{url}/load_recommendations", params=params)
+            if response.status_code != 200:
+                return response.status_code
+            job_id = response.json()["job_id"]
+            while True:
+                job = session.get(f"{url}/load_recommendations/{job_id}").json()
+                if job["status"] in ("done", "failed"):
+                    return 200 if job["status"] == "done" else 500
+                time.sleep(0.01)
+
+        raise ValueError(f"Unknown endpoint: {endpoint}")
+
+
+def run_load(url, workload, endpoint, concurrency, n_requests):
+    """
+    Выполняет n_requests запросов к эндпоинту в concurrency потоков; возвращает задержки (сек), коды и время
+    """
+
+    latencies = np.zeros(n_requests)
+    statuses = np.zeros(n_requests, dtype=np.int64)
+    local = threading.local()
+
+    def one(i):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            statuses[i] = workload.request(local.session, url, endpoint)
+        except requests.RequestException:
+            statuses[i] = -1
+        latencies[i] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(n_requests)))
+
+    return latencies, statuses, time.perf_counter() - start
+
+
+def server_rss(url):
+    """
+    Память процесса сервиса по метрике recsys_process_memory_bytes из /metrics (None, если недоступна)
+    """
+
+    try:
+        text = requests.get(f"{url}/metrics", timeout=5).text
+    except requests.RequestException:
+        return None
+
+    match = re.search(r"^recsys_process_memory_bytes (\S+)$", text, re.MULTILINE)
+
+    return int(float(match.group(1))) if match else None
+
+
+def summarize(latencies, statuses, seconds):
+
+    ok = statuses == 200
+    latencies_ms = latencies * 1000
+
+    return {
+        "requests": int(len(latencies)),
+        "errors": int((~ok).sum()),
+        "status_codes": {str(code): int(count) for code, count in zip(*np.unique(statuses, return_counts=True))},
+        "throughput_rps": round(len(latencies) / seconds, 2) if seconds > 0 else None,
+        "latency_ms": {
+            "mean": round(float(latencies_ms.mean()), 3),
+            "p50": round(float(np.percentile(latencies_ms, 50)), 3),
+            "p95": round(float(np.percentile(latencies_ms, 95)), 3),
+            "p99": round(float(np.percentile(latencies_ms, 99)), 3),
+            "max": round(float(latencies_ms.max()), 3),
+        },
+    }
+
+
+def free_port():
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_service(data_dir, cache_dir, extra_env, workers=1, timeout=600):
+    """
+    Запускает uvicorn с сервисом на синтетических данных и ждёт готовности (/ready); возвращает (процесс, url)
+    """
+
+    port = free_port()
+    env = {**os.environ, **service_env(data_dir, cache_dir), **extra_env}
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "recommendations_service:app",
+            "--port",
+            str(port),
+            "--workers",
+            str(workers),
+            "--log-level",
+            "warning",
+        ],
+        env=env,
+        cwd=repo_root,
+    )
+    url = f"http://127.0.0.1:{port}"
+
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if process.poll() is not None:
+            raise RuntimeError(f"Service exited with code {process.returncode}")
+        try:
+            if requests.get(f"{url}/ready", timeout=1).status_code == 200:
+                return process, url
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+
+    process.terminate()
+    raise TimeoutError("Service is not ready")
+
+
+def git_commit():
+
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+
+    extra_env = dict(item.split("=", 1) for item in args.env)
+
+    if not all(os.path.exists(os.path.join(args.data_dir, key)) for key in ARTIFACT_KEYS.values()):
+        generate(args.data_dir, n_items=args.n_items, n_users=args.n_users, random_state=args.random_state)
+
+    user_ids = pd.read_parquet(
+        os.path.join(args.data_dir, ARTIFACT_KEYS["KEY_PERSONAL_ALS_PARQUET"]), columns=["user_id"]
+    )["user_id"].unique()
+    track_ids = pd.read_parquet(
+        os.path.join(args.data_dir, ARTIFACT_KEYS["KEY_ITEMS_PARQUET"]), columns=["track_id"]
+    )["track_id"].to_numpy()
+    workload = Workload(
+        user_ids, track_ids, cold_share=args.cold_share, k=args.k, random_state=args.random_state
+    )
+
+    report = {
+        "config": {
+            "commit": git_commit(),
+            "n_items": len(track_ids),
+            "n_users": len(user_ids),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "workers": args.workers,
+            "env": extra_env,
+        },
+        "results": {},
+    }
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        process = None
+        url = args.url
+        if url is None:
+            process, url = start_service(args.data_dir, cache_dir, extra_env, workers=args.workers)
+        try:
+            report["rss_bytes_start"] = server_rss(url)
+
+            # у части пользователей заранее есть события - чтобы онлайн-рекомендации были непустыми
+            run_load(url, workload, "put_user_event", max(args.concurrency), args.warmup_events)
+
+            for endpoint in args.endpoints:
+                report["results"][endpoint] = {}
+                for concurrency in args.concurrency:
+                    n_requests = args.reload_requests if endpoint == "load_recommendations" else args.requests
+                    result = summarize(*run_load(url, workload, endpoint, concurrency, n_requests))
+                    result["rss_bytes"] = server_rss(url)
+                    report["results"][endpoint][str(concurrency)] = result
+                    print(
+                        f"{endpoint:<24} c={concurrency:<4} "
+                        f"p50={result['latency_ms']['p50']:.2f}ms p95={result['latency_ms']['p95']:.2f}ms "
+                        f"p99={result['latency_ms']['p99']:.2f}ms rps={result['throughput_rps']} "
+                        f"errors={result['errors']}",
+                        file=sys.stderr,
+                    )
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+def compare(baseline, current, threshold=0.2):
+    """
+    Сравнивает два результата: для каждого эндпоинта и параллельности - изменение p50/p95/p99 и throughput.
+    Возвращает (строки сравнения, есть ли ухудшение p95 больше threshold или новые ошибки)
+    """
+
+    lines = []
+    regressed = False
+    for endpoint, by_concurrency in current["results"].items():
+        for concurrency, result in by_concurrency.items():
+            base = baseline["results"].get(endpoint, {}).get(concurrency)
+            if base is None:
+                continue
+
+            changes = {}
+            for name in ("p50", "p95", "p99"):
+                before, after = base["latency_ms"][name], result["latency_ms"][name]
+                changes[name] = (after - before) / before if before > 0 else 0.0
+            if base["throughput_rps"] and result["throughput_rps"]:
+                changes["rps"] = (result["throughput_rps"] - base["throughput_rps"]) / base["throughput_rps"]
+
+            bad = changes["p95"] > threshold or result["errors"] > base["errors"]
+            regressed = regressed or bad
+            lines.append(
+                f"{endpoint:<24} c={concurrency:<4} "
+                + " ".join(f"{name}={change:+.1%}" for name, change in changes.items())
+                + f" errors={base['errors']}->{result['errors']}"
+                + ("  REGRESSION" if bad else "")
+            )
+
+    return lines, regressed
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Нагрузочный тест сервиса рекомендаций")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="запустить нагрузку и сохранить результат")
+    run_parser.add_argument("--data-dir", default="bench_data")
+    run_parser.add_argument("--n-items", type=int, default=100_000)
+    run_parser.add_argument("--n-users", type=int, default=10_000)
+    run_parser.add_argument("--random-state", type=int, default=0)
+    run_parser.add_argument("--url", default=None, help="уже запущенный сервис (иначе запускается свой)")
+    run_parser.add_argument("--workers", type=int, default=1, help="число воркеров uvicorn")
+    run_parser.add_argument("--env", nargs="*", default=[], help="переменные окружения сервиса KEY=VALUE")
+    run_parser.add_argument("--endpoints", nargs="+", default=list(ENDPOINTS), choices=ENDPOINTS)
+    run_parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32])
+    run_parser.add_argument("--requests", type=int, default=2000, help="запросов на эндпоинт и параллельность")
+    run_parser.add_argument("--reload-requests", type=int, default=5)
+    run_parser.add_argument("--warmup-events", type=int, default=5000)
+    run_parser.add_argument("--cold-share", type=float, default=0.1)
+    run_parser.add_argument("--k", type=int, default=100)
+    run_parser.add_argument("--output", default=None, help="куда сохранить результат в json")
+
+    compare_parser = subparsers.add_parser("compare", help="сравнить два результата")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.2, help="допустимый рост p95")
+
+    args = parser.parse_args()
+
+    if args.command == "run":
+        run(args)
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        lines, regressed = compare(baseline, current, args.threshold)
+        print("\n".join(lines))
+        sys.exit(1 if regressed else 0)
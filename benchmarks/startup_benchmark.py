@@ -0,0 +1,75 @@
+# Бенчмарк времени запуска сервиса с пустым (cold) и заполненным (warm) локальным кэшем артефактов.
+# Вместо S3 используется папка с синтетическими артефактами (ARTIFACT_STORAGE_DIR).
+#
+# python -m benchmarks.startup_benchmark --data-dir bench_data --n-items 1000000 --n-users 100000
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.synthetic import ARTIFACT_KEYS, generate, service_env
+
+# код, который выполняется в отдельном процессе: импорт сервиса и загрузка всех артефактов
+STARTUP_CODE = """
+import json, time
+start = time.perf_counter()
+import recommendations_service as service
+imported = time.perf_counter() - start
+service.run_startup()
+print(json.dumps({
+    "import_seconds": round(imported, 3),
+    "total_seconds": round(time.perf_counter() - start, 3),
+    "ready": service.startup_state["ready"],
+    "error": service.startup_state["error"],
+    "load_seconds": service.artifacts.load_seconds,
+}))
+"""
+
+
+def measure_startup(data_dir, cache_dir):
+    """
+    Запускает загрузку сервиса в отдельном процессе и возвращает замеры
+    """
+
+    env = {**os.environ, **service_env(data_dir, cache_dir)}
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, "-c", STARTUP_CODE],
+        env=env,
+        cwd=repo_root,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Время запуска сервиса: cold vs warm кэш")
+    parser.add_argument("--data-dir", default="bench_data")
+    parser.add_argument("--n-items", type=int, default=100_000)
+    parser.add_argument("--n-users", type=int, default=10_000)
+    parser.add_argument("--warm-runs", type=int, default=3)
+    parser.add_argument("--output", default=None, help="куда сохранить результаты в json")
+    args = parser.parse_args()
+
+    if not all(
+        os.path.exists(os.path.join(args.data_dir, key)) for key in ARTIFACT_KEYS.values()
+    ):
+        generate(args.data_dir, n_items=args.n_items, n_users=args.n_users)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        report = {"cold": measure_startup(args.data_dir, cache_dir)}
+        report["warm"] = [
+            measure_startup(args.data_dir, cache_dir) for _ in range(args.warm_runs)
+        ]
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,103 @@
+# Синтетические артефакты сервиса заданного размера: items.parquet, als_model.npz,
+# personal_als.parquet и top_popular.parquet. Папка с ними подставляется вместо S3
+# через ARTIFACT_STORAGE_DIR.
+#
+# python -m benchmarks.synthetic bench_data --n-items 1000000 --n-users 100000
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+# имена файлов синтетических артефактов и переменные окружения, через которые сервис их находит
+ARTIFACT_KEYS = {
+    "KEY_ITEMS_PARQUET": "items.parquet",
+    "KEY_ALS_MODEL": "als_model.npz",
+    "KEY_PERSONAL_ALS_PARQUET": "personal_als.parquet",
+    "KEY_TOP_POPULAR_PARQUET": "top_popular.parquet",
+}
+
+
+def service_env(data_dir, cache_dir):
+    """
+    Переменные окружения, с которыми сервис читает синтетические артефакты из data_dir вместо S3
+    """
+
+    return {
+        "ARTIFACT_STORAGE_DIR": os.path.abspath(data_dir),
+        "ARTIFACT_CACHE_DIR": os.path.join(os.path.abspath(cache_dir), "artifacts"),
+        "RECS_CACHE_DIR": os.path.join(os.path.abspath(cache_dir), "recs"),
+        **ARTIFACT_KEYS,
+    }
+
+
+def generate(data_dir, n_items=100_000, n_users=10_000, n_recs=100, factors=50, random_state=0):
+    """
+    Генерирует артефакты в папку data_dir
+    """
+
+    from implicit.als import AlternatingLeastSquares
+
+    os.makedirs(data_dir, exist_ok=True)
+    rng = np.random.default_rng(random_state)
+
+    # треки: track_id - разреженные идентификаторы, track_id_enc - 0, 1, 2, ...
+    track_ids = np.sort(rng.choice(n_items * 100, n_items, replace=False))
+    artist_ids = rng.integers(0, max(1, n_items // 20), n_items)
+    genre_ids = rng.integers(0, 100, (n_items, 2))
+    items = pd.DataFrame(
+        {
+            "track_id": track_ids,
+            "track_id_enc": np.arange(n_items),
+            "track_name": [[f"track {i}"] for i in track_ids],
+            "artist_name": [[f"artist {i}"] for i in artist_ids],
+            "genre_name": [[f"genre {a}", f"genre {b}"] for a, b in genre_ids],
+        }
+    )
+    items.to_parquet(os.path.join(data_dir, ARTIFACT_KEYS["KEY_ITEMS_PARQUET"]))
+
+    # модель ALS со случайными факторами (кластеры, чтобы похожие треки были осмысленными)
+    n_clusters = max(1, int(np.sqrt(n_items)))
+    centers = rng.standard_normal((n_clusters, factors)).astype(np.float32)
+    item_factors = centers[rng.integers(0, n_clusters, n_items)]
+    item_factors += 0.3 * rng.standard_normal((n_items, factors)).astype(np.float32)
+    user_factors = rng.standard_normal((n_users, factors)).astype(np.float32)
+    als_model = AlternatingLeastSquares(factors=factors, random_state=random_state)
+    als_model.item_factors = item_factors
+    als_model.user_factors = user_factors
+    als_model.save(os.path.join(data_dir, ARTIFACT_KEYS["KEY_ALS_MODEL"]))
+
+    # персональные рекомендации: по n_recs треков на пользователя по убыванию score
+    user_ids = np.sort(rng.choice(n_users * 10, n_users, replace=False))
+    personal = pd.DataFrame(
+        {
+            "user_id": np.repeat(user_ids, n_recs),
+            "track_id": track_ids[rng.integers(0, n_items, n_users * n_recs)],
+            "score": np.tile(np.linspace(1.0, 0.01, n_recs), n_users),
+        }
+    )
+    personal.to_parquet(os.path.join(data_dir, ARTIFACT_KEYS["KEY_PERSONAL_ALS_PARQUET"]))
+
+    top_popular = pd.DataFrame(
+        {
+            "track_id": track_ids[rng.choice(n_items, min(100, n_items), replace=False)],
+            "popularity_weighted": np.linspace(100.0, 1.0, min(100, n_items)),
+        }
+    )
+    top_popular.to_parquet(os.path.join(data_dir, ARTIFACT_KEYS["KEY_TOP_POPULAR_PARQUET"]))
+
+    return {"items": items, "user_ids": user_ids}
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Генерация синтетических артефактов сервиса")
+    parser.add_argument("data_dir")
+    parser.add_argument("--n-items", type=int, default=100_000)
+    parser.add_argument("--n-users", type=int, default=10_000)
+    parser.add_argument("--n-recs", type=int, default=100)
+    parser.add_argument("--factors", type=int, default=50)
+    args = parser.parse_args()
+
+    generate(args.data_dir, args.n_items, args.n_users, args.n_recs, args.factors)
@@ -0,0 +1,187 @@
+# Смешивание рекомендаций из нескольких источников (онлайн, оффлайн, ТОП) в итоговый список.
+#
+# Кандидаты каждого источника - массивы track_id и score в порядке убывания score. Стратегия задаёт
+# порядок, в котором кандидаты попадают в выдачу; повторы и уже прослушанные пользователем треки
+# пропускаются, а выдача заканчивается, как только набрано k треков. Если кандидатов не хватило,
+# список дополняется треками из запасного источника (ТОП-рекомендаций).
+
+import numpy as np
+
+
+class Blender:
+    """
+    Методы:
+
+    blend - смешивает кандидатов из источников в список из k треков (track_ids, scores, sources).
+    """
+
+    STRATEGIES = ("interleave", "weighted", "quota")
+
+    def __init__(self, strategy="interleave", weights=None):
+        """
+        strategy:
+            interleave - чередование источников (в порядке приоритета);
+            weighted - сортировка по сумме нормированных score источников с весами weights;
+            quota - каждому источнику достаётся доля k, пропорциональная его весу, остаток - чередованием.
+        weights - веса источников {source: weight} (по умолчанию у всех источников вес 1)
+        """
+
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Unknown blend strategy: {strategy}")
+
+        self.strategy = strategy
+        self.weights = weights or {}
+
+    def _weight(self, source):
+
+        return self.weights.get(source, 1.0)
+
+    def blend(self, sources, k, exclude=(), fill=None):
+        """
+        sources - список (source, track_ids, scores) в порядке приоритета;
+        exclude - треки, которые не нужно рекомендовать (например, уже прослушанные);
+        fill - (source, track_ids, scores), чем дополнить список до k, если кандидатов не хватило.
+
+        Возвращает (track_ids, scores, sources) длиной k (меньше - только если не хватило и запасных треков)
+        """
+
+        sources = [
+            (source, np.asarray(track_ids, dtype=np.int64), np.asarray(scores, dtype=np.float64))
+            for source, track_ids, scores in sources
+        ]
+        output = _Output(k, exclude)
+
+        if self.strategy == "interleave":
+            _interleave(output, sources)
+        elif self.strategy == "weighted":
+            self._weighted(output, sources)
+        else:
+            self._quota(output, sources)
+
+        if fill is not None and not output.full():
+            source, track_ids, scores = fill
+            for track_id, score in zip(np.asarray(track_ids).tolist(), np.asarray(scores).tolist()):
+                if output.add(track_id, score, source):
+                    break
+
+        return output.result()
+
+    def _weighted(self, output, sources):
+        """
+        Score трека - сумма нормированных (min-max внутри источника) score с весами источников
+        """
+
+        if not sources or all(len(track_ids) == 0 for _, track_ids, _ in sources):
+            return
+
+        track_ids = np.concatenate([track_ids for _, track_ids, _ in sources])
+        weighted = np.concatenate(
+            [self._weight(source) * _normalize(scores) for source, _, scores in sources]
+        )
+        labels = np.concatenate(
+            [np.full(len(ids), i) for i, (_, ids, _) in enumerate(sources)]
+        )
+
+        unique_ids, first, inverse = np.unique(track_ids, return_index=True, return_inverse=True)
+        merged = np.bincount(inverse, weights=weighted, minlength=len(unique_ids))
+        # при равных score выше тот трек, который раньше встретился в источниках
+        order = np.lexsort((first, -merged))
+
+        for i in order:
+            if output.add(unique_ids[i], merged[i], sources[labels[first[i]]][0]):
+                break
+
+    def _quota(self, output, sources):
+        """
+        Сначала каждый источник заполняет свою долю k, затем оставшиеся места - чередованием всех источников
+        """
+
+        total_weight = sum(self._weight(source) for source, _, _ in sources)
+        picks = []
+        seen = set(output.seen)
+        for source, track_ids, scores in sources:
+            quota = int(round(output.k * self._weight(source) / total_weight)) if total_weight else 0
+            picked_ids, picked_scores = [], []
+            for track_id, score in zip(track_ids.tolist(), scores.tolist()):
+                if len(picked_ids) >= quota:
+                    break
+                if track_id not in seen:
+                    seen.add(track_id)
+                    picked_ids.append(track_id)
+                    picked_scores.append(score)
+            picks.append((source, picked_ids, picked_scores))
+
+        if not _interleave(output, picks):
+            _interleave(output, sources)
+
+
+class _Output:
+    """
+    Итоговый список: пропускает повторы и исключённые треки, сообщает, когда набрано k
+    """
+
+    def __init__(self, k, exclude):
+
+        self.k = k
+        self.seen = set(np.asarray(exclude, dtype=np.int64).tolist())
+        self.track_ids = []
+        self.scores = []
+        self.sources = []
+
+    def full(self):
+
+        return len(self.track_ids) >= self.k
+
+    def add(self, track_id, score, source):
+        """
+        Добавляет трек (если его ещё нет); возвращает True, когда список заполнен
+        """
+
+        if self.full():
+            return True
+
+        track_id = int(track_id)
+        if track_id not in self.seen:
+            self.seen.add(track_id)
+            self.track_ids.append(track_id)
+            self.scores.append(float(score))
+            self.sources.append(source)
+
+        return self.full()
+
+    def result(self):
+
+        return self.track_ids, self.scores, self.sources
+
+
+def _interleave(output, sources):
+    """
+    По одному кандидату из каждого источника по очереди; возвращает True, если список заполнен
+    """
+
+    sources = [
+        (source, np.asarray(track_ids).tolist(), np.asarray(scores).tolist())
+        for source, track_ids, scores in sources
+    ]
+    max_length = max((len(track_ids) for _, track_ids, _ in sources), default=0)
+    for i in range(max_length):
+        for source, track_ids, scores in sources:
+            if i < len(track_ids) and output.add(track_ids[i], scores[i], source):
+                return True
+
+    return output.full()
+
+
+def _normalize(scores):
+    """
+    Приводит score источника к отрезку [0, 1] (если все score равны - все равны 1)
+    """
+
+    if len(scores) == 0:
+        return scores
+
+    low, high = scores.min(), scores.max()
+    if high - low <= 0 or not np.isfinite(high - low):
+        return np.ones_like(scores)
+
+    return (scores - low) / (high - low)
@@ -0,0 +1,375 @@
+# Подготовка данных для ранжирующей модели (кандидаты, таргеты, признаки пользователей) по частям.
+#
+# Вместо объединения полных таблиц в памяти (как в ноутбуке) события и кандидаты разбиваются по хэшу
+# user_id на n_partitions частей (pyarrow dataset, папки part=N). Все данные одного пользователя попадают
+# в одну часть, поэтому части обрабатываются независимо и параллельно, а память ограничена размером части:
+#
+#  1. partition - входные parquet-файлы читаются потоком (по батчам) и раскладываются по частям;
+#  2. build - для каждой части: объединение кандидатов ALS и похожих треков (als_score, cnt_score),
+#     top_score из ТОП-рекомендаций, таргет по events_labels, по negatives_per_user случайных негативных
+#     примеров на пользователя с позитивным таргетом (candidates_for_train), кандидаты пользователей
+#     из events_train + events_labels (candidates_to_rank) и признаки пользователей (user_features).
+#
+# Готовые этапы и части при повторном запуске пропускаются (каждая часть пишется через временный файл),
+# если не изменились число частей, входные файлы (путь, размер, время изменения) и параметры построения:
+# разложенная таблица пересчитывается по описанию в её _SUCCESS, результаты - по out_dir/_build.json.
+# Результат - папки candidates_for_train, candidates_to_rank, user_features с файлами part-NNNNN.parquet
+# и ranker_params.json с максимальным score ALS (сервис нормирует на него als_score при ранжировании).
+#
+# python candidates_pipeline.py data --events-train events_train.parquet --events-labels events_labels.parquet \
+#     --als personal_als.parquet --similar similar.parquet --top-popular top_popular.parquet --partitions 64
+
+import argparse
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# входные таблицы, которые раскладываются по частям, и нужные из них колонки
+INPUTS = {
+    "events_train": ["user_id", "track_id", "started_at"],
+    "events_labels": ["user_id", "track_id", "started_at"],
+    "als": ["user_id", "track_id", "score"],
+    "similar": ["user_id", "track_id", "score"],
+}
+OUTPUTS = ("candidates_for_train", "candidates_to_rank", "user_features")
+# параметры признаков, которые нужны сервису вместе с обученной моделью (KEY_RANKER_PARAMS_JSON)
+RANKER_PARAMS = "ranker_params.json"
+
+
+def partition_of(user_ids, n_partitions):
+    """
+    Номер части для каждого user_id (устойчивый хэш, не зависит от запуска)
+    """
+
+    return (pd.util.hash_array(np.asarray(user_ids, dtype=np.int64)) % n_partitions).astype(np.int32)
+
+
+def input_fingerprint(path):
+    """
+    Отпечаток входного файла: если он изменился, готовые части по нему пересчитываются
+    """
+
+    stat = os.stat(path)
+
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _month(started_at):
+
+    return pd.to_datetime(pd.Series(started_at)).dt.month.to_numpy(dtype=np.int16)
+
+
+def partition_input(path, name, out_dir, n_partitions, batch_size=1_000_000):
+    """
+    Потоком (по батчам) раскладывает parquet-файл path по частям в out_dir/partitioned/name/part=N.
+    Возвращает описание (число строк, максимум score, число частей, отпечаток входного файла),
+    которое сохраняется в _SUCCESS; если описание не совпадает с текущим запуском - раскладывает заново
+    """
+
+    target = os.path.join(out_dir, "partitioned", name)
+    success = os.path.join(target, "_SUCCESS")
+    fingerprint = input_fingerprint(path)
+    if os.path.exists(success):
+        with open(success) as f:
+            meta = json.load(f)
+        if meta.get("n_partitions") == n_partitions and meta.get("input") == fingerprint:
+            return meta
+
+    parquet_file = pq.ParquetFile(path)
+    names = parquet_file.schema_arrow.names
+    columns = [column for column in INPUTS[name] if column in names]
+    # для событий нужен только месяц прослушивания (started_at_month, как в ноутбуке)
+    if "started_at_month" in names and "started_at" in columns:
+        columns[columns.index("started_at")] = "started_at_month"
+
+    # пишем во временную папку и переименовываем: недописанный этап не считается готовым
+    tmp = f"{target}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    meta = {"rows": 0, "max_score": None, "n_partitions": n_partitions, "input": fingerprint}
+    writers = {}
+    try:
+        for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+            # метаданные pandas (индекс исходной таблицы) в части не переносим
+            table = pa.Table.from_batches([batch]).replace_schema_metadata(None)
+            if "started_at" in table.column_names:
+                months = _month(table.column("started_at").to_pandas())
+                table = table.drop(["started_at"]).append_column("started_at_month", pa.array(months))
+            if "score" in table.column_names and len(table):
+                batch_max = float(np.nanmax(table.column("score").to_numpy()))
+                meta["max_score"] = max(batch_max, meta["max_score"] or batch_max)
+            meta["rows"] += len(table)
+
+            # строки батча группируются по частям одной сортировкой
+            parts = partition_of(table.column("user_id").to_numpy(), n_partitions)
+            order = np.argsort(parts, kind="stable")
+            table = table.take(order)
+            parts = parts[order]
+            bounds = np.flatnonzero(np.diff(parts)) + 1
+            for start, stop in zip(np.r_[0, bounds], np.r_[bounds, len(parts)]):
+                if start == stop:
+                    continue
+                part = int(parts[start])
+                if part not in writers:
+                    os.makedirs(os.path.join(tmp, f"part={part}"))
+                    writers[part] = pq.ParquetWriter(
+                        os.path.join(tmp, f"part={part}", "data.parquet"), table.schema
+                    )
+                writers[part].write_table(table.slice(start, stop - start))
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(tmp, target)
+    with open(success, "w") as f:
+        json.dump(meta, f)
+
+    return meta
+
+
+def read_partition(out_dir, name, part, columns):
+    """
+    Часть part входной таблицы name (пустая таблица с колонками columns, если строк нет)
+    """
+
+    path = os.path.join(out_dir, "partitioned", name, f"part={part}", "data.parquet")
+    if not os.path.exists(path):
+        return pd.DataFrame({column: pd.Series(dtype=np.float64) for column in columns})
+
+    return pd.read_parquet(path, columns=columns)
+
+
+def _segment_starts(sorted_keys):
+    """
+    Для отсортированного массива ключей - позиция каждого элемента внутри своей группы равных ключей
+    """
+
+    if len(sorted_keys) == 0:
+        return np.zeros(0, dtype=np.int64)
+    new_group = np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]
+    group_start = np.maximum.accumulate(np.where(new_group, np.arange(len(sorted_keys)), 0))
+
+    return np.arange(len(sorted_keys)) - group_start
+
+
+def _keys(user_ids, track_ids):
+    """
+    Пары (user_id, track_id) в виде MultiIndex - для векторной проверки вхождения пар
+    """
+
+    return pd.MultiIndex.from_arrays(
+        [np.asarray(user_ids, dtype=np.int64), np.asarray(track_ids, dtype=np.int64)]
+    )
+
+
+def user_aggregates(events):
+    """
+    Частичные агрегаты событий по пользователю: первый и последний месяц, число событий
+    """
+
+    return events.groupby("user_id").agg(
+        month_min=("started_at_month", "min"),
+        month_max=("started_at_month", "max"),
+        tracks_used=("track_id", "count"),
+    )
+
+
+def features_from_aggregates(*aggregates):
+    """
+    Признаки пользователей (как get_user_features в ноутбуке) из объединённых частичных агрегатов
+    нескольких наборов событий - без объединения самих событий
+    """
+
+    combined = pd.concat(aggregates).groupby(level=0).agg(
+        month_min=("month_min", "min"),
+        month_max=("month_max", "max"),
+        tracks_used=("tracks_used", "sum"),
+    )
+    user_features = pd.DataFrame(index=combined.index)
+    user_features["using_months"] = combined["month_max"] - combined["month_min"] + 1
+    user_features["tracks_used"] = combined["tracks_used"]
+    user_features["tracks_per_month"] = (
+        user_features["tracks_used"] / user_features["using_months"]
+    ).round(3)
+
+    return user_features
+
+
+def build_partition(out_dir, part, top_popular, als_max_score, negatives_per_user=4, random_state=0):
+    """
+    Строит candidates_for_train, candidates_to_rank и user_features для одной части.
+    Возвращает число строк каждого результата
+    """
+
+    paths = {name: os.path.join(out_dir, name, f"part-{part:05d}.parquet") for name in OUTPUTS}
+    if all(os.path.exists(path) for path in paths.values()):
+        return {name: pq.ParquetFile(path).metadata.num_rows for name, path in paths.items()}
+
+    events_columns = ["user_id", "track_id", "started_at_month"]
+    events_train = read_partition(out_dir, "events_train", part, events_columns)
+    events_labels = read_partition(out_dir, "events_labels", part, events_columns)
+    als = read_partition(out_dir, "als", part, ["user_id", "track_id", "score"])
+    similar = read_partition(out_dir, "similar", part, ["user_id", "track_id", "score"])
+
+    # кандидаты: объединение ALS (score нормирован на максимум по всем данным) и похожих треков
+    als["score"] = als["score"] / (als_max_score or 1.0)
+    candidates = pd.merge(
+        als.rename(columns={"score": "als_score"}),
+        similar.rename(columns={"score": "cnt_score"}),
+        on=["user_id", "track_id"],
+        how="outer",
+    )
+    candidates = candidates.astype({"user_id": np.int64, "track_id": np.int64})
+
+    # top_score - признак трека (взвешенная популярность), NaN для треков не из ТОП
+    candidates["top_score"] = top_popular.reindex(candidates["track_id"].to_numpy()).to_numpy()
+
+    # таргет: 1, если пользователь слушал трек в events_labels
+    candidates["target"] = (
+        _keys(candidates["user_id"], candidates["track_id"])
+        .isin(_keys(events_labels["user_id"], events_labels["track_id"]))
+        .astype(np.int64)
+    )
+
+    # для обучения - пользователи хотя бы с одним позитивным таргетом: все позитивные примеры
+    # и по negatives_per_user случайных негативных (случайный ключ сортировки внутри пользователя)
+    positive_users = candidates.loc[candidates["target"] == 1, "user_id"].unique()
+    negatives = candidates[(candidates["target"] == 0) & candidates["user_id"].isin(positive_users)]
+    rng = np.random.default_rng([random_state, part])
+    order = np.lexsort((rng.random(len(negatives)), negatives["user_id"].to_numpy()))
+    negatives = negatives.iloc[order]
+    negatives = negatives[_segment_starts(negatives["user_id"].to_numpy()) < negatives_per_user]
+    candidates_for_train = pd.concat([candidates[candidates["target"] == 1], negatives])
+
+    # признаки: для обучения - по events_train, для инференса - по events_train + events_labels
+    train_aggregates = user_aggregates(events_train)
+    labels_aggregates = user_aggregates(events_labels)
+    user_features_for_train = features_from_aggregates(train_aggregates)
+    user_features = features_from_aggregates(train_aggregates, labels_aggregates)
+
+    candidates_for_train = candidates_for_train.merge(
+        user_features_for_train, left_on="user_id", right_index=True, how="left"
+    )
+    candidates_to_rank = candidates[candidates["user_id"].isin(user_features.index)].merge(
+        user_features, left_on="user_id", right_index=True, how="left"
+    )
+
+    results = {
+        "candidates_for_train": candidates_for_train,
+        "candidates_to_rank": candidates_to_rank,
+        "user_features": user_features.reset_index(),
+    }
+    for name, frame in results.items():
+        os.makedirs(os.path.dirname(paths[name]), exist_ok=True)
+        frame.to_parquet(f"{paths[name]}.tmp", index=False)
+        os.replace(f"{paths[name]}.tmp", paths[name])
+
+    return {name: len(frame) for name, frame in results.items()}
+
+
+def run_pipeline(
+    out_dir,
+    inputs,
+    top_popular_path,
+    n_partitions=64,
+    negatives_per_user=4,
+    n_jobs=None,
+    random_state=0,
+):
+    """
+    Выполняет оба этапа. inputs - пути к входным таблицам по именам из INPUTS.
+    Возвращает число строк каждого результата
+    """
+
+    meta = {
+        name: partition_input(path, name, out_dir, n_partitions) for name, path in inputs.items()
+    }
+
+    # готовые части результатов годятся, только если они построены с теми же входами и параметрами
+    build = {
+        "n_partitions": n_partitions,
+        "negatives_per_user": negatives_per_user,
+        "random_state": random_state,
+        "inputs": {name: meta[name]["input"] for name in sorted(meta)},
+        "top_popular": input_fingerprint(top_popular_path),
+    }
+    build_path = os.path.join(out_dir, "_build.json")
+    saved = None
+    if os.path.exists(build_path):
+        with open(build_path) as f:
+            saved = json.load(f)
+    if saved != build:
+        for name in OUTPUTS:
+            shutil.rmtree(os.path.join(out_dir, name), ignore_errors=True)
+        with open(f"{build_path}.tmp", "w") as f:
+            json.dump(build, f, indent=2)
+        os.replace(f"{build_path}.tmp", build_path)
+
+    ranker_params_path = os.path.join(out_dir, RANKER_PARAMS)
+    with open(f"{ranker_params_path}.tmp", "w") as f:
+        json.dump({"als_max_score": meta["als"]["max_score"] or 1.0}, f, indent=2)
+    os.replace(f"{ranker_params_path}.tmp", ranker_params_path)
+
+    top_popular = pd.read_parquet(top_popular_path, columns=["track_id", "popularity_weighted"])
+    top_popular = top_popular.set_index("track_id")["popularity_weighted"]
+    top_popular = top_popular[~top_popular.index.duplicated()]
+
+    with ProcessPoolExecutor(max_workers=n_jobs or os.cpu_count()) as executor:
+        futures = [
+            executor.submit(
+                build_partition,
+                out_dir,
+                part,
+                top_popular,
+                meta["als"]["max_score"],
+                negatives_per_user,
+                random_state,
+            )
+            for part in range(n_partitions)
+        ]
+        rows = dict.fromkeys(OUTPUTS, 0)
+        for future in futures:
+            for name, count in future.result().items():
+                rows[name] += count
+
+    return rows
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Кандидаты и признаки для ранжирующей модели по частям")
+    parser.add_argument("out_dir", help="папка для частей и результатов")
+    parser.add_argument("--events-train", required=True)
+    parser.add_argument("--events-labels", required=True)
+    parser.add_argument("--als", required=True, help="персональные рекомендации (personal_als.parquet)")
+    parser.add_argument("--similar", required=True, help="похожие треки (user_id, track_id, score)")
+    parser.add_argument("--top-popular", required=True)
+    parser.add_argument("--partitions", type=int, default=64)
+    parser.add_argument("--negatives", type=int, default=4, help="негативных примеров на пользователя")
+    parser.add_argument("--jobs", type=int, default=None, help="число процессов (по умолчанию - все ядра)")
+    parser.add_argument("--random-state", type=int, default=0)
+    args = parser.parse_args()
+
+    rows = run_pipeline(
+        args.out_dir,
+        {
+            "events_train": args.events_train,
+            "events_labels": args.events_labels,
+            "als": args.als,
+            "similar": args.similar,
+        },
+        args.top_popular,
+        n_partitions=args.partitions,
+        negatives_per_user=args.negatives,
+        n_jobs=args.jobs,
+        random_state=args.random_state,
+    )
+    for name, count in rows.items():
+        print(f"{name}: {count} rows in {os.path.join(args.out_dir, name)}")
@@ -0,0 +1,250 @@
+# Оффлайн-расчёт контентных рекомендаций (по жанрам) для всех пользователей.
+#
+# Матрица трек x жанр строится один раз (жанры треков разворачиваются в плоский массив и кодируются),
+# строки взвешиваются популярностью жанра и нормируются (как get_item2genre_matrix в ноутбуке).
+# Профили всех пользователей по жанрам получаются одним разреженным произведением
+# (пользователь x трек, веса popularity_weighted) @ (трек x жанр). Дальше пользователи обрабатываются
+# частями в нескольких процессах: косинусная близость части профилей со всеми треками и выбор k лучших
+# через argpartition. Результат записывается в content.parquet с той же схемой, что personal_als.parquet
+# (user_id, track_id, score), строки пользователя - по убыванию score.
+#
+# python content_recs.py items.parquet events_train.parquet content.parquet --k 100 --jobs 4
+
+import argparse
+import os
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import scipy.sparse
+
+# ограничение памяти на матрицу scores одной части пользователей
+CHUNK_BYTES = 256 * 1024**2
+
+SCHEMA = pa.schema([("user_id", pa.int64()), ("track_id", pa.int64()), ("score", pa.float32())])
+
+
+def _normalize_rows(matrix, norm):
+    """
+    Делит строки разреженной матрицы на их норму ("l1" или "l2"); пустые строки остаются нулевыми
+    """
+
+    matrix = scipy.sparse.csr_matrix(matrix, dtype=np.float32)
+    if norm == "l1":
+        norms = np.asarray(abs(matrix).sum(axis=1)).ravel()
+    else:
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+
+    return scipy.sparse.csr_matrix(scipy.sparse.diags(1.0 / norms) @ matrix, dtype=np.float32)
+
+
+def item_genre_matrix(items):
+    """
+    Матрица трек x жанр (строка - track_id_enc): вес жанра - число треков с этим жанром,
+    строка нормирована на сумму 1. Возвращает (матрица, названия жанров по номеру столбца)
+    """
+
+    n_items = int(items["track_id_enc"].max()) + 1 if len(items) else 0
+    items = items[["track_id_enc", "genre_name"]].explode("genre_name").dropna()
+    genre_codes, genres = pd.factorize(items["genre_name"])
+    votes = np.bincount(genre_codes, minlength=len(genres)).astype(np.float32)
+
+    matrix = scipy.sparse.csr_matrix(
+        (votes[genre_codes], (items["track_id_enc"].to_numpy(), genre_codes)),
+        shape=(n_items, len(genres)),
+    )
+
+    return _normalize_rows(matrix, "l1"), np.asarray(genres)
+
+
+def user_item_matrix(events, track_index, n_items, weight="popularity_weighted"):
+    """
+    Разреженная матрица пользователь x трек из событий (веса - колонка weight, если она есть, иначе 1);
+    столбцов n_items - по числу строк матрицы трек x жанр (в нумерации track_id_enc бывают пропуски).
+    Треки, которых нет в track_index, пропускаются. Возвращает (матрица, user_id по номеру строки)
+    """
+
+    track_ids_enc = track_index.reindex(events["track_id"].to_numpy()).to_numpy()
+    known = ~np.isnan(track_ids_enc)
+    user_codes, user_ids = pd.factorize(events["user_id"].to_numpy()[known], sort=True)
+    weights = (
+        events[weight].to_numpy(dtype=np.float32)[known]
+        if weight in events
+        else np.ones(known.sum(), dtype=np.float32)
+    )
+
+    matrix = scipy.sparse.csr_matrix(
+        (weights, (user_codes, track_ids_enc[known].astype(np.int64))),
+        shape=(len(user_ids), n_items),
+    )
+    matrix.sum_duplicates()
+
+    return matrix, np.asarray(user_ids)
+
+
+def _save_csr(path, matrix):
+
+    np.save(f"{path}_data.npy", matrix.data)
+    np.save(f"{path}_indices.npy", matrix.indices)
+    np.save(f"{path}_indptr.npy", matrix.indptr)
+
+    return path, matrix.shape
+
+
+def _load_csr(path, shape):
+
+    return scipy.sparse.csr_matrix(
+        tuple(np.load(f"{path}_{name}.npy", mmap_mode="r") for name in ("data", "indices", "indptr")),
+        shape=shape,
+    )
+
+
+# данные процесса-исполнителя: матрицы открываются через memory map один раз
+_worker = {}
+
+
+def _init_worker(items_genres, profiles, listened, track_ids_path, user_ids_path):
+
+    # в каждом процессе BLAS в один поток, параллельность - за счёт процессов
+    try:
+        from threadpoolctl import threadpool_limits
+
+        threadpool_limits(1)
+    except ImportError:
+        pass
+
+    _worker["items_genres_t"] = _load_csr(*items_genres).T.tocsr()
+    _worker["profiles"] = _load_csr(*profiles)
+    _worker["listened"] = _load_csr(*listened) if listened else None
+    _worker["track_ids"] = np.load(track_ids_path, mmap_mode="r")
+    # номера track_id_enc, которых нет в items (пропуски в нумерации, track_id = -1)
+    _worker["missing"] = np.flatnonzero(_worker["track_ids"] < 0)
+    _worker["user_ids"] = np.load(user_ids_path, mmap_mode="r")
+
+
+def _score_chunk(start, stop, k):
+    """
+    Для пользователей с номерами [start, stop) возвращает k лучших треков по косинусной близости
+    профиля пользователя и жанров трека (плоские массивы user_id, track_id, score)
+    """
+
+    profiles = _worker["profiles"][start:stop].toarray()
+    scores = np.asarray(profiles @ _worker["items_genres_t"], dtype=np.float32)
+
+    # несуществующие треки и уже прослушанные треки не рекомендуем
+    scores[:, _worker["missing"]] = -np.inf
+    listened = _worker["listened"]
+    if listened is not None:
+        chunk = listened[start:stop]
+        rows = np.repeat(np.arange(stop - start), np.diff(chunk.indptr))
+        scores[rows, chunk.indices] = -np.inf
+
+    k = min(k, scores.shape[1])
+    top = np.argpartition(scores, -k, axis=1)[:, -k:]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind="stable")
+    top = np.take_along_axis(top, order, axis=1).ravel()
+    top_scores = np.take_along_axis(top_scores, order, axis=1).ravel()
+
+    user_ids = np.repeat(_worker["user_ids"][start:stop], k)
+    found = np.isfinite(top_scores) & (_worker["track_ids"][top] >= 0)
+
+    return user_ids[found], _worker["track_ids"][top[found]], top_scores[found]
+
+
+def build_content_recs(
+    items, events, out_path, k=100, exclude_listened=True, n_jobs=None, chunk_bytes=CHUNK_BYTES
+):
+    """
+    Считает по k контентных рекомендаций для каждого пользователя из events и записывает их в out_path.
+    items - колонки track_id, track_id_enc, genre_name; events - user_id, track_id (и popularity_weighted).
+    Возвращает число записанных строк
+    """
+
+    items = items.sort_values("track_id_enc")
+    items_genres, _ = item_genre_matrix(items)
+    track_ids = np.full(items_genres.shape[0], -1, dtype=np.int64)
+    track_ids[items["track_id_enc"].to_numpy()] = items["track_id"].to_numpy()
+    track_index = pd.Series(items["track_id_enc"].to_numpy(), index=items["track_id"].to_numpy())
+
+    # профили всех пользователей одним произведением; в косинусной близости важны только направления,
+    # поэтому сумма вместо среднего, а строки обеих матриц нормируются
+    user_items, user_ids = user_item_matrix(events, track_index, items_genres.shape[0])
+    profiles = _normalize_rows(user_items @ items_genres, "l2")
+    items_genres = _normalize_rows(items_genres, "l2")
+
+    n_items = items_genres.shape[0]
+    chunk_size = max(1, chunk_bytes // (4 * n_items))
+    chunks = [
+        (start, min(start + chunk_size, len(user_ids)))
+        for start in range(0, len(user_ids), chunk_size)
+    ]
+    n_jobs = n_jobs or os.cpu_count()
+
+    rows = 0
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # процессы читают матрицы из общих файлов через memory map, а не получают копию
+        initargs = (
+            _save_csr(os.path.join(tmp_dir, "items_genres"), items_genres),
+            _save_csr(os.path.join(tmp_dir, "profiles"), profiles),
+            _save_csr(os.path.join(tmp_dir, "listened"), user_items) if exclude_listened else None,
+            os.path.join(tmp_dir, "track_ids.npy"),
+            os.path.join(tmp_dir, "user_ids.npy"),
+        )
+        np.save(initargs[3], track_ids)
+        np.save(initargs[4], user_ids.astype(np.int64))
+
+        # части записываются в порядке пользователей; в работе не больше 2 * n_jobs частей,
+        # поэтому в памяти одновременно только несколько частей результата
+        with pq.ParquetWriter(out_path, SCHEMA) as writer:
+
+            def write(future):
+                user_chunk, track_chunk, score_chunk = future.result()
+                writer.write_table(pa.table([user_chunk, track_chunk, score_chunk], schema=SCHEMA))
+                return len(user_chunk)
+
+            with ProcessPoolExecutor(
+                max_workers=n_jobs, initializer=_init_worker, initargs=initargs
+            ) as executor:
+                pending = deque()
+                for start, stop in chunks:
+                    pending.append(executor.submit(_score_chunk, start, stop, k))
+                    if len(pending) >= 2 * n_jobs:
+                        rows += write(pending.popleft())
+                while pending:
+                    rows += write(pending.popleft())
+
+    return rows
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Контентные рекомендации по жанрам для всех пользователей")
+    parser.add_argument("items_path", help="путь к items.parquet")
+    parser.add_argument("events_path", help="события пользователей (user_id, track_id, popularity_weighted)")
+    parser.add_argument("out_path", help="путь к результату (content.parquet)")
+    parser.add_argument("--k", type=int, default=100)
+    parser.add_argument("--keep-listened", action="store_true", help="не исключать прослушанные треки")
+    parser.add_argument("--jobs", type=int, default=None, help="число процессов (по умолчанию - все ядра)")
+    args = parser.parse_args()
+
+    items = pd.read_parquet(args.items_path, columns=["track_id", "track_id_enc", "genre_name"])
+    columns = pq.read_schema(args.events_path).names
+    events = pd.read_parquet(
+        args.events_path,
+        columns=[name for name in ("user_id", "track_id", "popularity_weighted") if name in columns],
+    )
+    rows = build_content_recs(
+        items,
+        events,
+        args.out_path,
+        k=args.k,
+        exclude_listened=not args.keep_listened,
+        n_jobs=args.jobs,
+    )
+    print(f"Saved {rows} rows to {args.out_path}")
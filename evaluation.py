@@ -0,0 +1,274 @@
+# Оффлайн-оценка качества рекомендаций: NDCG@k, precision@k, recall@k, hit rate@k, coverage@k и novelty@k.
+#
+# Рекомендации и тестовые события переводятся в плоские массивы, отсортированные по пользователю
+# (и по убыванию score внутри пользователя). Метрики всех пользователей считаются одним векторным
+# проходом сразу для нескольких k: релевантность каждой рекомендации - проверка вхождения пары
+# (пользователь, трек) в тестовые события, суммы по пользователям - np.bincount по номеру пользователя.
+# Пользователи могут обрабатываться частями в нескольких процессах.
+#
+# Оцениваются (и входят в NDCG, precision, recall, hit rate и novelty) только пользователи, у которых есть
+# и рекомендации, и тестовые события; из тестовых событий убираются треки, которых не было в events_train;
+# precision - доля релевантных среди показанных рекомендаций; novelty - доля рекомендаций, которые пользователь
+# ещё не слушал в events_train; coverage - доля треков каталога, попавших в первые k рекомендаций всех
+# пользователей (как в ноутбуке - по всем рекомендациям, а не только по оцениваемым пользователям).
+#
+# NDCG@k - стандартный: DCG первых k рекомендаций, делённый на идеальный DCG@k по всем тестовым трекам
+# пользователя (gain 1 или, если задана колонка relevance тестовых событий, сумма её значений по событиям пары
+# (пользователь, трек)). Это совпадает с sklearn.metrics.ndcg_score по всем трекам каталога. В ноутбуке NDCG@5
+# считается иначе и с этим модулем не сравним: ndcg_score только по рекомендациям, попавшим в тест (gain -
+# popularity_weighted_test, порядок - score), поэтому он оценивает лишь порядок угаданных треков, а пользователи
+# меньше чем с двумя угаданными треками получают NaN и не входят в среднее.
+#
+# python evaluation.py recommendations.parquet events_test_2.parquet --train events_train.parquet \
+#     --items items.parquet --k 5 10 100 --jobs 4 [--relevance listens]
+
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+METRICS = ("ndcg", "precision", "recall", "hit_rate", "novelty")
+
+
+def _pair_keys(user_codes, track_codes, n_tracks):
+    """
+    Пара (номер пользователя, номер трека) одним числом int64
+    """
+
+    return user_codes.astype(np.int64) * n_tracks + track_codes.astype(np.int64)
+
+
+def _discounts(n):
+    """
+    Скидки DCG для позиций 0..n-1
+    """
+
+    return 1.0 / np.log2(np.arange(n) + 2.0)
+
+
+def _ideal_dcg(test_users, test_gains, n_users, ks):
+    """
+    Идеальный DCG@k каждого пользователя: его gain по убыванию на первых k позициях.
+    Возвращает матрицу n_users x len(ks)
+    """
+
+    order = np.lexsort((-test_gains, test_users))
+    users = test_users[order]
+    gains = test_gains[order]
+    positions = np.arange(len(users)) - np.searchsorted(users, users)
+    discounts = _discounts(max(ks))
+
+    ideal = np.zeros((n_users, len(ks)))
+    for column, k in enumerate(ks):
+        top = positions < k
+        ideal[:, column] = np.bincount(
+            users[top], weights=gains[top] * discounts[positions[top]], minlength=n_users
+        )
+
+    return ideal
+
+
+def _chunk_metrics(
+    rec_users, rec_ranks, rec_relevant, rec_gains, rec_read, n_relevant, ideal_dcg, user_start, ks
+):
+    """
+    Метрики пользователей одной части: rec_* - рекомендации части (отсортированы по пользователю и rank),
+    rec_gains - gain рекомендации для NDCG (0 у нерелевантных), номера пользователей отсчитываются
+    от user_start, n_relevant и ideal_dcg - число тестовых треков и идеальный DCG@k пользователей части.
+    Возвращает {"<метрика>@<k>": массив по пользователям части}
+    """
+
+    n_users = len(n_relevant)
+    users = rec_users - user_start
+    discounts = _discounts(max(ks))
+
+    result = {}
+    for column, k in enumerate(ks):
+        shown = rec_ranks < k
+        n_shown = np.bincount(users[shown], minlength=n_users)
+        hits = np.bincount(users[shown & rec_relevant], minlength=n_users)
+        dcg = np.bincount(
+            users[shown & rec_relevant],
+            weights=rec_gains[shown & rec_relevant] * discounts[rec_ranks[shown & rec_relevant]],
+            minlength=n_users,
+        )
+
+        # у пользователя, все тестовые события которого с нулевым весом, идеального DCG нет - NDCG 0
+        ideal = ideal_dcg[:, column]
+        result[f"ndcg@{k}"] = np.divide(dcg, ideal, out=np.zeros(n_users), where=ideal > 0)
+        result[f"precision@{k}"] = hits / np.maximum(n_shown, 1)
+        result[f"recall@{k}"] = hits / n_relevant
+        result[f"hit_rate@{k}"] = (hits > 0).astype(np.float64)
+        if rec_read is not None:
+            read = np.bincount(users[shown & rec_read], minlength=n_users)
+            result[f"novelty@{k}"] = 1.0 - read / np.maximum(n_shown, 1)
+
+    return result
+
+
+def evaluate(
+    recs,
+    events_test,
+    ks=(5, 10, 100),
+    events_train=None,
+    n_items=None,
+    n_jobs=1,
+    chunk_users=100_000,
+    relevance=None,
+):
+    """
+    Считает метрики рекомендаций recs (user_id, track_id, score) по тестовым событиям events_test
+    (user_id, track_id) сразу для всех k из ks.
+
+    events_train - события обучения (для фильтра тестовых треков и novelty), n_items - размер каталога
+    (для coverage; по умолчанию - число треков в events_train), relevance - колонка events_test с весом
+    события для NDCG (по умолчанию NDCG бинарный).
+    Возвращает (средние метрики - словарь, метрики по пользователям - DataFrame с индексом user_id)
+    """
+
+    ks = sorted(set(ks))
+    if events_train is not None:
+        events_test = events_test[events_test["track_id"].isin(events_train["track_id"].unique())]
+        if n_items is None:
+            n_items = events_train["track_id"].nunique()
+
+    # coverage - по рекомендациям всех пользователей, в том числе без тестовых событий
+    coverage = {}
+    if n_items:
+        all_users, _ = pd.factorize(recs["user_id"])
+        all_order = np.lexsort((-recs["score"].to_numpy(), all_users))
+        all_users = all_users[all_order]
+        all_ranks = np.arange(len(all_users)) - np.searchsorted(all_users, all_users)
+        all_tracks = recs["track_id"].to_numpy()[all_order]
+        for k in ks:
+            coverage[f"coverage@{k}"] = len(np.unique(all_tracks[all_ranks < k])) / n_items
+
+    # только общие пользователи; номер пользователя - позиция в отсортированном массиве user_id
+    user_ids = np.intersect1d(recs["user_id"].unique(), events_test["user_id"].unique())
+    recs = recs[recs["user_id"].isin(user_ids)]
+    events_test = events_test[events_test["user_id"].isin(user_ids)]
+
+    # номера треков общие для рекомендаций, тестовых событий и событий обучения
+    track_arrays = [recs["track_id"].to_numpy(), events_test["track_id"].to_numpy()]
+    if events_train is not None:
+        train_mask = events_train["user_id"].isin(user_ids).to_numpy()
+        track_arrays.append(events_train["track_id"].to_numpy()[train_mask])
+    track_codes, track_ids = pd.factorize(np.concatenate(track_arrays))
+    n_tracks = max(len(track_ids), 1)
+    rec_tracks = track_codes[: len(recs)]
+    test_tracks = track_codes[len(recs) : len(recs) + len(events_test)]
+
+    # рекомендации по пользователю и убыванию score; rank - позиция внутри пользователя
+    rec_users = np.searchsorted(user_ids, recs["user_id"].to_numpy())
+    order = np.lexsort((-recs["score"].to_numpy(), rec_users))
+    rec_users = rec_users[order]
+    rec_tracks = rec_tracks[order]
+    rec_ranks = np.arange(len(rec_users)) - np.searchsorted(rec_users, rec_users)
+
+    # релевантные пары (без повторных прослушиваний) и их gain: 1 или сумма весов relevance событий пары
+    test_users = np.searchsorted(user_ids, events_test["user_id"].to_numpy())
+    test_keys, test_inverse = np.unique(
+        _pair_keys(test_users, test_tracks, n_tracks), return_inverse=True
+    )
+    if relevance is None:
+        test_gains = np.ones(len(test_keys))
+    else:
+        test_gains = np.bincount(
+            test_inverse,
+            weights=events_test[relevance].to_numpy(dtype=np.float64),
+            minlength=len(test_keys),
+        )
+    rec_keys = _pair_keys(rec_users, rec_tracks, n_tracks)
+    # пользователи общие, поэтому без тестовых пар нет и рекомендаций
+    rec_positions = np.searchsorted(test_keys, rec_keys).clip(max=max(len(test_keys) - 1, 0))
+    rec_relevant = test_keys[rec_positions] == rec_keys
+    rec_gains = np.where(rec_relevant, test_gains[rec_positions], 0.0)
+    n_relevant = np.bincount(test_keys // n_tracks, minlength=len(user_ids))
+    ideal_dcg = _ideal_dcg(test_keys // n_tracks, test_gains, len(user_ids), ks)
+
+    rec_read = None
+    if events_train is not None:
+        train_users = np.searchsorted(user_ids, events_train["user_id"].to_numpy()[train_mask])
+        train_tracks = track_codes[len(recs) + len(events_test) :]
+        rec_read = np.isin(rec_keys, _pair_keys(train_users, train_tracks, n_tracks))
+
+    # части по пользователям: границы частей в массиве рекомендаций
+    user_bounds = np.arange(0, len(user_ids) + chunk_users, chunk_users).clip(max=len(user_ids))
+    user_bounds = np.unique(user_bounds)
+    rec_bounds = np.searchsorted(rec_users, user_bounds)
+    chunks = [
+        (
+            rec_users[rec_start:rec_stop],
+            rec_ranks[rec_start:rec_stop],
+            rec_relevant[rec_start:rec_stop],
+            rec_gains[rec_start:rec_stop],
+            None if rec_read is None else rec_read[rec_start:rec_stop],
+            n_relevant[user_start:user_stop],
+            ideal_dcg[user_start:user_stop],
+            user_start,
+            ks,
+        )
+        for user_start, user_stop, rec_start, rec_stop in zip(
+            user_bounds[:-1], user_bounds[1:], rec_bounds[:-1], rec_bounds[1:]
+        )
+    ]
+    if n_jobs == 1 or len(chunks) <= 1:
+        results = [_chunk_metrics(*chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs or os.cpu_count()) as executor:
+            results = list(executor.map(_chunk_metrics, *zip(*chunks)))
+
+    per_user = pd.DataFrame(
+        {name: np.concatenate([result[name] for result in results]) for name in results[0]}
+        if results
+        else {},
+        index=pd.Index(user_ids, name="user_id"),
+    )
+    summary = {name: float(per_user[name].mean()) for name in per_user.columns}
+    summary["users"] = len(user_ids)
+    summary.update(coverage)
+
+    return summary, per_user
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Оффлайн-метрики качества рекомендаций")
+    parser.add_argument("recs_path", help="рекомендации (user_id, track_id, score)")
+    parser.add_argument("test_path", help="тестовые события (user_id, track_id)")
+    parser.add_argument("--train", default=None, help="события обучения (для novelty и фильтра треков)")
+    parser.add_argument("--items", default=None, help="items.parquet (размер каталога для coverage)")
+    parser.add_argument("--score-column", default="score", help="колонка score (например cb_score)")
+    parser.add_argument("--relevance", default=None, help="колонка тестовых событий с весом для NDCG")
+    parser.add_argument("--k", type=int, nargs="+", default=[5, 10, 100])
+    parser.add_argument("--jobs", type=int, default=1, help="число процессов")
+    parser.add_argument("--per-user", default=None, help="куда сохранить метрики по пользователям (parquet)")
+    args = parser.parse_args()
+
+    recs = pd.read_parquet(args.recs_path, columns=["user_id", "track_id", args.score_column])
+    recs = recs.rename(columns={args.score_column: "score"})
+    events_test = pd.read_parquet(
+        args.test_path, columns=["user_id", "track_id"] + ([args.relevance] if args.relevance else [])
+    )
+    events_train = None
+    if args.train:
+        events_train = pd.read_parquet(args.train, columns=["user_id", "track_id"])
+    n_items = None
+    if args.items:
+        n_items = pd.read_parquet(args.items, columns=["track_id"])["track_id"].nunique()
+
+    summary, per_user = evaluate(
+        recs,
+        events_test,
+        ks=args.k,
+        events_train=events_train,
+        n_items=n_items,
+        n_jobs=args.jobs,
+        relevance=args.relevance,
+    )
+    print(json.dumps(summary, indent=2))
+    if args.per_user:
+        per_user.to_parquet(args.per_user)
@@ -0,0 +1,732 @@
+# Event Store - компонент, умеющий сохранять и выдавать последние события пользователя.
+#
+# События каждого пользователя хранятся в кольцевом буфере фиксированного размера в общем
+# numpy-массиве (без отдельных Python-объектов на событие), поэтому put выполняется за O(1).
+# Память ограничена: неактивные дольше ttl пользователи удаляются, а при превышении бюджета
+# удаляются давно не обращавшиеся пользователи (LRU). Пользователи разложены по нескольким
+# независимым частям (stripes) со своими блокировками, чтобы хранилище можно было безопасно
+# использовать из пула потоков. События хранятся в int32; если track_id не помещается в int32,
+# буферы части расширяются до int64 (как CSRRecs выбирает тип по данным). Бюджет общий: число пользователей считается по всему хранилищу,
+# и при его превышении удаляется самый давний пользователь среди всех частей.
+#
+# DurableEventStore дополнительно пишет события в двоичный журнал на диске (с периодическими
+# компактными снимками): события переживают перезапуск и видны всем воркерам на одном хосте.
+
+import fcntl
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger("uvicorn.error")
+
+# примерный расход памяти на пользователя помимо буфера событий: запись в словаре и служебные поля
+USER_OVERHEAD_BYTES = 128
+
+# общий для процесса счётчик меток событий: метка не повторяется, даже если пользователя удалили
+# из хранилища и добавили снова или хранилище пересоздали из снимка (next атомарен под GIL)
+_SEQUENCE = itertools.count(1)
+
+
+class _Stripe:
+    """
+    Часть хранилища со своей блокировкой: пользователи -> номера строк в массиве буферов
+    """
+
+    def __init__(self, max_events_per_user, max_users, dtype):
+
+        self.lock = threading.Lock()
+        self.max_users = max_users  # часть может вырасти до всего бюджета, если в ней все пользователи
+        self.users = OrderedDict()  # user_id -> slot, порядок - от давно не обращавшихся к недавним
+        self.free_slots = []
+        size = min(max_users, 1024)
+        self.buffers = np.zeros((size, max_events_per_user), dtype=dtype)
+        self.heads = np.zeros(size, dtype=np.int32)  # куда будет записано следующее событие
+        self.counts = np.zeros(size, dtype=np.int32)  # сколько событий в буфере
+        self.seqs = np.zeros(size, dtype=np.int64)  # метка последнего события пользователя (из _SEQUENCE)
+        self.last_seen = np.zeros(size, dtype=np.float64)  # время последнего обращения
+        self.next_slot = 0
+
+    def fit(self, item_min, item_max):
+        """
+        Расширяет буферы до int64, если события из [item_min, item_max] не помещаются в их тип
+        """
+
+        info = np.iinfo(self.buffers.dtype)
+        if item_min < info.min or item_max > info.max:
+            self.buffers = self.buffers.astype(np.int64)
+
+    def grow(self):
+        """
+        Увеличивает массивы вдвое (не больше max_users строк)
+        """
+
+        size = min(self.max_users, 2 * len(self.buffers))
+        extra = size - len(self.buffers)
+        self.buffers = np.vstack(
+            [self.buffers, np.zeros((extra, self.buffers.shape[1]), dtype=self.buffers.dtype)]
+        )
+        self.heads = np.concatenate([self.heads, np.zeros(extra, dtype=self.heads.dtype)])
+        self.counts = np.concatenate([self.counts, np.zeros(extra, dtype=self.counts.dtype)])
+        self.seqs = np.concatenate([self.seqs, np.zeros(extra, dtype=self.seqs.dtype)])
+        self.last_seen = np.concatenate(
+            [self.last_seen, np.zeros(extra, dtype=self.last_seen.dtype)]
+        )
+
+
+class EventStore:
+    """
+    Методы:
+
+    put - сохраняет событие пользователя (O(1)).
+    get - возвращает последние k событий пользователя, от новых к старым.
+    seq - возвращает метку последнего события пользователя (меняется с каждым put и никогда не повторяется).
+    stats - выводит статистику по заполненности и удалениям.
+    """
+
+    def __init__(
+        self,
+        max_events_per_user=10,
+        ttl=None,
+        memory_budget=256 * 1024**2,
+        n_stripes=16,
+        dtype=np.int32,
+    ):
+
+        self.max_events_per_user = max_events_per_user
+        self.ttl = ttl  # через сколько секунд без обращений пользователь удаляется (None - не удаляется)
+        self.memory_budget = memory_budget  # ограничение памяти на всё хранилище, байт
+
+        user_bytes = max_events_per_user * np.dtype(dtype).itemsize + USER_OVERHEAD_BYTES
+        self.max_users = max(1, memory_budget // user_bytes)
+        self._stripes = [
+            _Stripe(max_events_per_user, self.max_users, dtype) for _ in range(n_stripes)
+        ]
+        self._users = 0  # число пользователей во всех частях (под _stats_lock)
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "events_put_count": 0,  # счетчик сохранённых событий
+            "users_evicted_ttl_count": 0,  # счетчик удалённых по ttl пользователей
+            "users_evicted_lru_count": 0,  # счетчик удалённых из-за бюджета памяти пользователей
+        }
+
+    def _stripe(self, user_id):
+
+        return self._stripes[hash(user_id) % len(self._stripes)]
+
+    def _count(self, name, value=1):
+
+        with self._stats_lock:
+            self._stats[name] += value
+
+    def _evict_expired(self, stripe, now):
+        """
+        Удаляет пользователей, не обращавшихся дольше ttl (они в начале порядка LRU)
+        """
+
+        if self.ttl is None:
+            return
+
+        evicted = 0
+        while stripe.users:
+            user_id, slot = next(iter(stripe.users.items()))
+            if now - stripe.last_seen[slot] <= self.ttl:
+                break
+            stripe.users.popitem(last=False)
+            stripe.free_slots.append(slot)
+            evicted += 1
+
+        if evicted:
+            with self._stats_lock:
+                self._stats["users_evicted_ttl_count"] += evicted
+                self._users -= evicted
+
+    def _allocate(self, stripe):
+        """
+        Возвращает свободную строку буфера для нового пользователя части stripe
+        """
+
+        if stripe.free_slots:
+            return stripe.free_slots.pop()
+
+        if stripe.next_slot == len(stripe.buffers) and len(stripe.buffers) < stripe.max_users:
+            stripe.grow()
+
+        if stripe.next_slot < len(stripe.buffers):
+            stripe.next_slot += 1
+            return stripe.next_slot - 1
+
+        # в части уже весь бюджет (возможно, пока параллельные put не успели вытеснить лишних) -
+        # место освобождает давний пользователь этой же части
+        _, slot = stripe.users.popitem(last=False)
+        self._count("users_evicted_lru_count")
+        self._count_users(-1)
+
+        return slot
+
+    def _count_users(self, value):
+        """
+        Меняет общее число пользователей; возвращает, превышен ли бюджет
+        """
+
+        with self._stats_lock:
+            self._users += value
+
+            return self._users > self.max_users
+
+    def _evict_lru(self):
+        """
+        Пока пользователей больше бюджета, удаляет самого давнего пользователя среди всех частей.
+        Блокировки частей берутся по одной, поэтому вызывать только без удерживаемой блокировки части
+        """
+
+        while True:
+            with self._stats_lock:
+                if self._users <= self.max_users:
+                    return
+
+            oldest, victim = None, None
+            for stripe in self._stripes:
+                with stripe.lock:
+                    if stripe.users:
+                        last_seen = stripe.last_seen[next(iter(stripe.users.values()))]
+                        if oldest is None or last_seen < oldest:
+                            oldest, victim = last_seen, stripe
+            if victim is None:
+                return
+
+            with victim.lock:
+                # пока блокировка не была взята, часть могли опустошить - тогда ищем заново
+                if not victim.users:
+                    continue
+                _, slot = victim.users.popitem(last=False)
+                victim.free_slots.append(slot)
+            with self._stats_lock:
+                self._stats["users_evicted_lru_count"] += 1
+                self._users -= 1
+
+    def put(self, user_id, item_id):
+        """
+        Сохраняет событие
+        """
+
+        stripe = self._stripe(user_id)
+        now = time.monotonic()
+        over_budget = False
+        with stripe.lock:
+            self._evict_expired(stripe, now)
+            stripe.fit(item_id, item_id)
+
+            slot = stripe.users.get(user_id)
+            if slot is None:
+                slot = self._allocate(stripe)
+                stripe.users[user_id] = slot
+                stripe.heads[slot] = 0
+                stripe.counts[slot] = 0
+                over_budget = self._count_users(1)
+            else:
+                stripe.users.move_to_end(user_id)
+
+            head = stripe.heads[slot]
+            stripe.buffers[slot, head] = item_id
+            stripe.heads[slot] = (head + 1) % self.max_events_per_user
+            stripe.counts[slot] = min(stripe.counts[slot] + 1, self.max_events_per_user)
+            stripe.seqs[slot] = next(_SEQUENCE)
+            stripe.last_seen[slot] = now
+
+        if over_budget:
+            self._evict_lru()
+        self._count("events_put_count")
+
+    def get(self, user_id, k):
+        """
+        Возвращает события для пользователя (не больше k, от новых к старым)
+        """
+
+        stripe = self._stripe(user_id)
+        now = time.monotonic()
+        with stripe.lock:
+            self._evict_expired(stripe, now)
+
+            slot = stripe.users.get(user_id)
+            if slot is None:
+                return []
+
+            stripe.users.move_to_end(user_id)
+            stripe.last_seen[slot] = now
+
+            n = min(k, stripe.counts[slot])
+            positions = (stripe.heads[slot] - 1 - np.arange(n)) % self.max_events_per_user
+
+            return stripe.buffers[slot, positions].tolist()
+
+    def put_many(self, user_ids, item_ids):
+        """
+        Сохраняет пакет событий (в порядке следования) - быстрее, чем put для каждого события:
+        для каждого пользователя в буфер записываются только последние max_events_per_user событий
+        """
+
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        item_ids = np.asarray(item_ids)
+        if len(user_ids) == 0:
+            return
+
+        order = np.argsort(user_ids, kind="stable")
+        unique_user_ids, starts, totals = np.unique(
+            user_ids[order], return_index=True, return_counts=True
+        )
+        item_ids = item_ids[order]
+        item_min, item_max = int(item_ids.min()), int(item_ids.max())
+
+        now = time.monotonic()
+        for user_id, start, total in zip(unique_user_ids.tolist(), starts, totals):
+            events = item_ids[start + max(0, total - self.max_events_per_user) : start + total]
+            stripe = self._stripe(user_id)
+            over_budget = False
+            with stripe.lock:
+                self._evict_expired(stripe, now)
+                stripe.fit(item_min, item_max)
+
+                slot = stripe.users.get(user_id)
+                if slot is None:
+                    slot = self._allocate(stripe)
+                    stripe.users[user_id] = slot
+                    stripe.heads[slot] = 0
+                    stripe.counts[slot] = 0
+                    over_budget = self._count_users(1)
+                else:
+                    stripe.users.move_to_end(user_id)
+
+                n = len(events)
+                positions = (stripe.heads[slot] + np.arange(n)) % self.max_events_per_user
+                stripe.buffers[slot, positions] = events
+                stripe.heads[slot] = (stripe.heads[slot] + n) % self.max_events_per_user
+                stripe.counts[slot] = min(stripe.counts[slot] + n, self.max_events_per_user)
+                stripe.seqs[slot] = next(_SEQUENCE)
+                stripe.last_seen[slot] = now
+
+            if over_budget:
+                self._evict_lru()
+
+        self._count("events_put_count", len(user_ids))
+
+    def dump(self):
+        """
+        Возвращает все сохранённые события в виде плоских массивов (user_ids, offsets, item_ids),
+        события каждого пользователя - от старых к новым
+        """
+
+        user_ids = []
+        lengths = []
+        items = []
+        for stripe in self._stripes:
+            with stripe.lock:
+                for user_id, slot in stripe.users.items():
+                    count = stripe.counts[slot]
+                    positions = (
+                        stripe.heads[slot] - count + np.arange(count)
+                    ) % self.max_events_per_user
+                    user_ids.append(user_id)
+                    lengths.append(count)
+                    items.append(stripe.buffers[slot, positions])
+
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(lengths)
+        item_ids = np.concatenate(items) if items else np.empty(0, dtype=np.int64)
+
+        return np.array(user_ids, dtype=np.int64), offsets, item_ids
+
+    def close(self):
+        """
+        Хранилище в памяти ничего не сохраняет - метод для единого интерфейса с DurableEventStore
+        """
+
+    def seq(self, user_id):
+        """
+        Возвращает метку последнего события пользователя (0, если событий нет).
+        Метки берутся из общего для процесса счётчика и не откатываются при удалении пользователя
+        по ttl/LRU и при восстановлении из снимка, поэтому их можно использовать в ключах кэшей
+        """
+
+        stripe = self._stripe(user_id)
+        with stripe.lock:
+            slot = stripe.users.get(user_id)
+
+            return int(stripe.seqs[slot]) if slot is not None else 0
+
+    def stats(self):
+
+        users = 0
+        events = 0
+        memory_bytes = 0
+        for stripe in self._stripes:
+            with stripe.lock:
+                slots = list(stripe.users.values())
+                users += len(slots)
+                events += int(stripe.counts[slots].sum())
+                memory_bytes += (
+                    stripe.buffers.nbytes
+                    + stripe.heads.nbytes
+                    + stripe.counts.nbytes
+                    + stripe.seqs.nbytes
+                    + stripe.last_seen.nbytes
+                    + len(slots) * USER_OVERHEAD_BYTES
+                )
+
+        with self._stats_lock:
+            return {
+                **self._stats,
+                "events_users": users,
+                "events_stored": events,
+                "events_users_capacity": self.max_users,
+                "events_memory_bytes": memory_bytes,
+            }
+
+
+# Запись журнала событий: пользователь, трек и идентификатор процесса, который записал событие
+RECORD_DTYPE = np.dtype([("user_id", "<i8"), ("item_id", "<i8"), ("origin", "<i8")])
+
+
+class DurableEventStore:
+    """
+    Event Store с журналом на диске, общим для всех процессов (воркеров uvicorn) на одном хосте.
+
+    События хранятся в EventStore в памяти процесса и дописываются в двоичный журнал (log.<gen>)
+    пакетами (group commit) из фонового потока. Этот же поток читает из журнала события, записанные
+    другими процессами. Когда журнал вырастает больше snapshot_bytes, состояние сохраняется
+    в компактный снимок (snapshot.<gen+1>.npz) и начинается новый журнал. При запуске состояние
+    восстанавливается из последнего снимка и журнала после него.
+
+    Методы:
+
+    put - сохраняет событие (сразу видно в этом процессе, в журнал попадает с ближайшей записью пакета).
+    get - возвращает последние k событий пользователя.
+    seq - возвращает метку последнего события пользователя (см. EventStore.seq).
+    flush - записывает накопленные события в журнал и читает новые события других процессов.
+    stats - выводит статистику хранилища и журнала.
+    close - останавливает фоновый поток и записывает оставшиеся события.
+    """
+
+    def __init__(
+        self,
+        path,
+        store=None,
+        flush_interval=0.01,
+        snapshot_bytes=64 * 1024**2,
+        fsync=False,
+    ):
+
+        self.path = path
+        self.flush_interval = flush_interval  # как часто записывать пакет событий, секунд
+        self.snapshot_bytes = snapshot_bytes  # при каком размере журнала делать снимок
+        self.fsync = fsync  # сбрасывать ли журнал на диск после каждой записи пакета
+        self._store = store if store is not None else EventStore()
+        self._origin = random.getrandbits(63)  # идентификатор этого процесса в журнале
+
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        # flock берётся на общий файл блокировки; внутри процесса операции с ним выполняются по одной
+        self._io_lock = threading.Lock()
+        self._gen = 0  # номер журнала, который читает этот процесс
+        self._offset = 0  # сколько байт этого журнала уже прочитано
+        self._stats = {
+            "log_flush_count": 0,  # счетчик записанных пакетов
+            "log_records_written": 0,  # сколько событий записано в журнал этим процессом
+            "log_records_applied": 0,  # сколько событий других процессов прочитано из журнала
+            "log_snapshot_count": 0,  # сколько снимков сделал этот процесс
+        }
+
+        os.makedirs(path, exist_ok=True)
+        self._lock_fd = os.open(os.path.join(path, "lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        self._replay()
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="events-log", daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def max_events_per_user(self):
+
+        return self._store.max_events_per_user
+
+    def _log_path(self, gen):
+
+        return os.path.join(self.path, f"log.{gen:08d}")
+
+    def _snapshot_path(self, gen):
+
+        return os.path.join(self.path, f"snapshot.{gen:08d}.npz")
+
+    def _read_current(self):
+        """
+        Номер текущего журнала (файл CURRENT); при первом запуске создаёт журнал 0
+        """
+
+        current_path = os.path.join(self.path, "CURRENT")
+        if not os.path.exists(current_path):
+            self._write_current(0)
+            open(self._log_path(0), "ab").close()
+
+        with open(current_path) as f:
+            return int(f.read())
+
+    def _write_current(self, gen):
+
+        tmp_path = os.path.join(self.path, f"CURRENT.tmp-{os.getpid()}")
+        with open(tmp_path, "w") as f:
+            f.write(str(gen))
+        os.replace(tmp_path, os.path.join(self.path, "CURRENT"))
+
+    def _flock(self, operation):
+
+        fcntl.flock(self._lock_fd, operation)
+
+    def _load_snapshot(self, gen):
+        """
+        Заменяет состояние в памяти снимком gen (если он есть). Возвращает, с какого байта читать журнал gen:
+        записи до него уже есть в снимке
+        """
+
+        store = self._store
+        # новое состояние собираем в отдельном хранилище с теми же настройками
+        loaded = EventStore(
+            max_events_per_user=store.max_events_per_user,
+            ttl=store.ttl,
+            memory_budget=store.memory_budget,
+            n_stripes=len(store._stripes),
+            dtype=store._stripes[0].buffers.dtype,
+        )
+        log_offset = 0
+        snapshot_path = self._snapshot_path(gen)
+        if os.path.exists(snapshot_path):
+            with np.load(snapshot_path) as data:
+                user_ids = np.repeat(data["user_ids"], np.diff(data["offsets"]))
+                loaded.put_many(user_ids, data["item_ids"])
+                if "log_offset" in data.files:
+                    log_offset = int(data["log_offset"])
+
+        # события этого процесса, ещё не попавшие в журнал, не должны потеряться; put пишет в хранилище
+        # и в _pending под той же блокировкой, поэтому каждое событие попадает в новое хранилище ровно раз
+        with self._pending_lock:
+            if self._pending:
+                user_ids, item_ids = zip(*self._pending)
+                loaded.put_many(user_ids, item_ids)
+            self._store = loaded
+
+        return log_offset
+
+    def _read_log(self, gen, offset):
+        """
+        Читает из журнала gen целые записи начиная с offset, применяет чужие события, возвращает новый offset
+        (вызывается под flock)
+        """
+
+        log_path = self._log_path(gen)
+        if not os.path.exists(log_path):
+            return offset
+
+        with open(log_path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+
+        n = len(data) // RECORD_DTYPE.itemsize
+        if len(data) % RECORD_DTYPE.itemsize:
+            # под flock пакеты дописываются целиком, поэтому неполная запись в конце осталась от процесса,
+            # упавшего во время записи: обрезаем её, иначе следующие записи прочитаются со сдвигом
+            end = offset + n * RECORD_DTYPE.itemsize
+            logger.warning(f"Truncating torn record at {log_path}:{end}")
+            os.truncate(log_path, end)
+        records = np.frombuffer(data, dtype=RECORD_DTYPE, count=n)
+        records = records[records["origin"] != self._origin]
+        self._store.put_many(records["user_id"], records["item_id"])
+        self._stats["log_records_applied"] += len(records)
+
+        return offset + n * RECORD_DTYPE.itemsize
+
+    def _catch_up_locked(self):
+        """
+        Дочитывает журнал (вызывается под flock)
+        """
+
+        current = self._read_current()
+        if current == self._gen + 1:
+            # журнал сменился: дочитываем старый (он больше не пополняется) и переходим на новый
+            self._read_log(self._gen, self._offset)
+            self._gen, self._offset = current, 0
+        elif current != self._gen:
+            # процесс отстал больше чем на журнал: восстанавливаемся из последнего снимка
+            self._gen, self._offset = current, self._load_snapshot(current)
+
+        self._offset = self._read_log(self._gen, self._offset)
+
+    def _replay(self):
+        """
+        Восстанавливает состояние при запуске: последний снимок и журнал после него
+        """
+
+        start = time.perf_counter()
+        with self._io_lock:
+            self._flock(fcntl.LOCK_EX)
+            try:
+                self._gen = self._read_current()
+                self._offset = self._read_log(self._gen, self._load_snapshot(self._gen))
+            finally:
+                self._flock(fcntl.LOCK_UN)
+
+        logger.info(
+            f"Replayed events log gen {self._gen} in {time.perf_counter() - start:.3f}s"
+        )
+
+    def _write_pending_locked(self):
+        """
+        Записывает накопленные события одним пакетом в текущий журнал (вызывается под flock)
+        """
+
+        with self._pending_lock:
+            batch, self._pending = self._pending, []
+        self._append_locked(self._gen, batch)
+
+    def _append_locked(self, gen, batch):
+        """
+        Дописывает события batch одним пакетом в журнал gen (вызывается под flock)
+        """
+
+        if not batch:
+            return
+
+        records = np.empty(len(batch), dtype=RECORD_DTYPE)
+        records["user_id"] = [user_id for user_id, _ in batch]
+        records["item_id"] = [item_id for _, item_id in batch]
+        records["origin"] = self._origin
+
+        fd = os.open(self._log_path(gen), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, records.tobytes())
+            if self.fsync:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+
+        self._stats["log_flush_count"] += 1
+        self._stats["log_records_written"] += len(batch)
+
+    def _snapshot_locked(self):
+        """
+        Сохраняет состояние в снимок и начинает новый журнал (вызывается под flock, после catch up)
+        """
+
+        gen = self._gen + 1
+        # события, сохранённые после записи последнего пакета, уже есть в снимке, но другие процессы
+        # читают их из журнала: они пишутся в начало нового журнала, а снимок запоминает, сколько байт
+        # журнала уже в нём учтено (при восстановлении из снимка эти записи пропускаются)
+        with self._pending_lock:
+            user_ids, offsets, item_ids = self._store.dump()
+            carried, self._pending = self._pending, []
+        log_offset = len(carried) * RECORD_DTYPE.itemsize
+
+        tmp_path = os.path.join(self.path, f"snapshot.tmp-{os.getpid()}.npz")
+        np.savez(
+            tmp_path, user_ids=user_ids, offsets=offsets, item_ids=item_ids, log_offset=log_offset
+        )
+        os.replace(tmp_path, self._snapshot_path(gen))
+        # новый журнал ещё не текущий и никем не читается - остаток от упавшего процесса отбрасываем
+        open(self._log_path(gen), "wb").close()
+        self._append_locked(gen, carried)
+        self._write_current(gen)
+
+        # старые журналы и снимки больше не нужны (кроме предыдущего журнала - его могут дочитывать)
+        for name in os.listdir(self.path):
+            if name.startswith(("log.", "snapshot.")) and not name.startswith("snapshot.tmp"):
+                file_gen = int(name.split(".")[1])
+                if (name.startswith("log.") and file_gen < gen - 1) or (
+                    name.startswith("snapshot.") and file_gen < gen
+                ):
+                    os.remove(os.path.join(self.path, name))
+
+        self._gen, self._offset = gen, log_offset
+        self._stats["log_snapshot_count"] += 1
+        logger.info(f"Events snapshot gen {gen}: {len(user_ids)} users")
+
+    def flush(self):
+        """
+        Записывает накопленные события и читает события других процессов; при необходимости делает снимок
+        """
+
+        with self._io_lock:
+            self._flock(fcntl.LOCK_EX)
+            try:
+                self._catch_up_locked()
+                self._write_pending_locked()
+                # свои записи уже применены в памяти - просто сдвигаем позицию чтения
+                self._offset = self._read_log(self._gen, self._offset)
+                if self._offset >= self.snapshot_bytes:
+                    self._snapshot_locked()
+            finally:
+                self._flock(fcntl.LOCK_UN)
+
+    def _run(self):
+
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to flush events log")
+
+    def put(self, user_id, item_id):
+        """
+        Сохраняет событие
+        """
+
+        with self._pending_lock:
+            self._store.put(user_id, item_id)
+            self._pending.append((user_id, item_id))
+
+    def put_many(self, user_ids, item_ids):
+        """
+        Сохраняет пакет событий
+        """
+
+        with self._pending_lock:
+            self._store.put_many(user_ids, item_ids)
+            self._pending.extend(zip(np.asarray(user_ids).tolist(), np.asarray(item_ids).tolist()))
+
+    def get(self, user_id, k):
+        """
+        Возвращает события для пользователя (не больше k, от новых к старым)
+        """
+
+        return self._store.get(user_id, k)
+
+    def seq(self, user_id):
+
+        return self._store.seq(user_id)
+
+    def stats(self):
+
+        with self._pending_lock:
+            pending = len(self._pending)
+
+        return {
+            **self._store.stats(),
+            **self._stats,
+            "log_gen": self._gen,
+            "log_offset_bytes": self._offset,
+            "log_pending": pending,
+        }
+
+    def close(self):
+        """
+        Останавливает фоновый поток и записывает оставшиеся события
+        """
+
+        self._stop.set()
+        self._thread.join()
+        self.flush()
+        os.close(self._lock_fd)
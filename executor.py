@@ -0,0 +1,82 @@
+# Выполнение блокирующей (CPU-bound) работы сервиса вне цикла событий asyncio.
+#
+# Поиск рекомендаций, расчёт похожих треков и смешивание выполняются в ограниченном пуле потоков
+# (NumPy/BLAS отпускают GIL), а обработчики запросов только ждут результат. Очередь к пулу ограничена:
+# если она заполнена, новый запрос сразу получает ServiceOverloaded (503), а не ждёт бесконечно.
+
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ServiceOverloaded(Exception):
+    """
+    Пул занят и очередь заполнена - запрос не принят
+    """
+
+
+class Offloader:
+    """
+    Методы:
+
+    run - выполняет функцию в пуле потоков и возвращает результат (с таймаутом).
+    stats - выводит статистику по пулу: занятость, отказы, таймауты.
+    shutdown - останавливает пул.
+    """
+
+    def __init__(self, max_workers=4, max_queue=64, timeout=None):
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="scoring"
+        )
+        self.max_workers = max_workers
+        self.capacity = max_workers + max_queue  # сколько задач может быть в пуле и очереди
+        self.timeout = timeout  # таймаут по умолчанию, секунд
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._stats = {
+            "offload_rejected_count": 0,  # счетчик отказов при заполненной очереди
+            "offload_timeout_count": 0,  # счетчик превышений таймаута
+        }
+
+    def _done(self, _):
+
+        with self._lock:
+            self._in_flight -= 1
+
+    async def run(self, fn, *args, timeout=None, **kwargs):
+        """
+        Выполняет fn(*args, **kwargs) в пуле потоков.
+        ServiceOverloaded - очередь заполнена, asyncio.TimeoutError - превышен таймаут
+        """
+
+        with self._lock:
+            if self._in_flight >= self.capacity:
+                self._stats["offload_rejected_count"] += 1
+                raise ServiceOverloaded()
+            self._in_flight += 1
+
+        # задача занимает место, пока реально не завершится (даже если запрос уже отвалился по таймауту)
+        future = self._executor.submit(functools.partial(fn, *args, **kwargs))
+        future.add_done_callback(self._done)
+
+        try:
+            return await asyncio.wait_for(
+                asyncio.wrap_future(future), timeout if timeout is not None else self.timeout
+            )
+        except asyncio.TimeoutError:
+            self._stats["offload_timeout_count"] += 1
+            raise
+
+    def stats(self):
+
+        return {
+            **self._stats,
+            "offload_in_flight": self._in_flight,
+            "offload_capacity": self.capacity,
+        }
+
+    def shutdown(self):
+
+        self._executor.shutdown(wait=False, cancel_futures=True)
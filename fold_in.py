@@ -0,0 +1,147 @@
+# Персональные рекомендации ALS для пользователей без оффлайн-рекомендаций (fold-in).
+#
+# Вектор пользователя считается на лету по его событиям из Event Store при неизменных факторах треков,
+# как AlternatingLeastSquares.recalculate_user: решается система (YtY + regularization * I + Yt (Cu - I) Y) x = Yt Cu p,
+# где Y - факторы треков, Cu - уверенность (alpha * число прослушиваний трека). YtY считается один раз
+# при загрузке модели, поэтому на пользователя остаётся маленькая система factors x factors.
+# Рекомендации - одно произведение факторов треков на вектор пользователя и выбор k лучших (argpartition).
+# Вектор пользователя кэшируется до его следующего события (ключ - seq из Event Store и версия модели).
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# ограничение памяти на матрицу scores при расчёте для нескольких пользователей
+CHUNK_BYTES = 256 * 1024**2
+
+
+def gramian(item_factors):
+    """
+    YtY - произведение транспонированной матрицы факторов треков на неё саму (factors x factors)
+    """
+
+    item_factors = np.asarray(item_factors, dtype=np.float64)
+
+    return item_factors.T @ item_factors
+
+
+def solve_user_factors(item_factors, item_gramian, items_per_user, regularization, alpha=1.0):
+    """
+    Векторы пользователей по их трекам (items_per_user - список массивов track_id_enc, повторы -
+    несколько прослушиваний). Системы всех пользователей решаются одним вызовом np.linalg.solve.
+    Возвращает матрицу len(items_per_user) x factors (нулевой вектор у пользователя без треков)
+    """
+
+    n_factors = item_gramian.shape[0]
+    A = np.repeat((item_gramian + regularization * np.eye(n_factors))[None], len(items_per_user), axis=0)
+    b = np.zeros((len(items_per_user), n_factors))
+
+    for row, items in enumerate(items_per_user):
+        items, counts = np.unique(np.asarray(items, dtype=np.int64), return_counts=True)
+        confidence = alpha * counts
+        factors = np.asarray(item_factors[items], dtype=np.float64)
+        # YtCuY = YtY + Yt (Cu - I) Y, YtCuPu - сумма факторов треков с весом уверенности
+        A[row] += (factors * (confidence - 1)[:, None]).T @ factors
+        b[row] = confidence @ factors
+
+    return np.linalg.solve(A, b[:, :, None])[:, :, 0].astype(np.float32)
+
+
+def top_k_items(item_factors, user_factors, k, exclude_per_user=None, chunk_bytes=CHUNK_BYTES):
+    """
+    k лучших треков по score = факторы трека . вектор пользователя для каждого пользователя
+    (exclude_per_user - треки, которые не рекомендуем, например уже прослушанные).
+    Возвращает матрицы track_id_enc и scores размером len(user_factors) x k по убыванию score;
+    если k не меньше числа неисключённых треков, в конце строк остаются исключённые со score -inf
+    """
+
+    n_items = item_factors.shape[0]
+    k = min(k, n_items)
+    ids = np.empty((len(user_factors), k), dtype=np.int64)
+    scores = np.empty((len(user_factors), k), dtype=np.float32)
+
+    chunk_size = max(1, chunk_bytes // (4 * n_items))
+    for start in range(0, len(user_factors), chunk_size):
+        chunk_scores = user_factors[start : start + chunk_size] @ item_factors.T
+        if exclude_per_user is not None:
+            for row, items in enumerate(exclude_per_user[start : start + chunk_size]):
+                chunk_scores[row, items] = -np.inf
+
+        top = np.argpartition(chunk_scores, -k, axis=1)[:, -k:]
+        top_scores = np.take_along_axis(chunk_scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        ids[start : start + chunk_size] = np.take_along_axis(top, order, axis=1)
+        scores[start : start + chunk_size] = np.take_along_axis(top_scores, order, axis=1)
+
+    return ids, scores
+
+
+class FoldIn:
+    """
+    Методы:
+
+    user_factors - векторы пользователей по их трекам (из кэша, если события не изменились).
+    recommend - k лучших треков для нескольких пользователей (без их собственных треков).
+    stats - выводит статистику кэша векторов.
+    """
+
+    def __init__(self, max_size=100_000):
+
+        self.max_size = max_size  # сколько векторов пользователей хранить (LRU)
+        self._vectors = OrderedDict()  # user_id -> (ключ, вектор)
+        self._lock = threading.Lock()
+        self._stats = {
+            "fold_in_cache_hit_count": 0,  # счетчик векторов, взятых из кэша
+            "fold_in_cache_miss_count": 0,  # счетчик пересчитанных векторов
+        }
+
+    def user_factors(self, model, user_ids, items_per_user, keys):
+        """
+        model - (item_factors, YtY, regularization, alpha); keys - ключ актуальности вектора каждого
+        пользователя (меняется с каждым новым событием). Пересчитываются только векторы с новым ключом
+        """
+
+        vectors = [None] * len(user_ids)
+        with self._lock:
+            for row, (user_id, key) in enumerate(zip(user_ids, keys)):
+                cached = self._vectors.get(user_id)
+                if cached is not None and cached[0] == key:
+                    self._vectors.move_to_end(user_id)
+                    vectors[row] = cached[1]
+            # счётчики меняются только под блокировкой: user_factors вызывается из нескольких потоков пула
+            self._stats["fold_in_cache_hit_count"] += sum(vector is not None for vector in vectors)
+
+        missing = [row for row, vector in enumerate(vectors) if vector is None]
+        if missing:
+            item_factors, item_gramian, regularization, alpha = model
+            solved = solve_user_factors(
+                item_factors, item_gramian, [items_per_user[row] for row in missing], regularization, alpha
+            )
+            with self._lock:
+                for row, vector in zip(missing, solved):
+                    vectors[row] = vector
+                    self._vectors[user_ids[row]] = (keys[row], vector)
+                    self._vectors.move_to_end(user_ids[row])
+                while len(self._vectors) > self.max_size:
+                    self._vectors.popitem(last=False)
+                self._stats["fold_in_cache_miss_count"] += len(missing)
+
+        return np.stack(vectors) if vectors else np.empty((0, model[0].shape[1]), dtype=np.float32)
+
+    def recommend(self, model, user_ids, items_per_user, keys, k):
+        """
+        Возвращает (lengths, track_ids_enc, scores): число рекомендаций каждого пользователя (не больше k)
+        и плоские массивы рекомендаций по убыванию score (исключённые треки в выдачу не попадают)
+        """
+
+        user_factors = self.user_factors(model, user_ids, items_per_user, keys)
+        ids, scores = top_k_items(model[0], user_factors, k, exclude_per_user=items_per_user)
+        found = np.isfinite(scores)
+
+        return found.sum(axis=1), ids[found], scores[found]
+
+    def stats(self):
+
+        with self._lock:
+            return {**self._stats, "fold_in_cache_size": len(self._vectors)}
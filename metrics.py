@@ -0,0 +1,267 @@
+# Метрики сервиса в текстовом формате Prometheus (выгружаются на /metrics).
+#
+# Гистограммы задержек по этапам (поиск оффлайн-рекомендаций, события, i2i, смешивание, загрузка
+# артефактов и т.д.), счётчики и gauge. Счётчики, которые компоненты уже ведут в своих stats(),
+# не дублируются: они подключаются как collector и читаются в момент выгрузки.
+# Как принято в Prometheus, имена счётчиков оканчиваются на _total, у каждой метрики есть # HELP и # TYPE.
+
+import math
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+# границы корзин гистограмм задержек по умолчанию, секунд
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+
+def _format_labels(names, values, extra=None):
+
+    pairs = list(zip(names, values)) + (list(extra.items()) if extra else [])
+    if not pairs:
+        return ""
+
+    escaped = [
+        f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for name, value in pairs
+    ]
+
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value):
+
+    if isinstance(value, float) and math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+
+    type = None
+
+    def __init__(self, name, help, labels=()):
+
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def header(self):
+
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+
+
+class Counter(_Metric):
+    """
+    Счётчик (только растёт)
+    """
+
+    type = "counter"
+
+    def inc(self, value=1, **labels):
+
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def render(self):
+
+        with self._lock:
+            values = dict(self._values)
+
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+
+class Gauge(Counter):
+    """
+    Значение, которое может и расти, и уменьшаться
+    """
+
+    type = "gauge"
+
+    def set(self, value, **labels):
+
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    """
+    Гистограмма (например, задержек): число наблюдений по корзинам, сумма и количество
+    """
+
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Замеряет время выполнения блока
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def summary(self):
+        """
+        Словарь labels -> (количество, сумма)
+        """
+
+        with self._lock:
+            return {key: (state[2], state[1]) for key, state in self._values.items()}
+
+    def render(self):
+
+        with self._lock:
+            values = {key: ([*state[0]], state[1], state[2]) for key, state in self._values.items()}
+
+        lines = self.header()
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labels, key, {'le': _format_value(float(bound))})} {cumulative}"
+                )
+            lines.append(
+                f"{self.name}_bucket{_format_labels(self.labels, key, {'le': '+Inf'})} {count}"
+            )
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+
+        return lines
+
+
+class Metrics:
+    """
+    Методы:
+
+    counter / gauge / histogram - регистрирует метрику (или возвращает уже зарегистрированную с тем же именем);
+    к имени счётчика добавляется _total, если его нет.
+    collector - подключает функцию, возвращающую словарь значений (например, stats() компонента).
+    render - все метрики в текстовом формате Prometheus.
+    """
+
+    def __init__(self, prefix="recsys"):
+
+        self.prefix = prefix
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, help, **kwargs):
+
+        name = f"{self.prefix}_{name}"
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, help, **kwargs)
+
+            return self._metrics[name]
+
+    def counter(self, name, help, labels=()):
+
+        if not name.endswith("_total"):
+            name = f"{name}_total"
+
+        return self._register(Counter, name, help, labels=labels)
+
+    def gauge(self, name, help, labels=()):
+
+        return self._register(Gauge, name, help, labels=labels)
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+
+        return self._register(Histogram, name, help, labels=labels, buckets=buckets)
+
+    def collector(self, fn=None, counters=(), source=None):
+        """
+        fn() -> {name: value}; имена, оканчивающиеся на _count, и имена из counters выгружаются как counter
+        с суффиксом _total (вместо _count), прочие - как gauge. Нечисловые значения пропускаются.
+        source - откуда значения, для # HELP (по умолчанию - имя функции). Можно использовать как декоратор
+        """
+
+        if fn is None:
+            return lambda fn: self.collector(fn, counters, source)
+
+        self._collectors.append((fn, frozenset(counters), source or fn.__qualname__))
+
+        return fn
+
+    def render(self):
+
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines.extend(metric.render())
+
+        for fn, counters, source in self._collectors:
+            for name, value in fn().items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                if name.endswith("_count") or name in counters:
+                    type = "counter"
+                    full_name = f"{self.prefix}_{name.removesuffix('_count')}_total"
+                else:
+                    type = "gauge"
+                    full_name = f"{self.prefix}_{name}"
+                lines.append(f"# HELP {full_name} {name} from {source}")
+                lines.append(f"# TYPE {full_name} {type}")
+                lines.append(f"{full_name} {_format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+def process_memory_bytes():
+    """
+    Текущий RSS процесса (Linux: /proc/self/statm; иначе - максимальный RSS из getrusage)
+    """
+
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# общий реестр метрик сервиса
+registry = Metrics()
+
+# время этапов расчёта и загрузки: stage - offline, events, i2i, blend, rank, names, s3_load, reload, ...
+stage_seconds = registry.histogram("stage_seconds", "Duration of service stages", labels=("stage",))
+# ошибки по типам (503 - перегрузка, 504 - таймаут, 500 - необработанная ошибка)
+errors = registry.counter("errors_total", "Errors by type", labels=("type",))
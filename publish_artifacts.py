@@ -0,0 +1,24 @@
+# Материализация артефактов сервиса в общую папку SHARED_ARTIFACTS_DIR перед запуском воркеров:
+# модель, индекс треков и оффлайн-рекомендации один раз строятся в поколение плоских .npy-файлов,
+# а воркеры при запуске только открывают их через memory map.
+#
+# SHARED_ARTIFACTS_DIR=shared_artifacts python publish_artifacts.py
+# SHARED_ARTIFACTS_DIR=shared_artifacts uvicorn recommendations_service:app --workers 4
+
+import argparse
+
+import recommendations_service as service
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Публикация общих артефактов для воркеров сервиса")
+    parser.add_argument(
+        "--force", action="store_true", help="опубликовать новое поколение, даже если оно уже есть"
+    )
+    args = parser.parse_args()
+
+    if service.shared_artifacts is None:
+        parser.error("SHARED_ARTIFACTS_DIR is not set")
+
+    gen = service.shared_artifacts.publish_initial(service.rec_sources(), force=args.force)
+    print(f"Artifacts generation: {gen}")
@@ -0,0 +1,124 @@
+# Онлайн-ранжирование кандидатов моделью CatBoost (вторая стадия двухстадийного подхода из ноутбука).
+#
+# Признаки кандидата те же, что при обучении модели: als_score (персональные рекомендации ALS,
+# нормированные на максимальный score ALS обучающих кандидатов - как в ноутбуке), cnt_score (похожие треки), top_score (взвешенная популярность) и признаки пользователя из
+# get_user_features (using_months, tracks_used, tracks_per_month). Признаки пользователя хранятся
+# в таблице на массивах (отсортированные user_id и матрица значений), кандидаты собираются в матрицу
+# признаков одним векторным шагом и оцениваются одним вызовом predict_proba.
+# Отсутствующие значения - NaN, как в ноутбуке после объединения кандидатов через outer merge.
+
+import numpy as np
+
+FEATURES = ["als_score", "cnt_score", "top_score", "using_months", "tracks_used", "tracks_per_month"]
+USER_FEATURES = ["using_months", "tracks_used", "tracks_per_month"]
+
+
+def _lookup(sorted_keys, values, keys):
+    """
+    Значения для ключей keys по отсортированному массиву ключей (NaN для отсутствующих)
+    """
+
+    keys = np.asarray(keys, dtype=np.int64)
+    result = np.full((len(keys),) + values.shape[1:], np.nan, dtype=np.float32)
+    if len(sorted_keys) == 0:
+        return result
+
+    positions = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+    found = sorted_keys[positions] == keys
+    result[found] = values[positions[found]]
+
+    return result
+
+
+class UserFeatures:
+    """
+    Методы:
+
+    from_frame - строит таблицу по результату get_user_features (индекс или колонка user_id).
+    to_arrays / from_arrays - массивы таблицы (для кэша артефактов).
+    get - признаки пользователя (NaN, если пользователя нет в таблице).
+    """
+
+    def __init__(self, user_ids, values):
+
+        self.user_ids = user_ids  # отсортированные user_id (int64)
+        self.values = values  # признаки USER_FEATURES в том же порядке (float32)
+
+    @classmethod
+    def from_frame(cls, user_features):
+
+        if "user_id" in user_features.columns:
+            user_features = user_features.set_index("user_id")
+        user_features = user_features.sort_index()
+
+        return cls(
+            user_features.index.to_numpy(dtype=np.int64),
+            user_features[USER_FEATURES].to_numpy(dtype=np.float32),
+        )
+
+    def to_arrays(self):
+
+        return {"user_ids": self.user_ids, "values": self.values}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+
+        return cls(arrays["user_ids"], arrays["values"])
+
+    def get(self, user_id):
+
+        return _lookup(self.user_ids, self.values, [user_id])[0]
+
+
+class Ranker:
+    """
+    Методы:
+
+    features - матрица признаков кандидатов пользователя (один векторный шаг).
+    rank - упорядочивает кандидатов по вероятности, предсказанной моделью (один вызов predict_proba).
+    """
+
+    def __init__(self, model, user_features, top_track_ids, top_scores, als_max_score=1.0):
+
+        self.model = model  # CatBoostClassifier
+        self.user_features = user_features  # UserFeatures
+        self.top_track_ids = top_track_ids  # отсортированные track_id ТОП-рекомендаций
+        self.top_scores = top_scores  # их popularity_weighted
+        self.als_max_score = als_max_score  # максимальный score ALS, на который нормировались кандидаты при обучении
+
+    def features(self, user_id, track_ids, sources):
+        """
+        track_ids - кандидаты; sources - {feature: (track_ids, scores)} для als_score и cnt_score
+        (als_score - исходные score ALS, здесь они нормируются на als_max_score)
+        """
+
+        track_ids = np.asarray(track_ids, dtype=np.int64)
+        features = np.empty((len(track_ids), len(FEATURES)), dtype=np.float32)
+
+        for column, feature in enumerate(["als_score", "cnt_score"]):
+            source_ids, source_scores = sources.get(feature, ([], []))
+            source_ids = np.asarray(source_ids, dtype=np.int64)
+            source_scores = np.asarray(source_scores, dtype=np.float32)
+            # у трека может быть несколько score в источнике - берём первый (максимальный)
+            unique_ids, first = np.unique(source_ids, return_index=True)
+            features[:, column] = _lookup(unique_ids, source_scores[first], track_ids)
+
+        features[:, 0] /= self.als_max_score or 1.0
+        features[:, 2] = _lookup(self.top_track_ids, self.top_scores, track_ids)
+        features[:, 3:] = self.user_features.get(user_id)
+
+        return features
+
+    def rank(self, user_id, track_ids, sources):
+        """
+        Возвращает (track_ids, cb_scores) по убыванию вероятности
+        """
+
+        track_ids = np.asarray(track_ids, dtype=np.int64)
+        if len(track_ids) == 0:
+            return track_ids, np.empty(0, dtype=np.float32)
+
+        cb_scores = self.model.predict_proba(self.features(user_id, track_ids, sources))[:, 1]
+        order = np.argsort(-cb_scores, kind="stable")
+
+        return track_ids[order], cb_scores[order]
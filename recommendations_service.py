@@ -4,10 +4,35 @@
 #     учитывает историю пользователя,
 #     смешивает онлайн- и офлайн-рекомендации.
 
-from utils import rec_store, events_store, items, dedup_ids, get_als_i2i
-from fastapi import FastAPI
+from executor import Offloader, ServiceOverloaded
+from response_cache import ResponseCache
+from blender import Blender
+from metrics import errors, process_memory_bytes, registry, stage_seconds
+from utils import (
+    ALS_FOLD_IN,
+    RANKING_ENABLED,
+    artifacts,
+    rec_store,
+    shared_artifacts,
+    rec_reloader,
+    events_store,
+    fold_in,
+    get_fold_in_recs,
+    get_als_i2i_batch,
+    get_als_i2i_users,
+)
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
 from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import logging
+import os
+import time
+import json
+import random
+import numpy as np
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -16,27 +41,173 @@ load_dotenv()
 # в который логирует и uvicorn
 logger = logging.getLogger("uvicorn.error")
 
+# колонки, которые читаются из файлов рекомендаций каждого типа
+REC_COLUMNS = {
+    "personal": ["user_id", "track_id", "score"],
+    "default": ["track_id", "popularity_weighted"],
+}
+
+# /load_recommendations читает локальные файлы только из этой папки (остальные пути - ключи в хранилище)
+RECS_LOAD_DIR = os.path.realpath(os.environ.get("RECS_LOAD_DIR", "recs_load"))
+
+
+# Пул потоков для блокирующей работы: размер пула, длина очереди (при переполнении - 503),
+# таймаут запроса (при превышении - 504) и бюджет онлайн-этапа (при превышении - ТОП-рекомендации), в секундах
+SCORING_WORKERS = int(os.environ.get("SCORING_WORKERS", 4))
+SCORING_MAX_QUEUE = int(os.environ.get("SCORING_MAX_QUEUE", 64))
+REQUEST_TIMEOUT = float(os.environ.get("REQUEST_TIMEOUT", 5.0))
+ONLINE_BUDGET = float(os.environ.get("ONLINE_BUDGET", 0.2))
+
+offloader = Offloader(
+    max_workers=SCORING_WORKERS, max_queue=SCORING_MAX_QUEUE, timeout=REQUEST_TIMEOUT
+)
+
+# пользователям без оффлайн-рекомендаций - персональные рекомендации ALS по их событиям (ALS_FOLD_IN=1)
+offline_fallback = get_fold_in_recs if ALS_FOLD_IN else None
+
+# сколько пользователей /recommendations/batch обрабатывает за один вызов пула
+BATCH_CHUNK_USERS = int(os.environ.get("BATCH_CHUNK_USERS", 1000))
+
+# смешивание онлайн- и оффлайн-рекомендаций: стратегия BLEND_STRATEGY (interleave, weighted или quota),
+# BLEND_ONLINE_SHARE - вес онлайн-рекомендаций (для quota - их доля в выдаче)
+BLEND_STRATEGY = os.environ.get("BLEND_STRATEGY", "interleave")
+BLEND_ONLINE_SHARE = float(os.environ.get("BLEND_ONLINE_SHARE", 0.5))
+blender = Blender(
+    strategy=BLEND_STRATEGY,
+    weights={"online": BLEND_ONLINE_SHARE, "offline": 1.0 - BLEND_ONLINE_SHARE},
+)
+
+# кэш ответов /recommendations: не больше RESPONSE_CACHE_SIZE ответов (0 - кэш отключён)
+response_cache = ResponseCache(max_size=int(os.environ.get("RESPONSE_CACHE_SIZE", 10_000)))
+
+# онлайн-ранжирование (если задан KEY_CB_MODEL): модель выбирает k лучших из RANK_POOL_FACTOR * k
+# смешанных кандидатов; если ранжирование не уложилось в RANK_BUDGET секунд - отдаём кандидатов без него
+RANK_BUDGET = float(os.environ.get("RANK_BUDGET", 0.05))
+RANK_POOL_FACTOR = int(os.environ.get("RANK_POOL_FACTOR", 2))
+
+service_stats = {
+    "online_fallback_count": 0,  # счетчик замен онлайн-рекомендаций на ТОП-рекомендации
+    "rank_fallback_count": 0,  # счетчик ответов без ранжирования (не уложились в бюджет)
+}
+
+# доля запросов, для которых в лог пишется структурированная запись с рекомендациями и их названиями
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", 0.01))
+# сколько первых рекомендаций писать в такую запись
+LOG_SAMPLE_ITEMS = 10
+
+# время обработки запросов по эндпоинтам
+request_seconds = registry.histogram(
+    "request_seconds", "Duration of HTTP requests", labels=("path",)
+)
+
+
+def log_sample(event, user_id, recs):
+    """
+    С вероятностью LOG_SAMPLE_RATE пишет в лог json-запись с первыми рекомендациями и их названиями
+    """
+
+    if LOG_SAMPLE_RATE <= 0 or random.random() >= LOG_SAMPLE_RATE:
+        return
+
+    recs = list(recs[:LOG_SAMPLE_ITEMS])
+    with stage_seconds.time(stage="names"):
+        names = artifacts.item_index.names(recs)
+    logger.info(
+        json.dumps(
+            {
+                "event": event,
+                "user_id": user_id,
+                "recs": recs,
+                "names": [f"{artist_name} - {track_name}" for track_name, artist_name in names],
+            },
+            ensure_ascii=False,
+        )
+    )
+
+
+# состояние запуска: сервис готов отдавать рекомендации, когда загружены все артефакты
+startup_state = {"ready": False, "error": None, "seconds": None}
+
+
+def rec_sources():
+    """
+    Откуда загружать оффлайн-рекомендации при запуске: {type: (path, kwargs)}
+    """
+
+    return {
+        # для оффайн-рекомендаций: автозагрузка перс-рекомендаций
+        "personal": (
+            os.environ.get("KEY_PERSONAL_ALS_PARQUET"),
+            {"columns": REC_COLUMNS["personal"]},
+        ),
+        # для оффайн-рекомендаций: автозагрузка топ-рекомендаций
+        "default": (
+            os.environ.get("KEY_TOP_POPULAR_PARQUET"),
+            {"columns": REC_COLUMNS["default"]},
+        ),
+    }
+
+
+def load_on_startup():
+    """
+    Параллельно загружает модель, индекс треков и оффлайн-рекомендации
+    (или подключается к общему для воркеров поколению артефактов)
+    """
+
+    start = time.perf_counter()
+    if shared_artifacts is not None:
+        shared_artifacts.start(rec_sources())
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = [executor.submit(artifacts.load_all)] + [
+            executor.submit(rec_store.load, type=type, path=path, **kwargs)
+            for type, (path, kwargs) in rec_sources().items()
+        ]
+        for future in futures:
+            future.result()
+
+    return time.perf_counter() - start
+
+
+def run_startup():
+    """
+    Загрузка при запуске с фиксацией результата в startup_state
+    """
+
+    try:
+        startup_state["seconds"] = round(load_on_startup(), 3)
+        startup_state["ready"] = True
+        logger.info(f"Ready in {startup_state['seconds']}s")
+    except Exception as e:
+        logger.exception("Startup failed")
+        startup_state["error"] = str(e)
+
+
+def ensure_ready():
+    """
+    Пока артефакты не загружены, запросы за рекомендациями получают 503
+    """
+
+    if not startup_state["ready"]:
+        raise HTTPException(status_code=503, detail="Service is not ready")
+
 
 # Функция ниже, которая передаётся как параметр FastAPI-объекту, выполняет свой код только при запуске приложения и при его остановке.
-# При запуске приложения загружаем персональные и ТОП-рекомендации
+# При запуске приложения в фоне загружаем модель, индекс треков, персональные и ТОП-рекомендации:
+# сервис сразу начинает принимать запросы, а готовность можно проверить через /ready
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("Starting")
 
-    # для оффайн-рекомендаций: автозагрузка перс-рекомендаций
-    rec_store.load(
-        type="personal",
-        path="personal_als.parquet",
-        columns=["user_id", "track_id", "score"],
-    )
-    # для оффайн-рекомендаций: автозагрузка топ-рекомендаций
-    rec_store.load(
-        type="default",
-        path="top_popular.parquet",
-        columns=["track_id", "popularity_weighted"],
-    )
+    loop = asyncio.get_running_loop()
+    startup = loop.run_in_executor(None, run_startup)
 
     yield
+    await startup
+    offloader.shutdown()
+    # записываем в журнал события, которые ещё не попали на диск
+    events_store.close()
     logger.info("Stopping")
 
 
@@ -44,54 +215,201 @@ async def lifespan(app: FastAPI):
 app = FastAPI(title="FastAPI-микросервис для выдачи рекомендаций", lifespan=lifespan)
 
 
-@app.post("/recommendations", name="Получение рекомендаций для пользователя")
-async def recommendations(user_id: int, k: int = 100):
+@app.exception_handler(ServiceOverloaded)
+async def service_overloaded_handler(request, exc):
     """
-    Возвращает список рекомендаций длиной k для пользователя user_id
+    Очередь пула заполнена - просим клиента повторить запрос позже
+    """
+
+    errors.inc(type="overloaded")
+
+    return JSONResponse(status_code=503, content={"detail": "Service is overloaded"})
+
+
+@app.exception_handler(asyncio.TimeoutError)
+async def timeout_handler(request, exc):
+    """
+    Запрос не уложился в REQUEST_TIMEOUT
     """
 
-    recs_offline = rec_store.get(user_id, k)
+    errors.inc(type="timeout")
 
-    recs_online = await get_online_u2i(user_id, k, N=10)
-    recs_online = recs_online["recs"]
+    return JSONResponse(status_code=504, content={"detail": "Request timed out"})
 
-    min_length = min(len(recs_offline), len(recs_online))
 
-    logger.info(f"recs_offline {recs_offline}")
-    logger.info(f"recs_online {recs_online}")
+@app.middleware("http")
+async def observe_requests(request, call_next):
+    """
+    Замеряет время обработки запроса и считает необработанные ошибки
+    """
 
-    recs_blended = []
-    # чередуем элементы из списков, пока позволяет минимальная длина
-    for i in range(min_length):
-        recs_blended.append(recs_online[i])
-        recs_blended.append(recs_offline[i])
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    except Exception:
+        errors.inc(type="unhandled")
+        raise
+
+    # шаблон пути, а не сам путь - чтобы идентификаторы задач не размножали метки
+    route = request.scope.get("route")
+    request_seconds.observe(
+        time.perf_counter() - start, path=route.path if route is not None else "unknown"
+    )
 
-    recs_blended = [recs_blended]
+    return response
 
-    logger.info(f"recs_blended {recs_blended}")
 
-    # добавляем оставшиеся элементы в конец
-    recs_blended.append(recs_offline[min_length:])
-    recs_blended.append(recs_online[min_length:])
+def blend_recommendations(user_id, recs_offline, recs_online, k):
+    """
+    Смешивает оффлайн- и онлайн-рекомендации (track_ids, scores, source) в список из k треков,
+    исключая уже прослушанные пользователем треки; если кандидатов не хватило - дополняет ТОП-рекомендациями
+    """
 
-    # удаляем дубликаты
-    recs_blended = dedup_ids(sum(recs_blended, []))
+    listened = events_store.get(user_id, events_store.max_events_per_user)
+    recs_blended, _, _ = blender.blend(
+        [("online", *recs_online[:2]), ("offline", *recs_offline[:2])],
+        k,
+        exclude=listened,
+        fill=("default", *rec_store.get_default_scored(None)),
+    )
 
-    # оставляем только первые k рекомендаций
-    recs_blended[:k]
+    return recs_blended
 
-    # посмотрим, какие треки выдал итоговый-рекоммендатор
-    if recs_blended:
-        for i in recs_blended:
-            print(
-                "online rec track name: ",
-                items.query("track_id == @i")["track_name"].to_list()[0],
-            )
-            print(
-                "online rec artist name: ",
-                items.query("track_id == @i")["artist_name"].to_list()[0],
+
+def rank_recommendations(user_id, candidates, sources, k):
+    """
+    Упорядочивает кандидатов моделью CatBoost и оставляет k лучших
+    """
+
+    track_ids, _ = artifacts.ranker.rank(user_id, candidates, sources)
+
+    return track_ids[:k].tolist()
+
+
+def compute_online_u2i(user_id, k, N):
+    """
+    Онлайн-рекомендации по последним k событиям пользователя (N похожих треков на каждое).
+    Возвращает (track_ids, scores)
+    """
+
+    # получаем список k-последних событий пользователя
+    with stage_seconds.time(stage="events"):
+        events = events_store.get(user_id, k)
+
+    # получаем список из N треков, похожих на последние k, с которыми взаимодействовал пользователь:
+    # для всех событий сразу, отсортированные по scores в убывающем порядке и без дубликатов
+    with stage_seconds.time(stage="i2i"):
+        recs, scores = get_als_i2i_batch(events, N=N)
+
+    # посмотрим (на части запросов), какие треки выдал онлайн-рекоммендатор
+    log_sample("online_recommendations", user_id, recs)
+
+    return recs, scores
+
+
+async def recommend(user_id, k, candidates=None):
+    """
+    Рекомендации длиной k для одного пользователя: оффлайн- и онлайн-кандидаты, смешивание и
+    (если включено) ранжирование с бюджетом RANK_BUDGET - общий путь /recommendations и /recommendations/batch.
+
+    candidates - уже посчитанные для n_candidates(k) кандидаты (recs_offline, recs_online)
+    (в /recommendations/batch - одним пакетом для всех пользователей); без них кандидаты считаются здесь,
+    онлайн-этап - с бюджетом ONLINE_BUDGET.
+    Возвращает (recs, complete): complete - False, если онлайн-этап или ранжирование заменены запасным вариантом
+    """
+
+    online_fallback = False
+    rank_fallback = False
+    n_candidates = candidates_count(k)
+
+    if candidates is not None:
+        recs_offline, recs_online = candidates
+    else:
+        with stage_seconds.time(stage="offline"):
+            recs_offline = await offloader.run(
+                rec_store.get_scored, user_id, n_candidates, fallback=offline_fallback
             )
 
+        try:
+            with stage_seconds.time(stage="online"):
+                recs_online = await offloader.run(
+                    compute_online_u2i, user_id, k, 10, timeout=ONLINE_BUDGET
+                )
+        except (asyncio.TimeoutError, ServiceOverloaded):
+            # онлайн-этап не уложился в бюджет - вместо него берём ТОП-рекомендации
+            service_stats["online_fallback_count"] += 1
+            logger.warning(f"Online stage fallback for user {user_id}")
+            recs_online = rec_store.get_default_scored(k)
+            online_fallback = True
+
+    with stage_seconds.time(stage="blend"):
+        recs_blended = await offloader.run(
+            blend_recommendations, user_id, recs_offline, recs_online, n_candidates
+        )
+
+    if RANKING_ENABLED:
+        # признаки кандидатов - score тех генераторов, которые их предложили
+        sources = {}
+        if recs_offline[2] in ("personal", "fallback"):
+            sources["als_score"] = recs_offline[:2]
+        if not online_fallback:
+            sources["cnt_score"] = recs_online
+        try:
+            with stage_seconds.time(stage="rank"):
+                recs_blended = await offloader.run(
+                    rank_recommendations, user_id, recs_blended, sources, k, timeout=RANK_BUDGET
+                )
+        except (asyncio.TimeoutError, ServiceOverloaded):
+            # ранжирование не уложилось в бюджет - отдаём кандидатов в порядке смешивания
+            service_stats["rank_fallback_count"] += 1
+            logger.warning(f"Rank stage fallback for user {user_id}")
+            rank_fallback = True
+
+    return recs_blended[:k], not online_fallback and not rank_fallback
+
+
+def candidates_count(k):
+    """
+    Сколько кандидатов смешивать: при ранжировании больше, чем нужно, - модель выбирает из них k лучших
+    """
+
+    return k * RANK_POOL_FACTOR if RANKING_ENABLED else k
+
+
+@app.post("/recommendations", name="Получение рекомендаций для пользователя")
+async def recommendations(user_id: int, k: int = 100):
+    """
+    Возвращает список рекомендаций длиной k для пользователя user_id
+    """
+
+    ensure_ready()
+
+    # ответ зависит от версий оффлайн-рекомендаций и модели и от событий пользователя:
+    # новое событие (put_user_event) меняет seq, поэтому устаревший ответ из кэша не вернётся;
+    # метки seq не повторяются и после удаления пользователя из events_store (ttl/LRU) или перезапуска
+    cache_key = (
+        user_id,
+        k,
+        rec_store.version("personal"),
+        rec_store.version("default"),
+        artifacts.version,
+        events_store.seq(user_id),
+    )
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return {"recs": cached}
+
+    start = time.perf_counter()
+    recs_blended, complete = await recommend(user_id, k)
+
+    # посмотрим (на части запросов), какие треки выдал итоговый рекомендатор
+    log_sample("recommendations", user_id, recs_blended)
+
+    # ответ с ТОП-рекомендациями вместо онлайн-этапа или без ранжирования не кэшируем -
+    # следующий запрос может уложиться в бюджет
+    if complete:
+        response_cache.put(cache_key, recs_blended, time.perf_counter() - start)
+
     return {"recs": recs_blended}
 
 
@@ -101,46 +419,97 @@ async def get_online_u2i(user_id: int, k: int = 100, N: int = 10):
     Возвращает список онлайн-рекомендаций длиной k для пользователя user_id
     """
 
-    # получаем список k-последних событий пользователя
-    events = await get_user_events(user_id=user_id, k=k)
-    events = events["events"]
-
-    # получаем список из N треков, похожих на последние k, с которыми взаимодействовал пользователь
-    sim_track_ids = []
-    sim_track_scores = []
-    if len(events) > 0:
-        for track_id in events:
-            sim_track_id, sim_track_score = await get_als_i2i(track_id, N=N)
-            sim_track_ids.append(sim_track_id)
-            sim_track_scores.append(sim_track_score)
-        sim_track_ids = sum(sim_track_ids, [])
-        sim_track_scores = sum(sim_track_scores, [])
-    else:
-        recs = []
-
-    # сортируем похожие объекты по scores в убывающем порядке
-    combined = list(zip(sim_track_ids, sim_track_scores))
-    combined = sorted(combined, key=lambda x: x[1], reverse=True)
-    combined = [item for item, _ in combined]
-
-    # удаляем дубликаты, чтобы не выдавать одинаковые рекомендации
-    recs = dedup_ids(combined)
-
-    # посмотрим, какие треки выдал онлайн-рекоммендатор
-    if recs:
-        for i in recs:
-            print(
-                "online rec track name: ",
-                items.query("track_id == @i")["track_name"].to_list()[0],
-            )
-            print(
-                "online rec artist name: ",
-                items.query("track_id == @i")["artist_name"].to_list()[0],
-            )
+    ensure_ready()
+
+    recs, _ = await offloader.run(compute_online_u2i, user_id, k, N)
 
     return {"recs": recs}
 
 
+def compute_candidates_batch(user_ids, k):
+    """
+    Кандидаты для группы пользователей: оффлайн - одним проходом по хранилищу, онлайн - одним пакетом
+    по событиям всех пользователей. Возвращает для каждого пользователя (recs_offline, recs_online)
+    в том же виде, что и этапы /recommendations
+    """
+
+    with stage_seconds.time(stage="batch_offline"):
+        offline_lengths, offline_ids, offline_scores, offline_types = rec_store.get_many(
+            user_ids, candidates_count(k), fallback=offline_fallback
+        )
+
+    with stage_seconds.time(stage="batch_events"):
+        events_per_user = [events_store.get(user_id, k) for user_id in user_ids]
+
+    with stage_seconds.time(stage="batch_i2i"):
+        online_segments, online_ids, online_scores = get_als_i2i_users(events_per_user, N=10)
+
+    online_lengths = np.bincount(online_segments, minlength=len(user_ids))
+    offline_ends = np.cumsum(offline_lengths)
+    online_ends = np.cumsum(online_lengths)
+
+    candidates = []
+    for row in range(len(user_ids)):
+        offline = slice(offline_ends[row] - offline_lengths[row], offline_ends[row])
+        online = slice(online_ends[row] - online_lengths[row], online_ends[row])
+        candidates.append(
+            (
+                (offline_ids[offline], offline_scores[offline], str(offline_types[row])),
+                (online_ids[online], online_scores[online]),
+            )
+        )
+
+    return candidates
+
+
+async def recommendations_chunk(user_ids, k):
+    """
+    Рекомендации для части пользователей /recommendations/batch: кандидаты - одним пакетом,
+    смешивание и ранжирование - тем же путём, что и в /recommendations. Возвращает строки NDJSON
+    """
+
+    candidates = await offloader.run(compute_candidates_batch, user_ids, k)
+
+    lines = []
+    for user_id, user_candidates in zip(user_ids, candidates):
+        recs, _ = await recommend(user_id, k, candidates=user_candidates)
+        lines.append(json.dumps({"user_id": user_id, "recs": recs}))
+
+    return "\n".join(lines) + "\n"
+
+
+class BatchRecommendationsRequest(BaseModel):
+    user_ids: list[int]
+    k: int = 100
+
+
+@app.post("/recommendations/batch", name="Получение рекомендаций для группы пользователей")
+async def recommendations_batch(request: BatchRecommendationsRequest):
+    """
+    Возвращает рекомендации длиной k для каждого пользователя из user_ids
+    в формате NDJSON: по строке {"user_id": ..., "recs": [...]} на пользователя
+    """
+
+    ensure_ready()
+
+    chunks = [
+        request.user_ids[start : start + BATCH_CHUNK_USERS]
+        for start in range(0, len(request.user_ids), BATCH_CHUNK_USERS)
+    ]
+    if not chunks:
+        return StreamingResponse(iter([]), media_type="application/x-ndjson")
+
+    # первую часть считаем до начала ответа, чтобы перегрузка или таймаут вернулись кодом ответа
+    first = await recommendations_chunk(chunks[0], request.k)
+
+    async def stream():
+        yield first
+        for chunk in chunks[1:]:
+            yield await recommendations_chunk(chunk, request.k)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
 @app.post("/put_user_event")
 async def put_user_event(user_id: int, item_id: int):
     """
@@ -163,21 +532,51 @@ async def get_user_events(user_id: int, k: int = 10):
     return {"events": events}
 
 
+def resolve_recs_path(file_path):
+    """
+    Путь для загрузки рекомендаций: файл из RECS_LOAD_DIR (путь к нему без символических ссылок)
+    или ключ в хранилище. Пути, которые выходят за RECS_LOAD_DIR (абсолютные, с "..", через ссылки)
+    или указывают на локальный файл вне неё, отклоняются с кодом 400
+    """
+
+    path = os.path.realpath(os.path.join(RECS_LOAD_DIR, file_path))
+    if os.path.commonpath([RECS_LOAD_DIR, path]) != RECS_LOAD_DIR:
+        raise HTTPException(status_code=400, detail=f"file_path must be inside {RECS_LOAD_DIR}")
+    if os.path.isfile(path):
+        return path
+    # ключ хранилища не должен совпадать с локальным файлом вне RECS_LOAD_DIR - его прочитал бы загрузчик
+    if os.path.exists(file_path):
+        raise HTTPException(status_code=400, detail=f"file_path must be inside {RECS_LOAD_DIR}")
+
+    return file_path
+
+
 @app.get("/load_recommendations", name="Загрузка рекомендаций из файла")
 async def load_recommendations(rec_type: str, file_path: str):
     """
-    Загружает оффлайн-рекомендации из файла (на случай, если файлы рекомендаций обновились)
+    Загружает оффлайн-рекомендации из файла (на случай, если файлы рекомендаций обновились):
+    файла в RECS_LOAD_DIR или ключа в хранилище (см. resolve_recs_path).
+    Загрузка выполняется в фоне, до её окончания сервис отдаёт текущую версию рекомендаций.
+    Возвращает описание задачи загрузки (job_id, status, progress, version)
     """
 
-    if rec_type == "personal":
-        columns = ["user_id", "track_id", "score"]
-    else:
-        columns = ["track_id", "popularity_weighted"]
-    rec_store.load(
-        type=rec_type,
-        path=file_path,
-        columns=columns,
-    )
+    if rec_type not in REC_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"Unknown rec_type: {rec_type}")
+
+    return rec_reloader.submit(rec_type, resolve_recs_path(file_path), columns=REC_COLUMNS[rec_type])
+
+
+@app.get("/load_recommendations/{job_id}", name="Статус загрузки рекомендаций")
+async def load_recommendations_status(job_id: str):
+    """
+    Возвращает статус задачи загрузки рекомендаций
+    """
+
+    job = rec_reloader.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job_id: {job_id}")
+
+    return job
 
 
 @app.get("/get_statistics", name="Получение статистики по рекомендациям")
@@ -186,7 +585,77 @@ async def get_statistics():
     Выводит статистику по имеющимся счётчикам
     """
 
-    return rec_store.stats()
+    return {
+        **rec_store.stats(),
+        **service_stats,
+        **offloader.stats(),
+        **events_store.stats(),
+        **response_cache.stats(),
+        **fold_in.stats(),
+        # среднее время этапов, мс
+        **{
+            f"stage_{stage}_avg_ms": round(1000 * total / count, 3)
+            for (stage,), (count, total) in stage_seconds.summary().items()
+        },
+    }
+
+
+# счётчики и размеры компонентов выгружаются в /metrics в момент запроса
+registry.collector(rec_store.stats)
+registry.collector(lambda: service_stats, source="service_stats")
+registry.collector(offloader.stats)
+registry.collector(events_store.stats, counters=("log_records_written", "log_records_applied"))
+registry.collector(response_cache.stats, counters=("response_cache_seconds_saved",))
+registry.collector(fold_in.stats)
+
+
+@registry.collector
+def service_gauges():
+
+    return {
+        **rec_store.sizes(),
+        "process_memory_bytes": process_memory_bytes(),
+        "ready": int(startup_state["ready"]),
+    }
+
+
+@app.get("/metrics", name="Метрики в формате Prometheus")
+async def metrics():
+    """
+    Гистограммы задержек по этапам, счётчики и gauge в текстовом формате Prometheus
+    """
+
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/health", name="Проверка, что сервис запущен")
+async def health():
+    """
+    Liveness: процесс жив и отвечает на запросы
+    """
+
+    return {"status": "ok"}
+
+
+@app.get("/ready", name="Проверка готовности сервиса")
+async def ready():
+    """
+    Readiness: загружены ли все артефакты (пока нет - 503)
+    """
+
+    state = {
+        **startup_state,
+        "artifacts": artifacts.loaded(),
+        "load_seconds": artifacts.load_seconds,
+        # поколение общих артефактов (если включён SHARED_ARTIFACTS_DIR)
+        "artifacts_generation": (
+            shared_artifacts.generation if shared_artifacts is not None else None
+        ),
+    }
+    if not startup_state["ready"]:
+        return JSONResponse(status_code=503, content=state)
+
+    return state
 
 
 # запуск сервиса
@@ -0,0 +1,79 @@
+# Кэш ответов /recommendations.
+#
+# Большая часть запросов - повторные открытия страницы тем же пользователем без новых событий между ними.
+# Ответ кэшируется по ключу, в который входят версии всех данных, от которых он зависит (версии оффлайн-
+# рекомендаций и модели, номер последнего события пользователя), поэтому устаревший ответ не может быть
+# отдан: после нового события или перезагрузки ключ просто другой, а старые записи вытесняются по LRU.
+
+import threading
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """
+    Методы:
+
+    get - возвращает сохранённый ответ по ключу (или None).
+    put - сохраняет ответ и время, за которое он был рассчитан.
+    stats - выводит статистику: попадания, промахи, сэкономленное время.
+    """
+
+    def __init__(self, max_size=10_000):
+
+        self.max_size = max_size  # сколько ответов хранить (0 - кэш отключён)
+        self._entries = OrderedDict()  # ключ -> (ответ, время расчёта), от давно не использованных к недавним
+        self._lock = threading.Lock()
+        self._stats = {
+            "response_cache_hit_count": 0,  # счетчик ответов из кэша
+            "response_cache_miss_count": 0,  # счетчик ответов, которые пришлось рассчитать
+            "response_cache_evicted_count": 0,  # счетчик вытесненных по LRU ответов
+            "response_cache_seconds_saved": 0.0,  # сколько времени расчёта сэкономлено за счёт кэша
+        }
+
+    def get(self, key):
+        """
+        Возвращает ответ по ключу или None
+        """
+
+        if self.max_size <= 0:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["response_cache_miss_count"] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._stats["response_cache_hit_count"] += 1
+            self._stats["response_cache_seconds_saved"] += entry[1]
+
+            return entry[0]
+
+    def put(self, key, value, seconds):
+        """
+        Сохраняет ответ; seconds - сколько времени занял его расчёт
+        """
+
+        if self.max_size <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (value, seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats["response_cache_evicted_count"] += 1
+
+    def stats(self):
+
+        with self._lock:
+            requests = self._stats["response_cache_hit_count"] + self._stats["response_cache_miss_count"]
+            return {
+                **self._stats,
+                "response_cache_seconds_saved": round(self._stats["response_cache_seconds_saved"], 3),
+                "response_cache_hit_rate": (
+                    round(self._stats["response_cache_hit_count"] / requests, 4) if requests else 0.0
+                ),
+                "response_cache_size": len(self._entries),
+            }
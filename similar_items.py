@@ -0,0 +1,322 @@
+# Оффлайн-расчёт похожих треков (i2i) по модели ALS для всех треков или заданного списка.
+#
+# Для каждого трека ищутся N ближайших по косинусной близости факторов треков: запросы обрабатываются
+# частями (одно матричное произведение на часть, память на матрицу scores ограничена), части
+# распределяются по процессам. Каждая часть сразу записывается отдельным файлом parquet в папку
+# результата (track_id, similar_track_id, score, rank), её можно прочитать целиком pd.read_parquet(папка).
+# Уже записанные части при повторном запуске пропускаются; параметры расчёта сохраняются в _manifest.json,
+# и продолжить расчёт в папке, начатый с другими параметрами (N, треки, размер части, модель), нельзя.
+#
+# С --users (parquet с user_id, track_id - последние треки пользователей) похожие треки считаются для этих
+# треков и дополнительно соединяются с пользователями: в --users-out пишется таблица (user_id, track_id, score),
+# которую ждёт candidates_pipeline.py --similar.
+#
+# python similar_items.py als_model.npz items.parquet similar --n 10 --jobs 4
+# python similar_items.py als_model.npz items.parquet similar_last --n 10 \
+#     --users users_last_track.parquet --users-out similar.parquet
+
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from ann_index import normalize_factors
+
+# ограничение памяти на матрицу scores одной части запросов
+CHUNK_BYTES = 256 * 1024**2
+
+
+def exact_top_k(factors_normed, queries_enc, n_neighbours, chunk_bytes=CHUNK_BYTES, exclude_enc=None):
+    """
+    Полным перебором находит по n_neighbours ближайших треков для каждого track_id_enc из queries_enc
+    (сам трек в выдачу не попадает). exclude_enc - track_id_enc, которые не должны попадать в выдачу
+    (массив номеров или булева маска по всем трекам): их score -inf, поэтому они могут оказаться только в конце строки, если остальных треков не хватило.
+
+    Возвращает матрицы track_id_enc и scores размером len(queries_enc) x n_neighbours,
+    строки отсортированы по убыванию score
+    """
+
+    queries_enc = np.asarray(queries_enc, dtype=np.int64)
+    n_items = factors_normed.shape[0]
+    n_neighbours = min(n_neighbours, n_items - 1)
+
+    similar_enc = np.empty((len(queries_enc), max(n_neighbours, 0)), dtype=np.int64)
+    similar_scores = np.empty((len(queries_enc), max(n_neighbours, 0)), dtype=np.float32)
+    if len(queries_enc) == 0 or n_neighbours <= 0:
+        return similar_enc, similar_scores
+
+    # одно матричное произведение на часть запросов: матрица scores не больше chunk_bytes
+    chunk_size = max(1, chunk_bytes // (4 * n_items))
+    for start in range(0, len(queries_enc), chunk_size):
+        chunk = queries_enc[start : start + chunk_size]
+        rows = np.arange(len(chunk))
+        scores = factors_normed[chunk] @ factors_normed.T
+        # сам трек в выдачу не попадает
+        scores[rows, chunk] = -np.inf
+        if exclude_enc is not None:
+            scores[:, exclude_enc] = -np.inf
+
+        top = np.argpartition(scores, -n_neighbours, axis=1)[:, -n_neighbours:]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+
+        similar_enc[start : start + chunk_size] = np.take_along_axis(top, order, axis=1)
+        similar_scores[start : start + chunk_size] = np.take_along_axis(top_scores, order, axis=1)
+
+    return similar_enc, similar_scores
+
+
+def part_path(out_dir, part):
+
+    return os.path.join(out_dir, f"part-{part:05d}.parquet")
+
+
+def _fingerprint(*arrays):
+    """
+    Хэш содержимого массивов - чтобы отличить запуск с другими треками или другой моделью
+    """
+
+    digest = hashlib.sha1()
+    for array in arrays:
+        digest.update(np.ascontiguousarray(array).tobytes())
+
+    return digest.hexdigest()
+
+
+def _check_manifest(out_dir, manifest):
+    """
+    Записывает параметры расчёта в out_dir/_manifest.json или, если расчёт уже начат,
+    проверяет, что параметры совпадают (иначе готовые части относятся к другому расчёту)
+    """
+
+    manifest_path = os.path.join(out_dir, "_manifest.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            saved = json.load(f)
+        if saved != manifest:
+            changed = sorted(
+                key for key in manifest.keys() | saved.keys() if saved.get(key) != manifest.get(key)
+            )
+            raise ValueError(
+                f"{out_dir} contains parts built with different parameters ({', '.join(changed)}), "
+                "remove it to rebuild"
+            )
+        return
+
+    if any(name.startswith("part-") for name in os.listdir(out_dir)):
+        raise ValueError(f"{out_dir} contains parts without {manifest_path}, remove it to rebuild")
+
+    with open(f"{manifest_path}.tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+
+
+# данные процесса-исполнителя: факторы и идентификаторы треков открываются через memory map один раз
+_worker = {}
+
+
+def _init_worker(factors_path, track_ids_path, chunk_bytes):
+
+    # в каждом процессе BLAS в один поток, параллельность - за счёт процессов
+    try:
+        from threadpoolctl import threadpool_limits
+
+        threadpool_limits(1)
+    except ImportError:
+        pass
+
+    _worker["factors_normed"] = np.load(factors_path, mmap_mode="r")
+    _worker["track_ids"] = np.load(track_ids_path, mmap_mode="r")
+    # track_id_enc без трека в items (track_id = -1) - их нельзя выдавать похожими треками
+    _worker["missing"] = np.flatnonzero(_worker["track_ids"] < 0)
+    _worker["chunk_bytes"] = chunk_bytes
+
+
+def _write_part(part, queries_enc, N, out_dir):
+    """
+    Считает похожие треки для части запросов и записывает их файлом part-NNNNN.parquet.
+    Возвращает число записанных строк
+    """
+
+    similar_enc, similar_scores = exact_top_k(
+        _worker["factors_normed"],
+        queries_enc,
+        N,
+        _worker["chunk_bytes"],
+        exclude_enc=_worker["missing"],
+    )
+    track_ids = _worker["track_ids"]
+    query_ids = np.broadcast_to(track_ids[queries_enc][:, None], similar_enc.shape)
+    ranks = np.broadcast_to(
+        np.arange(1, similar_enc.shape[1] + 1, dtype=np.int16), similar_enc.shape
+    )
+
+    # исключённые треки (score -inf) стоят в конце строк, поэтому rank оставшихся идёт подряд с 1;
+    # строки для неиспользуемых track_id_enc в запросах тоже не пишем
+    found = np.isfinite(similar_scores) & (query_ids >= 0)
+    similar = pd.DataFrame(
+        {
+            "track_id": query_ids[found],
+            "similar_track_id": track_ids[similar_enc[found]],
+            "score": similar_scores[found],
+            "rank": ranks[found],
+        }
+    )
+
+    # запись через временный файл: недописанная часть не считается готовой, а имя с "_" в начале
+    # не даёт прочитать её вместе с готовыми частями (pd.read_parquet(папка) такие файлы пропускает)
+    path = part_path(out_dir, part)
+    tmp_path = os.path.join(out_dir, f"_{os.path.basename(path)}.tmp")
+    similar.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+    return len(similar)
+
+
+def build_similar(
+    item_factors,
+    track_ids,
+    out_dir,
+    N=10,
+    queries_enc=None,
+    part_size=16384,
+    n_jobs=None,
+    chunk_bytes=CHUNK_BYTES,
+):
+    """
+    Считает по N похожих треков для queries_enc (по умолчанию - для всех треков) и записывает
+    их частями по part_size запросов в папку out_dir.
+
+    item_factors - факторы треков ALS (строка - track_id_enc), track_ids - track_id по track_id_enc.
+    Если в out_dir уже есть части расчёта с другими параметрами - ValueError.
+    Возвращает число записанных строк (без уже готовых частей)
+    """
+
+    os.makedirs(out_dir, exist_ok=True)
+    n_items = len(item_factors)
+    if queries_enc is None:
+        queries_enc = np.arange(n_items)
+    queries_enc = np.asarray(queries_enc, dtype=np.int64)
+    n_jobs = n_jobs or os.cpu_count()
+
+    _check_manifest(
+        out_dir,
+        {
+            "N": N,
+            "part_size": part_size,
+            "n_queries": len(queries_enc),
+            "queries": _fingerprint(queries_enc),
+            "model": _fingerprint(item_factors, np.asarray(track_ids, dtype=np.int64)),
+        },
+    )
+
+    parts = [
+        (part, queries_enc[start : start + part_size])
+        for part, start in enumerate(range(0, len(queries_enc), part_size))
+    ]
+    # готовые части (от прерванного запуска) пропускаем
+    parts = [(part, chunk) for part, chunk in parts if not os.path.exists(part_path(out_dir, part))]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # процессы читают нормированные факторы из общего файла через memory map, а не получают копию
+        factors_path = os.path.join(tmp_dir, "item_factors_normed.npy")
+        track_ids_path = os.path.join(tmp_dir, "track_ids.npy")
+        np.save(factors_path, normalize_factors(item_factors))
+        np.save(track_ids_path, np.asarray(track_ids, dtype=np.int64))
+
+        with ProcessPoolExecutor(
+            max_workers=n_jobs,
+            initializer=_init_worker,
+            initargs=(factors_path, track_ids_path, chunk_bytes),
+        ) as executor:
+            futures = [executor.submit(_write_part, part, chunk, N, out_dir) for part, chunk in parts]
+            return sum(future.result() for future in futures)
+
+
+def load_track_ids(items_path, n_items):
+    """
+    Массив track_id по track_id_enc из items.parquet длиной n_items (число строк факторов модели):
+    track_id_enc без трека в items - -1
+    """
+
+    items = pd.read_parquet(items_path, columns=["track_id", "track_id_enc"])
+    items = items[items["track_id_enc"] < n_items]
+    track_ids = np.full(n_items, -1, dtype=np.int64)
+    track_ids[items["track_id_enc"].to_numpy()] = items["track_id"].to_numpy()
+
+    return track_ids
+
+
+def join_users(similar, users_tracks):
+    """
+    Похожие треки для пользователей: соединяет результат build_similar (track_id, similar_track_id, score)
+    с треками пользователей (user_id, track_id). Возвращает таблицу (user_id, track_id, score) - вход
+    candidates_pipeline.py --similar; трек, похожий на несколько треков пользователя, остаётся с лучшим score
+    """
+
+    joined = users_tracks[["user_id", "track_id"]].merge(similar, on="track_id")
+    joined = (
+        joined[["user_id", "similar_track_id", "score"]]
+        .rename(columns={"similar_track_id": "track_id"})
+        .sort_values(["user_id", "score"], ascending=[True, False], kind="stable")
+        .drop_duplicates(["user_id", "track_id"])
+    )
+
+    return joined.reset_index(drop=True)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Оффлайн-расчёт похожих треков по модели ALS")
+    parser.add_argument("model_path", help="путь к als_model.npz")
+    parser.add_argument("items_path", help="путь к items.parquet (track_id, track_id_enc)")
+    parser.add_argument("out_dir", help="папка результата")
+    parser.add_argument("--n", type=int, default=10, help="сколько похожих треков на трек")
+    parser.add_argument("--tracks", default=None, help="parquet с колонкой track_id: только эти треки")
+    parser.add_argument(
+        "--users", default=None, help="parquet с user_id, track_id: похожие треки для треков пользователей"
+    )
+    parser.add_argument(
+        "--users-out", default=None, help="куда записать (user_id, track_id, score) для --users"
+    )
+    parser.add_argument("--part-size", type=int, default=16384, help="треков в одном файле результата")
+    parser.add_argument("--jobs", type=int, default=None, help="число процессов (по умолчанию - все ядра)")
+    args = parser.parse_args()
+    if bool(args.users) != bool(args.users_out):
+        parser.error("--users and --users-out must be given together")
+
+    with np.load(args.model_path) as data:
+        item_factors = data["item_factors"]
+    track_ids = load_track_ids(args.items_path, item_factors.shape[0])
+
+    queries_enc = None
+    if args.tracks or args.users:
+        tracks = pd.read_parquet(args.tracks or args.users, columns=["track_id"])["track_id"]
+        tracks = tracks.drop_duplicates()
+        known = track_ids >= 0
+        encode = pd.Series(np.flatnonzero(known), index=track_ids[known])
+        queries_enc = encode.reindex(tracks.to_numpy()).dropna().astype(np.int64).to_numpy()
+
+    rows = build_similar(
+        item_factors,
+        track_ids,
+        args.out_dir,
+        N=args.n,
+        queries_enc=queries_enc,
+        part_size=args.part_size,
+        n_jobs=args.jobs,
+    )
+    print(f"Saved {rows} rows to {args.out_dir}")
+
+    if args.users:
+        users_similar = join_users(
+            pd.read_parquet(args.out_dir, columns=["track_id", "similar_track_id", "score"]),
+            pd.read_parquet(args.users, columns=["user_id", "track_id"]),
+        )
+        users_similar.to_parquet(args.users_out, index=False)
+        print(f"Saved {len(users_similar)} rows to {args.users_out}")
@@ -13,6 +13,13 @@ logging.basicConfig(
 
 load_dotenv()
 
+# проверим, что сервис загрузил артефакты и готов отдавать рекомендации
+ready_url = os.environ.get("READY_URL")
+resp = requests.get(ready_url)
+logging.info(f"ready: {resp.status_code} {resp.json()}")
+# В ответе: ready: 200 {'ready': True, 'error': None, 'seconds': 12.3, 'artifacts': ['item_factors_normed', 'item_index'], ...}
+
+
 # Пример запроса на получение персональных рекомендаций:
 recommendations_url = os.environ.get("REC_URL")
 headers = {"Content-type": "application/json", "Accept": "text/plain"}
@@ -48,6 +55,18 @@ params = {"rec_type": "default", "file_path": "top_popular.parquet"}
 resp = requests.get(load_recommendations_url, headers=headers, params=params)
 logging.info(f"status_code: {resp.status_code}")
 # В ответе: 200
+# загрузка идёт в фоне, в ответе - описание задачи загрузки
+load_job = resp.json()
+logging.info(load_job)
+# В ответе: {'job_id': '...', 'rec_type': 'default', 'path': 'top_popular.parquet', 'status': 'queued', 'progress': 0.0, 'version': None, 'error': None}
+
+# статус задачи загрузки
+resp = requests.get(f"{load_recommendations_url}/{load_job['job_id']}")
+if resp.status_code == 200:
+    logging.info(resp.json())
+else:
+    logging.info(f"status code: {resp.status_code}")
+# В ответе: {'job_id': '...', 'rec_type': 'default', 'path': 'top_popular.parquet', 'status': 'done', 'progress': 1.0, 'version': 2, 'error': None}
 
 
 # запрос на вывод статистики
@@ -159,3 +178,16 @@ logging.info(f"Полученные идентификаторы рекомен
 # online rec track name:  ['Young And Beautiful']
 # online rec artist name:  ['Lana Del Rey']
 # и т.д.
+
+
+# рекомендации сразу для нескольких пользователей (ответ в формате NDJSON - по строке на пользователя)
+recommendations_batch_url = os.environ.get("REC_BATCH_URL")
+resp = requests.post(recommendations_batch_url, json={"user_ids": [47, 16, 47000000000], "k": 10})
+if resp.status_code == 200:
+    for line in resp.text.splitlines():
+        logging.info(line)
+else:
+    logging.info(f"status code: {resp.status_code}")
+# В ответе: {"user_id": 47, "recs": [977, 975, 973, ...]}
+#           {"user_id": 16, "recs": [672687, 2278985, 647040, ...]}
+#           {"user_id": 47000000000, "recs": [47627256, 51516485, 24692821, ...]}
@@ -0,0 +1,39 @@
+# Общие фикстуры тестов. Модули сервиса лежат в корне репозитория - добавляем его в путь поиска
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def service(tmp_path_factory):
+    """
+    Модуль сервиса, читающий небольшие синтетические артефакты из временной папки вместо S3
+    (переменные окружения читаются при импорте, поэтому сервис импортируется один раз на все тесты)
+    """
+
+    pytest.importorskip("implicit")
+    from benchmarks.synthetic import generate, service_env
+
+    data_dir = tmp_path_factory.mktemp("data")
+    generate(str(data_dir), n_items=2000, n_users=200, n_recs=50, factors=16)
+    os.environ.update(service_env(str(data_dir), str(tmp_path_factory.mktemp("cache"))))
+    os.environ["RECS_LOAD_DIR"] = str(tmp_path_factory.mktemp("recs_load"))
+
+    import recommendations_service
+
+    return recommendations_service
+
+
+@pytest.fixture(scope="session")
+def client(service):
+
+    from fastapi.testclient import TestClient
+
+    with TestClient(service.app) as client:
+        while client.get("/ready").status_code != 200:
+            time.sleep(0.05)
+        yield client
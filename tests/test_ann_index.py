@@ -0,0 +1,76 @@
+# Тесты IVF-индекса для приближённого поиска похожих треков: запуск - python -m pytest -q tests
+
+import numpy as np
+
+from ann_index import IVFIndex, normalize_factors
+from similar_items import exact_top_k
+
+
+def _factors(n_items=2000, n_factors=16, n_clusters=20, seed=0):
+    """
+    Факторы треков с кластерной структурой (как у обученной модели)
+    """
+
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_clusters, n_factors))
+    factors = centers[rng.integers(0, n_clusters, n_items)] + 0.3 * rng.normal(size=(n_items, n_factors))
+
+    return normalize_factors(factors.astype(np.float32))
+
+
+def _recall(factors_normed, index, queries, N, n_probe):
+
+    exact, _ = exact_top_k(factors_normed, queries, N)
+    approx, _ = index.search(factors_normed[queries], N, n_probe=n_probe, exclude=queries)
+
+    return np.mean([len(set(a) & set(e)) / N for a, e in zip(approx.tolist(), exact.tolist())])
+
+
+def test_recall_against_exact_search():
+
+    factors_normed = _factors()
+    index = IVFIndex.build(factors_normed, n_lists=40)
+    queries = np.arange(0, 2000, 10)
+
+    recalls = [_recall(factors_normed, index, queries, 10, n_probe) for n_probe in (1, 4, 40)]
+
+    assert recalls[1] >= 0.9
+    # больше просматриваемых кластеров - не хуже полнота; все кластеры - точный поиск
+    assert recalls[0] <= recalls[1] <= recalls[2]
+    assert recalls[2] == 1.0
+
+
+def test_search_excludes_query_and_fills_tail():
+
+    factors_normed = _factors(n_items=30, n_clusters=3)
+    index = IVFIndex.build(factors_normed, n_lists=3)
+    queries = np.array([0, 5])
+
+    ids, scores = index.search(factors_normed[queries], 40, n_probe=3, exclude=queries)
+
+    # в трёх кластерах всего 30 треков, минус сам трек: хвост заполнен -1 / -inf
+    assert ids.shape == (2, 40)
+    assert ((ids >= 0).sum(axis=1) == 29).all()
+    assert (ids[:, 29:] == -1).all() and np.isneginf(scores[:, 29:]).all()
+    assert 0 not in ids[0] and 5 not in ids[1]
+    assert (np.diff(scores[:, :29], axis=1) <= 0).all()
+
+    # треки из exclude_items не выдаются ни одному запросу
+    blocked = np.zeros(30, dtype=bool)
+    blocked[[1, 2, 3]] = True
+    ids, _ = index.search(factors_normed[queries], 40, n_probe=3, exclude=queries, exclude_items=blocked)
+    assert not np.isin(ids, [1, 2, 3]).any()
+    assert ((ids >= 0).sum(axis=1) == 26).all()
+
+
+def test_save_load_roundtrip(tmp_path):
+
+    factors_normed = _factors(n_items=200)
+    index = IVFIndex.build(factors_normed, n_lists=10)
+    path = str(tmp_path / "ivf.npz")
+    index.save(path)
+    loaded = IVFIndex.load(path)
+
+    queries = factors_normed[:5]
+    for expected, actual in zip(index.search(queries, 5), loaded.search(queries, 5)):
+        np.testing.assert_array_equal(expected, actual)
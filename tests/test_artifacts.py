@@ -0,0 +1,90 @@
+# Тесты локального кэша артефактов: запуск - python -m pytest -q tests
+
+import os
+
+import numpy as np
+
+from artifacts import ArtifactCache, ArtifactGenerations, LocalStorage, load_arrays, save_arrays
+
+
+class CountingStorage(LocalStorage):
+
+    def __init__(self, root):
+
+        super().__init__(root)
+        self.etag_calls = 0
+
+    def etag(self, key):
+
+        self.etag_calls += 1
+
+        return super().etag(key)
+
+
+def test_save_arrays_keeps_finished_target(tmp_path):
+
+    path = str(tmp_path / "entry")
+    save_arrays({"a": np.arange(3)}, path)
+    # второй процесс собрал ту же запись позже - готовая папка остаётся, временная удаляется
+    save_arrays({"a": np.arange(5)}, path)
+
+    assert np.array_equal(load_arrays(path)["a"], np.arange(3))
+    assert os.listdir(tmp_path) == ["entry"]
+
+
+def test_etag_requested_once_until_refresh(tmp_path):
+
+    storage_dir = tmp_path / "storage"
+    storage_dir.mkdir()
+    (storage_dir / "model.npy").write_bytes(b"v1")
+    storage = CountingStorage(str(storage_dir))
+    cache = ArtifactCache(storage, str(tmp_path / "cache"))
+
+    def build(path):
+        with open(path, "rb") as f:
+            return {"data": np.frombuffer(f.read(), dtype=np.uint8)}
+
+    first = cache.arrays("model.npy", "data", build)
+    cache.arrays("model.npy", "data", build)
+    cache.fetch("model.npy")
+    assert storage.etag_calls == 1
+
+    # новая версия файла видна только после refresh
+    (storage_dir / "model.npy").write_bytes(b"v22")
+    assert np.array_equal(cache.arrays("model.npy", "data", build)["data"], first["data"])
+    cache.refresh("model.npy")
+    assert bytes(cache.arrays("model.npy", "data", build)["data"]) == b"v22"
+    assert storage.etag_calls == 2
+
+
+def test_generations_publish_attach_and_cleanup(tmp_path):
+
+    generations = ArtifactGenerations(str(tmp_path / "shared"), keep=2)
+    assert generations.current() is None
+
+    built = []
+
+    def build_model():
+        built.append(1)
+        return {"factors": np.arange(4)}
+
+    gen = generations.publish({"model": build_model, "recs": {"track_ids": np.array([1, 2])}})
+    assert gen == 1 and generations.current() == 1
+    # первое поколение уже есть - if_missing его не пересобирает
+    assert generations.publish({"model": build_model}, if_missing=True) == 1
+    assert built == [1]
+
+    # новое поколение: заменённые массивы новые, остальные перенесены из текущего
+    attached = generations.attach(1)
+    assert generations.publish({"recs": {"track_ids": np.array([3])}}) == 2
+    current = generations.attach(2)
+    assert np.array_equal(current["model"]["factors"], np.arange(4))
+    assert current["recs"]["track_ids"].tolist() == [3]
+    assert isinstance(current["model"]["factors"], np.memmap)
+
+    # хранятся только keep последних поколений; уже открытые массивы остаются читаемыми
+    generations.publish({"recs": {"track_ids": np.array([4])}})
+    names = sorted(os.listdir(tmp_path / "shared"))
+    assert [name for name in names if name.startswith("gen-")] == ["gen-00000002", "gen-00000003"]
+    assert attached["recs"]["track_ids"].tolist() == [1, 2]
+    assert not [name for name in names if ".tmp" in name]
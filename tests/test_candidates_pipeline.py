@@ -0,0 +1,95 @@
+# Тесты подготовки кандидатов по частям: запуск - python -m pytest -q tests
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from candidates_pipeline import run_pipeline
+
+
+def _write_inputs(data_dir, n_users=40, seed=0):
+
+    rng = np.random.default_rng(seed)
+    paths = {}
+    for name in ("events_train", "events_labels"):
+        paths[name] = os.path.join(data_dir, f"{name}.parquet")
+        pd.DataFrame(
+            {
+                "user_id": rng.integers(0, n_users, 400),
+                "track_id": rng.integers(0, 50, 400),
+                "started_at": pd.to_datetime("2023-01-01")
+                + pd.to_timedelta(rng.integers(0, 300, 400), unit="D"),
+            }
+        ).to_parquet(paths[name])
+    for name in ("als", "similar"):
+        paths[name] = os.path.join(data_dir, f"{name}.parquet")
+        pd.DataFrame(
+            {
+                "user_id": np.repeat(np.arange(n_users), 10),
+                "track_id": rng.integers(0, 50, n_users * 10),
+                "score": rng.random(n_users * 10),
+            }
+        ).to_parquet(paths[name])
+
+    top_popular_path = os.path.join(data_dir, "top_popular.parquet")
+    pd.DataFrame({"track_id": np.arange(20), "popularity_weighted": np.linspace(1, 0, 20)}).to_parquet(
+        top_popular_path
+    )
+
+    return paths, top_popular_path
+
+
+def _parts(out_dir, name):
+
+    return sorted(os.listdir(os.path.join(out_dir, name)))
+
+
+def test_rerun_with_other_partitions_rebuilds(tmp_path):
+
+    paths, top_popular_path = _write_inputs(str(tmp_path))
+    out_dir = str(tmp_path / "out")
+
+    rows = run_pipeline(out_dir, paths, top_popular_path, n_partitions=4, n_jobs=1)
+    assert _parts(out_dir, "user_features") == [f"part-{part:05d}.parquet" for part in range(4)]
+    assert run_pipeline(out_dir, paths, top_popular_path, n_partitions=4, n_jobs=1) == rows
+
+    # другое число частей: входы раскладываются заново, старые части результатов удаляются
+    assert run_pipeline(out_dir, paths, top_popular_path, n_partitions=2, n_jobs=1) == rows
+    assert _parts(out_dir, "user_features") == ["part-00000.parquet", "part-00001.parquet"]
+    assert sorted(os.listdir(os.path.join(out_dir, "partitioned", "als"))) == [
+        "_SUCCESS",
+        "part=0",
+        "part=1",
+    ]
+
+
+def test_rerun_with_changed_input_rebuilds(tmp_path):
+
+    paths, top_popular_path = _write_inputs(str(tmp_path))
+    out_dir = str(tmp_path / "out")
+    run_pipeline(out_dir, paths, top_popular_path, n_partitions=2, n_jobs=1)
+
+    # событий для разметки стало больше: таргеты и признаки пересчитываются
+    more_labels = pd.read_parquet(paths["events_labels"])
+    more_labels = pd.concat([more_labels, more_labels.assign(user_id=more_labels["user_id"] + 1000)])
+    more_labels.to_parquet(paths["events_labels"])
+
+    rows = run_pipeline(out_dir, paths, top_popular_path, n_partitions=2, n_jobs=1)
+    user_features = pd.read_parquet(os.path.join(out_dir, "user_features"))
+    assert rows["user_features"] == len(user_features)
+    assert (user_features["user_id"] >= 1000).any()
+
+
+def test_ranker_params_match_als_normalisation(tmp_path):
+
+    paths, top_popular_path = _write_inputs(str(tmp_path))
+    out_dir = str(tmp_path / "out")
+    run_pipeline(out_dir, paths, top_popular_path, n_partitions=2, n_jobs=1)
+
+    # сервис делит score ALS на тот же максимум, что и кандидаты для обучения
+    with open(os.path.join(out_dir, "ranker_params.json")) as f:
+        params = json.load(f)
+    assert params["als_max_score"] == pd.read_parquet(paths["als"])["score"].max()
+    assert pd.read_parquet(os.path.join(out_dir, "candidates_to_rank"))["als_score"].max() == 1.0
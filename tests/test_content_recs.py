@@ -0,0 +1,29 @@
+# Тесты контентных рекомендаций: запуск - python -m pytest -q tests
+
+import pandas as pd
+
+from content_recs import build_content_recs
+
+
+def test_gaps_in_track_id_enc_are_not_recommended(tmp_path):
+
+    # в нумерации track_id_enc пропуски (1, 3, 4): таких треков нет и в рекомендациях быть не должно
+    items = pd.DataFrame(
+        {
+            "track_id": [100, 200, 500, 600],
+            "track_id_enc": [0, 2, 5, 6],
+            "genre_name": [["rock"], ["rock", "pop"], ["pop"], ["jazz"]],
+        }
+    )
+    events = pd.DataFrame({"user_id": [1, 2, 2], "track_id": [100, 500, 600]})
+    out_path = str(tmp_path / "content.parquet")
+
+    rows = build_content_recs(items, events, out_path, k=10, n_jobs=1)
+    recs = pd.read_parquet(out_path)
+
+    assert rows == len(recs)
+    assert set(recs["track_id"]) <= {100, 200, 500, 600}
+    # у каждого пользователя - все непрослушанные треки, без прослушанных
+    assert sorted(recs.loc[recs["user_id"] == 1, "track_id"]) == [200, 500, 600]
+    assert sorted(recs.loc[recs["user_id"] == 2, "track_id"]) == [100, 200]
+    assert recs.groupby("user_id")["score"].is_monotonic_decreasing.all()
@@ -0,0 +1,68 @@
+# Тесты хранилища персональных рекомендаций CSRRecs: запуск - python -m pytest -q tests
+# (utils читает переменные окружения при импорте, поэтому импортируется после фикстуры service)
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def CSRRecs(service):
+
+    from utils import CSRRecs
+
+    return CSRRecs
+
+
+def _recs(CSRRecs):
+
+    return CSRRecs.from_frame(
+        pd.DataFrame(
+            {
+                "user_id": [7, 3, 7, 3, 7],
+                "track_id": [70, 30, 71, 31, 72],
+                "score": [0.9, 0.8, 0.7, 0.6, 0.5],
+            }
+        )
+    )
+
+
+def test_get_hit_and_miss(CSRRecs):
+
+    recs = _recs(CSRRecs)
+
+    assert len(recs) == 2
+    track_ids, scores = recs.get(7)
+    # порядок рекомендаций внутри пользователя сохраняется
+    assert track_ids.tolist() == [70, 71, 72]
+    np.testing.assert_allclose(scores, [0.9, 0.7, 0.5])
+    assert recs.get(3)[0].tolist() == [30, 31]
+    assert recs.get(5) is None
+    assert recs.get(100) is None
+
+
+def test_take_truncates_to_k(CSRRecs):
+
+    recs = _recs(CSRRecs)
+
+    found, lengths, track_ids, scores = recs.take([7, 5, 3, 100], k=2)
+
+    assert found.tolist() == [True, False, True, False]
+    assert lengths.tolist() == [2, 0, 2, 0]
+    assert track_ids.tolist() == [70, 71, 30, 31]
+    np.testing.assert_allclose(scores, [0.9, 0.7, 0.8, 0.6])
+
+
+def test_empty_store(CSRRecs, tmp_path):
+
+    recs = CSRRecs.from_frame(pd.DataFrame({"user_id": [], "track_id": [], "score": []}))
+    path = str(tmp_path / "recs")
+    recs.save(path)
+
+    for store in (recs, CSRRecs.load(path)):
+        assert len(store) == 0
+        assert store.get(1) is None
+        found, lengths, track_ids, scores = store.take([1, 2], k=10)
+        assert not found.any()
+        assert lengths.tolist() == [0, 0]
+        assert len(track_ids) == len(scores) == 0
@@ -0,0 +1,214 @@
+# Тесты DurableEventStore (журнал во временном каталоге): запуск - python -m pytest -q tests
+
+import fcntl
+import os
+
+import pytest
+
+from event_store import RECORD_DTYPE, DurableEventStore, EventStore
+
+
+@pytest.fixture
+def open_store(tmp_path):
+    """
+    Открывает хранилище в tmp_path; фоновый поток не пишет сам - пакеты записываются вызовом flush
+    """
+
+    stores = []
+
+    def open_store(**kwargs):
+        store = DurableEventStore(str(tmp_path), flush_interval=3600, **kwargs)
+        stores.append(store)
+        return store
+
+    yield open_store
+
+    for store in stores:
+        if store._thread.is_alive():
+            store.close()
+
+
+def _log_size(path, gen):
+
+    return os.path.getsize(os.path.join(path, f"log.{gen:08d}"))
+
+
+def test_group_commit(tmp_path, open_store):
+
+    store = open_store()
+    for item_id in range(5):
+        store.put(1, item_id)
+    store.put_many([2, 2], [20, 21])
+
+    # события сразу видны в процессе, но в журнал попадают только при записи пакета
+    assert store.get(1, 10) == [4, 3, 2, 1, 0]
+    assert _log_size(tmp_path, 0) == 0
+    assert store.stats()["log_pending"] == 7
+
+    store.flush()
+    assert _log_size(tmp_path, 0) == 7 * RECORD_DTYPE.itemsize
+    stats = store.stats()
+    assert stats["log_flush_count"] == 1
+    assert stats["log_records_written"] == 7
+    assert stats["log_records_applied"] == 0
+    assert stats["log_pending"] == 0
+
+
+def test_replay_after_reopen(open_store):
+
+    store = open_store()
+    store.put(1, 10)
+    store.put_many([1, 2], [11, 20])
+    store.close()
+
+    reopened = open_store()
+    assert reopened.get(1, 10) == [11, 10]
+    assert reopened.get(2, 10) == [20]
+
+
+def test_replay_skips_torn_record(tmp_path, open_store):
+
+    store = open_store()
+    store.put(1, 10)
+    store.close()
+
+    # процесс упал посреди записи пакета: в конце журнала неполная запись
+    with open(os.path.join(tmp_path, "log.00000000"), "ab") as f:
+        f.write(b"\x01" * (RECORD_DTYPE.itemsize // 2))
+
+    reopened = open_store()
+    assert reopened.get(1, 10) == [10]
+    assert _log_size(tmp_path, 0) == RECORD_DTYPE.itemsize
+
+    # следующие записи читаются без сдвига
+    reopened.put(2, 20)
+    reopened.close()
+    assert open_store().get(2, 10) == [20]
+
+
+def test_snapshot_and_log_truncation(tmp_path, open_store):
+
+    store = open_store(snapshot_bytes=4 * RECORD_DTYPE.itemsize)
+    store.put_many([1, 1, 2, 2, 3], [10, 11, 20, 21, 30])
+    store.flush()
+
+    # журнал вырос больше snapshot_bytes: состояние в снимке, начат новый пустой журнал
+    assert store.stats()["log_snapshot_count"] == 1
+    assert store.stats()["log_gen"] == 1
+    assert open(os.path.join(tmp_path, "CURRENT")).read() == "1"
+    assert os.path.exists(os.path.join(tmp_path, "snapshot.00000001.npz"))
+    assert _log_size(tmp_path, 1) == 0
+
+    store.put_many([4, 4, 4, 4], [40, 41, 42, 43])
+    store.flush()
+
+    # после второго снимка остаются последний снимок, текущий и предыдущий журналы
+    files = sorted(name for name in os.listdir(tmp_path) if name.startswith(("log.", "snapshot.")))
+    assert files == ["log.00000001", "log.00000002", "snapshot.00000002.npz"]
+    store.close()
+
+    reopened = open_store()
+    assert reopened.get(1, 10) == [11, 10]
+    assert reopened.get(3, 10) == [30]
+    assert reopened.get(4, 10) == [43, 42, 41, 40]
+
+
+def test_second_instance_tails_log(open_store):
+
+    first = open_store()
+    second = open_store()
+
+    first.put(1, 10)
+    first.flush()
+    second.flush()
+    assert second.get(1, 10) == [10]
+
+    second.put(1, 11)
+    second.flush()
+    first.flush()
+    # свои события из журнала повторно не применяются
+    assert first.get(1, 10) == [11, 10]
+    assert second.get(1, 10) == [11, 10]
+    assert first.stats()["log_records_applied"] == 1
+    assert second.stats()["log_records_applied"] == 1
+
+
+def test_second_instance_follows_snapshots(open_store):
+
+    first = open_store(snapshot_bytes=2 * RECORD_DTYPE.itemsize)
+    second = open_store()
+
+    # журнал сменился один раз: второй процесс дочитывает старый журнал и переходит на новый
+    first.put_many([1, 1], [10, 11])
+    first.flush()
+    second.flush()
+    assert second.stats()["log_gen"] == 1
+    assert second.get(1, 10) == [11, 10]
+
+    # второй процесс отстал больше чем на журнал: состояние восстанавливается из снимка
+    for item_id in range(12, 18, 2):
+        first.put_many([1, 1], [item_id, item_id + 1])
+        first.flush()
+    second.put(2, 20)
+    second.flush()
+    assert second.stats()["log_gen"] == 4
+    assert second.get(1, 3) == [17, 16, 15]
+    assert second.get(2, 10) == [20]
+
+    first.flush()
+    assert first.get(2, 10) == [20]
+
+
+def test_put_during_snapshot_load_applied_once(open_store, monkeypatch):
+
+    first = open_store(snapshot_bytes=2 * RECORD_DTYPE.itemsize)
+    second = open_store()
+    for item_id in range(10, 16, 2):
+        first.put_many([1, 1], [item_id, item_id + 1])
+        first.flush()
+
+    # второй процесс отстал больше чем на журнал; пока он загружает снимок, приходит новое событие
+    put_many = EventStore.put_many
+    armed = [True]
+
+    def put_many_with_concurrent_put(self, user_ids, item_ids):
+        if armed[0]:
+            armed[0] = False
+            second.put(2, 20)
+        put_many(self, user_ids, item_ids)
+
+    monkeypatch.setattr(EventStore, "put_many", put_many_with_concurrent_put)
+    second.flush()
+
+    assert not armed[0]
+    assert second.get(2, 10) == [20]
+    assert second.get(1, 2) == [15, 14]
+
+    first.flush()
+    assert first.get(2, 10) == [20]
+
+
+def test_snapshot_with_pending_events_replayed_once(open_store):
+
+    store = open_store()
+    follower = open_store()
+    store.put_many([1, 1], [10, 11])
+    store.flush()
+    follower.flush()
+
+    # событие сохранено, но ещё не записано пакетом, когда делается снимок
+    store.put(1, 12)
+    store._flock(fcntl.LOCK_EX)
+    try:
+        store._snapshot_locked()
+    finally:
+        store._flock(fcntl.LOCK_UN)
+    store.close()
+
+    # при восстановлении из снимка событие не применяется второй раз из нового журнала
+    reopened = open_store()
+    assert reopened.get(1, 10) == [12, 11, 10]
+
+    # а процесс, который дочитывает журналы без снимка, получает его из журнала
+    follower.flush()
+    assert follower.get(1, 10) == [12, 11, 10]
@@ -0,0 +1,175 @@
+# Тесты оффлайн-оценки: векторные метрики сравниваются с простым расчётом по каждому пользователю
+# запуск - python -m pytest -q tests
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from evaluation import evaluate
+
+KS = (1, 3, 10)
+
+
+def _data(seed=0, n_users=60, n_tracks=40):
+
+    rng = np.random.default_rng(seed)
+    recs = pd.DataFrame(
+        {
+            "user_id": rng.integers(0, n_users, 1500),
+            "track_id": rng.integers(0, n_tracks, 1500),
+            "score": rng.random(1500),
+        }
+    ).drop_duplicates(["user_id", "track_id"])
+    events_test = pd.DataFrame(
+        {
+            "user_id": rng.integers(0, n_users + 10, 300),
+            "track_id": rng.integers(0, n_tracks + 5, 300),
+            "listens": rng.integers(1, 5, 300),
+        }
+    )
+    events_train = pd.DataFrame(
+        {"user_id": rng.integers(0, n_users, 2000), "track_id": rng.integers(0, n_tracks, 2000)}
+    )
+
+    return recs, events_test, events_train
+
+
+def _naive(recs, events_test, events_train, relevance):
+    """
+    Метрики по каждому пользователю в цикле (так, как они определены в модуле)
+    """
+
+    train_tracks = set(events_train["track_id"])
+    events_test = events_test[events_test["track_id"].isin(train_tracks)]
+    result = {}
+    for user_id in sorted(set(recs["user_id"]) & set(events_test["user_id"])):
+        user_recs = recs[recs["user_id"] == user_id].sort_values("score", ascending=False)
+        ranked = user_recs["track_id"].tolist()
+        user_test = events_test[events_test["user_id"] == user_id]
+        if relevance is None:
+            gains = dict.fromkeys(user_test["track_id"], 1.0)
+        else:
+            gains = user_test.groupby("track_id")[relevance].sum().astype(float).to_dict()
+        listened = set(events_train.loc[events_train["user_id"] == user_id, "track_id"])
+
+        metrics = {}
+        for k in KS:
+            shown = ranked[:k]
+            hits = [track_id for track_id in shown if track_id in gains]
+            dcg = sum(gains.get(track_id, 0.0) / np.log2(rank + 2) for rank, track_id in enumerate(shown))
+            ideal = sorted(gains.values(), reverse=True)[:k]
+            idcg = sum(gain / np.log2(rank + 2) for rank, gain in enumerate(ideal))
+            metrics[f"ndcg@{k}"] = dcg / idcg
+            metrics[f"precision@{k}"] = len(hits) / len(shown)
+            metrics[f"recall@{k}"] = len(hits) / len(gains)
+            metrics[f"hit_rate@{k}"] = float(len(hits) > 0)
+            metrics[f"novelty@{k}"] = 1 - sum(track_id in listened for track_id in shown) / len(shown)
+        result[user_id] = metrics
+
+    return pd.DataFrame.from_dict(result, orient="index")
+
+
+@pytest.mark.parametrize("relevance", [None, "listens"])
+@pytest.mark.parametrize("n_jobs, chunk_users", [(1, 100_000), (1, 7), (2, 7)])
+def test_matches_naive(relevance, n_jobs, chunk_users):
+
+    recs, events_test, events_train = _data()
+    summary, per_user = evaluate(
+        recs,
+        events_test,
+        ks=KS,
+        events_train=events_train,
+        n_items=40,
+        n_jobs=n_jobs,
+        chunk_users=chunk_users,
+        relevance=relevance,
+    )
+    expected = _naive(recs, events_test, events_train, relevance)
+
+    assert per_user.index.tolist() == expected.index.tolist()
+    for name in expected.columns:
+        np.testing.assert_allclose(per_user[name].to_numpy(), expected[name].to_numpy(), err_msg=name)
+        assert summary[name] == pytest.approx(expected[name].mean())
+    assert summary["users"] == len(expected)
+
+
+def test_graded_ndcg_prefers_higher_relevance():
+
+    events_test = pd.DataFrame({"user_id": [1, 1, 1], "track_id": [10, 20, 20], "listens": [1, 1, 3]})
+    # трек 20 релевантнее: 4 прослушивания против одного
+    good = pd.DataFrame({"user_id": [1, 1], "track_id": [20, 10], "score": [2.0, 1.0]})
+    bad = good.assign(score=[1.0, 2.0])
+
+    assert evaluate(good, events_test, ks=[2], relevance="listens")[0]["ndcg@2"] == pytest.approx(1.0)
+    assert evaluate(bad, events_test, ks=[2], relevance="listens")[0]["ndcg@2"] < 1.0
+    # бинарный NDCG порядок двух релевантных треков не различает
+    assert evaluate(bad, events_test, ks=[2])[0]["ndcg@2"] == pytest.approx(1.0)
+
+
+@pytest.mark.filterwarnings("error::RuntimeWarning")
+def test_graded_ndcg_zero_gain_user():
+
+    # у пользователя 2 все тестовые события с нулевым весом
+    events_test = pd.DataFrame(
+        {"user_id": [1, 1, 2, 2], "track_id": [10, 20, 10, 30], "listens": [1, 3, 0, 0]}
+    )
+    recs = pd.DataFrame(
+        {"user_id": [1, 1, 2, 2], "track_id": [20, 10, 10, 30], "score": [2.0, 1.0, 2.0, 1.0]}
+    )
+
+    summary, per_user = evaluate(recs, events_test, ks=[2], relevance="listens")
+
+    assert per_user.loc[2, "ndcg@2"] == 0.0
+    assert per_user.loc[1, "ndcg@2"] == pytest.approx(1.0)
+    assert summary["ndcg@2"] == pytest.approx(0.5)
+
+
+@pytest.mark.parametrize("relevance", [None, "listens"])
+def test_ndcg_matches_sklearn(relevance):
+
+    metrics = pytest.importorskip("sklearn.metrics")
+    rng = np.random.default_rng(1)
+    n_users, n_tracks = 8, 12
+    # каждый пользователь получает оценку всех треков каталога - тогда идеальный DCG у sklearn тот же
+    recs = pd.DataFrame(
+        {
+            "user_id": np.repeat(np.arange(n_users), n_tracks),
+            "track_id": np.tile(np.arange(n_tracks), n_users),
+            "score": rng.permutation(n_users * n_tracks).astype(float),
+        }
+    )
+    events_test = pd.DataFrame(
+        {
+            "user_id": rng.integers(0, n_users, 40),
+            "track_id": rng.integers(0, n_tracks, 40),
+            "listens": rng.integers(1, 5, 40),
+        }
+    )
+
+    _, per_user = evaluate(recs, events_test, ks=[5], relevance=relevance)
+
+    for user_id, ndcg in per_user["ndcg@5"].items():
+        user_recs = recs[recs["user_id"] == user_id].set_index("track_id")["score"]
+        user_test = events_test[events_test["user_id"] == user_id]
+        if relevance is None:
+            gains = pd.Series(1.0, index=user_test["track_id"].unique())
+        else:
+            gains = user_test.groupby("track_id")[relevance].sum().astype(float)
+        y_true = gains.reindex(user_recs.index, fill_value=0.0).to_numpy()
+        expected = metrics.ndcg_score([y_true], [user_recs.to_numpy()], k=5)
+        assert ndcg == pytest.approx(expected)
+
+
+def test_coverage_counts_users_without_test_events():
+
+    events_test = pd.DataFrame({"user_id": [1], "track_id": [10]})
+    # пользователь 2 без тестовых событий в метриках не оценивается, но его треки входят в coverage
+    recs = pd.DataFrame(
+        {"user_id": [1, 1, 2, 2], "track_id": [10, 20, 30, 40], "score": [2.0, 1.0, 2.0, 1.0]}
+    )
+
+    summary, per_user = evaluate(recs, events_test, ks=[1, 2], n_items=10)
+
+    assert per_user.index.tolist() == [1]
+    assert summary["coverage@1"] == pytest.approx(0.2)
+    assert summary["coverage@2"] == pytest.approx(0.4)
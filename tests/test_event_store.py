@@ -0,0 +1,232 @@
+# Тесты EventStore: запуск - python -m pytest -q tests
+
+import numpy as np
+
+from event_store import RECORD_DTYPE, DurableEventStore, EventStore
+
+
+def _small_store(max_users, max_events_per_user=4, n_stripes=1, **kwargs):
+    """
+    Хранилище, в которое помещаются только max_users пользователей (события - int32)
+    """
+
+    return EventStore(
+        max_events_per_user=max_events_per_user,
+        memory_budget=max_users * (max_events_per_user * 4 + 128),
+        n_stripes=n_stripes,
+        **kwargs,
+    )
+
+
+def test_get_wraparound_order():
+
+    store = EventStore(max_events_per_user=3)
+    for item_id in range(7):
+        store.put(1, item_id)
+
+    # в кольцевом буфере остаются последние три события, от новых к старым
+    assert store.get(1, 10) == [6, 5, 4]
+    assert store.get(1, 2) == [6, 5]
+    assert store.get(2, 10) == []
+    assert store.stats()["events_put_count"] == 7
+
+
+def test_put_many_matches_put():
+
+    rng = np.random.default_rng(0)
+    user_ids = rng.integers(0, 20, size=500)
+    item_ids = rng.integers(0, 1000, size=500)
+
+    one_by_one = EventStore(max_events_per_user=5)
+    for user_id, item_id in zip(user_ids.tolist(), item_ids.tolist()):
+        one_by_one.put(user_id, item_id)
+
+    # пакеты разного размера, часть пользователей уже есть в хранилище, часть - новые
+    batched = EventStore(max_events_per_user=5)
+    for start, stop in [(0, 3), (3, 150), (150, 500)]:
+        batched.put_many(user_ids[start:stop], item_ids[start:stop])
+
+    for user_id in range(20):
+        assert batched.get(user_id, 5) == one_by_one.get(user_id, 5)
+    assert batched.stats()["events_put_count"] == 500
+
+
+def test_put_many_empty_and_dump():
+
+    store = EventStore(max_events_per_user=2)
+    store.put_many([], [])
+    assert store.stats()["events_put_count"] == 0
+
+    store.put_many([2, 1, 2, 2], [20, 10, 21, 22])
+    user_ids, offsets, item_ids = store.dump()
+    events = {
+        user_id: item_ids[offsets[row] : offsets[row + 1]].tolist()
+        for row, user_id in enumerate(user_ids.tolist())
+    }
+    # события каждого пользователя - от старых к новым
+    assert events == {1: [10], 2: [21, 22]}
+
+
+def test_lru_eviction():
+
+    store = _small_store(max_users=2)
+    store.put(1, 10)
+    store.put(2, 20)
+    store.get(1, 1)  # пользователь 1 становится недавним
+    store.put(3, 30)
+
+    assert store.get(2, 1) == []
+    assert store.get(1, 1) == [10]
+    assert store.get(3, 1) == [30]
+    assert store.stats()["users_evicted_lru_count"] == 1
+    assert store.stats()["events_users"] == 2
+
+    store.put_many([4, 5], [40, 50])
+    assert store.stats()["users_evicted_lru_count"] == 3
+
+
+def test_lru_eviction_is_global_across_stripes():
+
+    # user_id попадают в части по hash(user_id) % 4: пользователи 1 и 5 - в одной части
+    store = _small_store(max_users=3, n_stripes=4)
+    assert store.stats()["events_users_capacity"] == 3
+    store.put(1, 10)
+    store.put(2, 20)
+    store.put(3, 30)
+    store.get(1, 1)  # пользователь 1 становится недавним
+    store.put(5, 50)
+
+    # вытесняется самый давний пользователь всего хранилища, а не своей части
+    assert store.get(2, 1) == []
+    assert store.get(1, 1) == [10]
+    assert store.get(3, 1) == [30]
+    assert store.get(5, 1) == [50]
+    assert store.stats()["users_evicted_lru_count"] == 1
+
+    # в одну часть помещается весь бюджет, пока другие части пусты
+    store.put_many([9, 13, 17, 21], [90, 130, 170, 210])
+    assert store.stats()["events_users"] == 3
+    assert [store.get(user_id, 1) for user_id in (13, 17, 21)] == [[130], [170], [210]]
+
+
+def test_default_dtype_is_int32():
+
+    store = EventStore(max_events_per_user=4)
+    store.put(1, 10)
+    _, _, item_ids = store.dump()
+    assert item_ids.dtype == np.int32
+
+
+def test_ttl_eviction(monkeypatch):
+
+    now = [1000.0]
+    monkeypatch.setattr("event_store.time.monotonic", lambda: now[0])
+
+    store = EventStore(ttl=10, n_stripes=1)
+    store.put(1, 10)
+    store.put(2, 20)
+    now[0] += 5
+    store.get(2, 1)  # обращение продлевает жизнь пользователя 2
+    now[0] += 6
+
+    assert store.get(1, 1) == []
+    assert store.get(2, 1) == [20]
+    assert store.stats()["users_evicted_ttl_count"] == 1
+    assert store.stats()["users_evicted_lru_count"] == 0
+
+
+def test_seq():
+
+    store = EventStore()
+    assert store.seq(1) == 0
+
+    store.put(1, 10)
+    first = store.seq(1)
+    store.put_many([1, 1], [11, 12])
+    second = store.seq(1)
+    assert second > first
+
+    # чтение событий метку не меняет
+    store.get(1, 10)
+    assert store.seq(1) == second
+
+
+def test_seq_changes_after_lru_eviction():
+
+    store = _small_store(max_users=2)
+    store.put(1, 10)
+    seq_before = store.seq(1)
+
+    store.put(2, 20)
+    store.put(3, 30)  # вытесняет пользователя 1
+    assert store.seq(1) == 0
+
+    store.put(1, 11)
+    assert store.get(1, 4) == [11]
+    assert store.seq(1) != seq_before
+
+
+def test_seq_changes_after_ttl_eviction(monkeypatch):
+
+    now = [1000.0]
+    monkeypatch.setattr("event_store.time.monotonic", lambda: now[0])
+
+    store = EventStore(ttl=10, n_stripes=1)
+    store.put_many([1, 1], [10, 11])
+    seq_before = store.seq(1)
+
+    now[0] += 11
+    store.put_many([1], [12])
+    assert store.get(1, 10) == [12]
+    assert store.seq(1) != seq_before
+
+
+def test_seq_does_not_rewind_after_reopen(tmp_path):
+
+    store = DurableEventStore(str(tmp_path))
+    store.put(1, 10)
+    store.put(1, 11)
+    seq_before = store.seq(1)
+    store.close()
+
+    # после перезапуска пользователь восстанавливается из журнала с теми же событиями
+    reopened = DurableEventStore(str(tmp_path))
+    try:
+        assert reopened.get(1, 10) == [11, 10]
+        assert reopened.seq(1) > seq_before
+    finally:
+        reopened.close()
+
+
+def test_item_ids_beyond_int32():
+
+    big = 2**31 + 5
+    store = EventStore(max_events_per_user=3, n_stripes=1)
+    store.put(1, 10)
+    store.put(1, big)
+    # пакетная запись (ею же восстанавливаются журнал и снимок) не должна переполняться
+    store.put_many([2, 2], [-big, 20])
+
+    assert store.get(1, 3) == [big, 10]
+    assert store.get(2, 3) == [20, -big]
+    _, _, item_ids = store.dump()
+    assert item_ids.dtype == np.int64
+
+
+def test_item_ids_beyond_int32_survive_replay(tmp_path):
+
+    big = 2**31 + 5
+    store = DurableEventStore(str(tmp_path), flush_interval=3600, snapshot_bytes=2 * RECORD_DTYPE.itemsize)
+    store.put(1, big)
+    store.put_many([1], [big + 1])
+    store.flush()  # журнал вырос больше snapshot_bytes - события попадают в снимок
+    store.put(2, big + 2)
+    store.close()
+
+    reopened = DurableEventStore(str(tmp_path), flush_interval=3600)
+    try:
+        assert reopened.stats()["log_gen"] == 1
+        assert reopened.get(1, 10) == [big + 1, big]
+        assert reopened.get(2, 10) == [big + 2]
+    finally:
+        reopened.close()
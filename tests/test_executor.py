@@ -0,0 +1,84 @@
+# Тесты выполнения работы сервиса в пуле потоков: запуск - python -m pytest -q tests
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from executor import Offloader, ServiceOverloaded
+
+
+@pytest.fixture
+def small_offloader(service, monkeypatch):
+    """
+    Пул из одного потока без очереди и с коротким таймаутом вместо пула сервиса
+    """
+
+    offloader = Offloader(max_workers=1, max_queue=0, timeout=0.1)
+    monkeypatch.setattr(service, "offloader", offloader)
+    yield offloader
+    offloader.shutdown()
+
+
+def test_run_rejects_when_saturated_and_times_out():
+
+    offloader = Offloader(max_workers=1, max_queue=1, timeout=0.05)
+    release = threading.Event()
+
+    async def scenario():
+        busy = [asyncio.ensure_future(offloader.run(release.wait, timeout=5)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        # поток занят, очередь заполнена - третья задача не принимается
+        with pytest.raises(ServiceOverloaded):
+            await offloader.run(time.sleep, 0)
+        release.set()
+        await asyncio.gather(*busy)
+
+        with pytest.raises(asyncio.TimeoutError):
+            await offloader.run(time.sleep, 0.3)
+        # задача после таймаута продолжает занимать место, пока не завершится
+        assert offloader.stats()["offload_in_flight"] == 1
+        return await offloader.run(sum, [1, 2], timeout=1)
+
+    assert asyncio.run(scenario()) == 3
+    stats = offloader.stats()
+    assert stats["offload_rejected_count"] == 1
+    assert stats["offload_timeout_count"] == 1
+    assert stats["offload_in_flight"] == 0
+    offloader.shutdown()
+
+
+def test_saturated_pool_returns_503(client, small_offloader):
+
+    release = threading.Event()
+    # единственное место в пуле занимает другая задача
+    holder = threading.Thread(target=asyncio.run, args=(small_offloader.run(release.wait, timeout=5),))
+    holder.start()
+    while small_offloader.stats()["offload_in_flight"] == 0:
+        time.sleep(0.01)
+
+    try:
+        response = client.post("/recommendations", params={"user_id": 10**9 + 1, "k": 5})
+    finally:
+        release.set()
+        holder.join()
+
+    assert response.status_code == 503
+    assert small_offloader.stats()["offload_rejected_count"] == 1
+
+
+def test_slow_request_returns_504(service, client, small_offloader, monkeypatch):
+
+    get_scored = service.rec_store.get_scored
+
+    def slow_get_scored(*args, **kwargs):
+        time.sleep(0.3)
+        return get_scored(*args, **kwargs)
+
+    monkeypatch.setattr(service.rec_store, "get_scored", slow_get_scored)
+
+    response = client.post("/recommendations", params={"user_id": 10**9 + 2, "k": 5})
+
+    assert response.status_code == 504
+    assert small_offloader.stats()["offload_timeout_count"] == 1
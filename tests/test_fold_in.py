@@ -0,0 +1,99 @@
+# Тесты fold-in ALS: запуск - python -m pytest -q tests
+
+import threading
+import time
+
+import numpy as np
+
+from event_store import EventStore
+from fold_in import FoldIn, gramian
+
+
+def _model(n_items=20, n_factors=4):
+
+    item_factors = np.random.default_rng(0).normal(size=(n_items, n_factors)).astype(np.float32)
+
+    return item_factors, gramian(item_factors), 0.01, 1.0
+
+
+def _user_factors(fold_in, model, store, user_id):
+
+    items = np.asarray(store.get(user_id, store.max_events_per_user), dtype=np.int64)
+
+    return fold_in.user_factors(model, [user_id], [items], [(store.seq(user_id), 0)])[0]
+
+
+def test_vector_recomputed_after_eviction():
+
+    model = _model()
+    fold_in = FoldIn()
+    # в хранилище помещаются только два пользователя
+    store = EventStore(max_events_per_user=4, memory_budget=2 * (4 * 4 + 128), n_stripes=1)
+
+    store.put(1, 0)
+    before = _user_factors(fold_in, model, store, 1)
+    assert np.array_equal(_user_factors(fold_in, model, store, 1), before)
+    assert fold_in.stats()["fold_in_cache_hit_count"] == 1
+
+    store.put(2, 1)
+    store.put(3, 2)  # вытесняет пользователя 1
+    store.put(1, 5)  # после вытеснения у пользователя снова одно событие, но другое
+
+    after = _user_factors(fold_in, model, store, 1)
+    assert not np.allclose(after, before)
+    assert fold_in.stats()["fold_in_cache_miss_count"] == 2
+
+
+def test_recommend_never_returns_excluded_items():
+
+    model = _model(n_items=6)
+    fold_in = FoldIn()
+    items_per_user = [np.array([0, 1, 2]), np.array([5])]
+
+    # k больше числа непрослушанных треков: у пользователей 3 и 5 рекомендаций, а не k
+    lengths, ids, scores = fold_in.recommend(model, [1, 2], items_per_user, [(1, 0), (2, 0)], k=10)
+
+    assert lengths.tolist() == [3, 5]
+    assert sorted(ids[:3].tolist()) == [3, 4, 5]
+    assert sorted(ids[3:].tolist()) == [0, 1, 2, 3, 4]
+    assert np.isfinite(scores).all()
+    assert (np.diff(scores[:3]) <= 0).all() and (np.diff(scores[3:]) <= 0).all()
+
+
+
+class YieldingStats(dict):
+    """
+    Счётчики, отдающие управление другому потоку между чтением и записью значения:
+    += без блокировки теряет обновления
+    """
+
+    def __getitem__(self, key):
+
+        value = super().__getitem__(key)
+        time.sleep(0.0001)
+
+        return value
+
+
+def test_stats_counted_from_many_threads():
+
+    model = _model()
+    fold_in = FoldIn()
+    fold_in._stats = YieldingStats(fold_in._stats)
+    items = [np.array([0, 1])]
+    n_threads, n_calls = 8, 20
+
+    def work(thread):
+        for call in range(n_calls):
+            # каждый второй вызов - новый ключ (промах), остальные - попадания в кэш
+            fold_in.user_factors(model, [thread], items, [(call // 2, 0)])
+
+    threads = [threading.Thread(target=work, args=(thread,)) for thread in range(n_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = fold_in.stats()
+    assert stats["fold_in_cache_hit_count"] == n_threads * n_calls // 2
+    assert stats["fold_in_cache_miss_count"] == n_threads * n_calls // 2
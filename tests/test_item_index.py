@@ -0,0 +1,47 @@
+# Тесты индекса треков ItemIndex: запуск - python -m pytest -q tests
+# (utils читает переменные окружения при импорте, поэтому импортируется после фикстуры service)
+
+import numpy as np
+import pandas as pd
+
+
+def _items():
+
+    # track_id_enc 1 и 4 не заняты ни одним треком
+    return pd.DataFrame(
+        {
+            "track_id": [500, 100, 300, 200],
+            "track_id_enc": [3, 0, 5, 2],
+            "track_name": ["Five", "One", "Three", "Two"],
+            "artist_name": [["A", "B"], ["A"], ["C"], ["A"]],
+        }
+    )
+
+
+def test_encode_decode_with_gaps(service):
+
+    from utils import ItemIndex
+
+    index = ItemIndex.from_items(_items())
+
+    assert len(index) == 4
+    assert index.encode([100, 200, 300, 500, 999, 0]).tolist() == [0, 2, 5, 3, -1, -1]
+    # незанятые track_id_enc декодируются в -1
+    assert index.decode([0, 1, 2, 3, 4, 5]).tolist() == [100, -1, 200, 500, -1, 300]
+    assert index.decode(index.encode([300, 100])).tolist() == [300, 100]
+
+
+def test_names_and_arrays_roundtrip(service):
+
+    from utils import ItemIndex
+
+    index = ItemIndex.from_items(_items())
+    # неизвестные треки пропускаются, списки исполнителей склеиваются через ", "
+    expected = [("Five", "A, B"), ("One", "A"), ("Three", "C")]
+    assert index.names([500, 999, 100, 300]) == expected
+
+    restored = ItemIndex.from_arrays(
+        {name: np.asarray(array) for name, array in index.to_arrays().items()}
+    )
+    assert restored.names([500, 999, 100, 300]) == expected
+    assert restored.encode([200, 7]).tolist() == [2, -1]
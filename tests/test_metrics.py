@@ -0,0 +1,79 @@
+# Тесты выгрузки метрик в формате Prometheus: запуск - python -m pytest -q tests
+
+from metrics import Metrics
+
+
+def _families(text):
+    """
+    Семейства метрик из текста выгрузки: имя -> (help, type, имена сэмплов)
+    """
+
+    families = {}
+    name = None
+    for line in text.splitlines():
+        if line.startswith("# HELP "):
+            name, help = line[len("# HELP ") :].split(" ", 1)
+            assert name not in families, name
+            families[name] = [help, None, []]
+        elif line.startswith("# TYPE "):
+            type_name, type = line[len("# TYPE ") :].split(" ")
+            assert type_name == name, type_name
+            families[name][1] = type
+        elif line:
+            # сэмплы идут сразу за заголовком своего семейства
+            families[name][2].append(line.split("{")[0].split(" ")[0])
+
+    return families
+
+
+def _check(text):
+
+    families = _families(text)
+    assert families
+    for name, (help, type, samples) in families.items():
+        assert help and type, name
+        if type == "counter":
+            assert name.endswith("_total"), name
+            assert set(samples) <= {name}
+        elif type == "histogram":
+            assert set(samples) <= {f"{name}_bucket", f"{name}_sum", f"{name}_count"}
+        else:
+            assert set(samples) == {name}
+
+    return families
+
+
+def test_render_families():
+
+    registry = Metrics(prefix="test")
+    registry.counter("errors", "Errors by type", labels=("type",)).inc(type="timeout")
+    registry.counter("requests_total", "Requests").inc()
+    registry.gauge("queue", "Queue length").set(3)
+    registry.histogram("latency_seconds", "Latency").observe(0.01)
+    registry.collector(
+        lambda: {"put_count": 5, "size": 2, "written": 7, "name": "x"}, counters=("written",), source="store"
+    )
+
+    families = _check(registry.render())
+    assert {name: family[1] for name, family in families.items()} == {
+        "test_errors_total": "counter",
+        "test_requests_total": "counter",
+        "test_queue": "gauge",
+        "test_latency_seconds": "histogram",
+        "test_put_total": "counter",
+        "test_size": "gauge",
+        "test_written_total": "counter",
+    }
+    assert families["test_put_total"][0] == "put_count from store"
+
+
+def test_service_metrics(client):
+
+    client.post("/recommendations", params={"user_id": 1, "k": 5})
+    response = client.get("/metrics")
+    assert response.status_code == 200
+
+    families = _check(response.text)
+    assert families["recsys_request_personal_total"][1] == "counter"
+    assert families["recsys_errors_total"][1] == "counter"
+    assert families["recsys_process_memory_bytes"][1] == "gauge"
@@ -0,0 +1,90 @@
+# Тесты онлайн-поиска похожих треков: запуск - python -m pytest -q tests
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ann_index import IVFIndex, normalize_factors
+
+
+@pytest.fixture
+def small_catalog(service, monkeypatch):
+    """
+    Каталог из 8 track_id_enc, из которых 2 и 5 не заняты треками (декодируются в -1)
+    """
+
+    from utils import ItemIndex
+
+    rng = np.random.default_rng(0)
+    item_factors = rng.normal(size=(8, 4)).astype(np.float32)
+    # незанятые track_id_enc ближе всего к треку 0 - без исключения они попали бы в выдачу
+    item_factors[[2, 5]] = item_factors[0] * [[1.0], [0.9]]
+    items_enc = np.array([0, 1, 3, 4, 6, 7])
+    item_index = ItemIndex.from_items(
+        pd.DataFrame(
+            {
+                "track_id": items_enc * 100 + 100,
+                "track_id_enc": items_enc,
+                "track_name": [f"track {i}" for i in items_enc],
+                "artist_name": [f"artist {i}" for i in items_enc],
+            }
+        )
+    )
+    factors_normed = normalize_factors(item_factors)
+    monkeypatch.setattr(
+        service.artifacts,
+        "_values",
+        {
+            "item_index": item_index,
+            "item_factors_normed": factors_normed,
+            # один кластер - приближённый поиск просматривает все треки и совпадает с точным
+            "ann_index": IVFIndex.build(factors_normed, n_lists=1),
+        },
+    )
+
+    return item_factors, item_index
+
+
+def _reference(item_factors, item_index, track_ids, N):
+    """
+    similar_items модели ALS для каждого события отдельно (без самого трека и незанятых track_id_enc),
+    затем объединение по убыванию score без дубликатов
+    """
+
+    from implicit.als import AlternatingLeastSquares
+
+    als_model = AlternatingLeastSquares(factors=item_factors.shape[1])
+    als_model.item_factors = item_factors
+    missing = np.flatnonzero(item_index.missing(len(item_factors)))
+
+    pairs = []
+    for track_id_enc in item_index.encode(track_ids):
+        ids, scores = als_model.similar_items(int(track_id_enc), N=N, filter_items=missing)
+        pairs.extend(zip(item_index.decode(ids[1:]).tolist(), scores[1:].tolist()))
+
+    recs = {}
+    for track_id, score in sorted(pairs, key=lambda pair: -pair[1]):
+        recs.setdefault(track_id, score)
+
+    return list(recs), list(recs.values())
+
+
+@pytest.mark.parametrize("mode", ["exact", "approx"])
+@pytest.mark.parametrize("track_ids", [[100], [100, 500]])
+def test_no_missing_tracks_and_matches_similar_items(small_catalog, mode, track_ids):
+
+    from utils import get_als_i2i_batch
+
+    item_factors, item_index = small_catalog
+
+    recs, scores = get_als_i2i_batch(track_ids, N=4, mode=mode)
+    expected_recs, expected_scores = _reference(item_factors, item_index, track_ids, N=4)
+
+    assert -1 not in recs
+    # score близости симметричен: треки-запросы похожи друг на друга с одинаковым score, поэтому
+    # сравниваем score каждого трека и порядок по убыванию score, а не порядок равных
+    assert sorted(recs) == sorted(expected_recs)
+    np.testing.assert_allclose(
+        [dict(zip(recs, scores))[track_id] for track_id in expected_recs], expected_scores, rtol=1e-5
+    )
+    assert (np.diff(scores) <= 1e-6).all()
@@ -0,0 +1,49 @@
+# Тесты онлайн-ранжирования: признаки кандидатов должны совпадать с признаками при обучении модели.
+# Запуск - python -m pytest -q tests
+
+import numpy as np
+
+from ranker import FEATURES, Ranker, UserFeatures
+
+
+class RecordingModel:
+    """
+    Вместо CatBoostClassifier: запоминает матрицу признаков, вероятность - als_score
+    """
+
+    def __init__(self):
+
+        self.features = None
+
+    def predict_proba(self, features):
+
+        self.features = features
+        scores = np.nan_to_num(features[:, 0])
+
+        return np.column_stack([1 - scores, scores])
+
+
+def test_als_score_normalised_by_training_max():
+
+    model = RecordingModel()
+    user_features = UserFeatures(np.array([7], dtype=np.int64), np.array([[3, 30, 10]], dtype=np.float32))
+    ranker = Ranker(
+        model,
+        user_features,
+        top_track_ids=np.array([2], dtype=np.int64),
+        top_scores=np.array([0.5], dtype=np.float32),
+        als_max_score=8.0,
+    )
+
+    # als_score - исходные score ALS (персональные или fold-in), как их отдаёт rec_store
+    track_ids, _ = ranker.rank(
+        7,
+        [1, 2, 3],
+        {"als_score": ([1, 2], [6.0, 2.0]), "cnt_score": ([3], [0.9])},
+    )
+
+    als_score = model.features[:, FEATURES.index("als_score")]
+    assert np.allclose(als_score[:2], [0.75, 0.25])
+    assert np.isnan(als_score[2])
+    assert model.features[1, FEATURES.index("top_score")] == np.float32(0.5)
+    assert track_ids.tolist() == [1, 2, 3]
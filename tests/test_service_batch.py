@@ -0,0 +1,102 @@
+# /recommendations/batch должен выдавать то же, что /recommendations для каждого пользователя:
+# запуск - python -m pytest -q tests
+
+import json
+
+import numpy as np
+import pytest
+
+from blender import Blender
+from ranker import UserFeatures
+from response_cache import ResponseCache
+
+
+@pytest.mark.parametrize("strategy", Blender.STRATEGIES)
+def test_batch_matches_single(service, client, monkeypatch, strategy):
+
+    monkeypatch.setattr(
+        service, "blender", Blender(strategy=strategy, weights={"online": 0.3, "offline": 0.7})
+    )
+    # ответы /recommendations с другой стратегией не должны браться из кэша
+    monkeypatch.setattr(service, "response_cache", ResponseCache(max_size=0))
+
+    personal_user_ids = service.rec_store._recs["personal"].user_ids[:3].tolist()
+    # пользователь с событиями, но без персональных рекомендаций, и совсем новый пользователь
+    user_ids = personal_user_ids + [-1, -2]
+    track_ids = service.artifacts.item_index.decode([1, 2, 3]).tolist()
+    for user_id in personal_user_ids[:2] + [-1]:
+        for track_id in track_ids:
+            client.post("/put_user_event", params={"user_id": user_id, "item_id": track_id})
+    # прослушанная оффлайн-рекомендация не должна попасть ни в один ответ
+    listened = int(service.rec_store.get(personal_user_ids[0], 2)[1])
+    client.post("/put_user_event", params={"user_id": personal_user_ids[0], "item_id": listened})
+
+    # k больше числа оффлайн-рекомендаций: недостающее добирается ТОП-рекомендациями
+    k = 60
+    single = {
+        user_id: client.post("/recommendations", params={"user_id": user_id, "k": k}).json()["recs"]
+        for user_id in user_ids
+    }
+    response = client.post("/recommendations/batch", json={"user_ids": user_ids, "k": k})
+    assert response.status_code == 200
+    batch = {
+        line["user_id"]: line["recs"]
+        for line in map(json.loads, response.text.strip().splitlines())
+    }
+
+    assert batch == single
+    assert all(len(recs) == k for recs in batch.values())
+    assert listened not in batch[personal_user_ids[0]]
+
+
+class CountingModel:
+    """
+    Вместо CatBoostClassifier: вероятность - сумма известных score кандидата, считает вызовы
+    """
+
+    def __init__(self):
+
+        self.calls = 0
+
+    def predict_proba(self, features):
+
+        self.calls += 1
+        scores = np.nan_to_num(features[:, 0]) + np.nan_to_num(features[:, 1])
+
+        return np.column_stack([1 - scores, scores])
+
+
+def test_batch_ranked_like_single(service, client, monkeypatch):
+
+    model = CountingModel()
+    monkeypatch.setattr(service, "RANKING_ENABLED", True)
+    monkeypatch.setattr(service, "response_cache", ResponseCache(max_size=0))
+    top_track_ids = service.artifacts.item_index.decode(np.arange(10))
+    for name, value in {
+        "cb_model": model,
+        "user_features": UserFeatures(np.empty(0, dtype=np.int64), np.empty((0, 3), dtype=np.float32)),
+        "top_scores": (top_track_ids, np.linspace(1, 0.1, 10).astype(np.float32)),
+        "ranker_params": {"als_max_score": 1.0},
+    }.items():
+        monkeypatch.setitem(service.artifacts._values, name, value)
+
+    user_ids = service.rec_store._recs["personal"].user_ids[:3].tolist() + [-3]
+    client.post("/put_user_event", params={"user_id": user_ids[0], "item_id": int(top_track_ids[0])})
+
+    k = 20
+    single = {
+        user_id: client.post("/recommendations", params={"user_id": user_id, "k": k}).json()["recs"]
+        for user_id in user_ids
+    }
+    calls = model.calls
+    response = client.post("/recommendations/batch", json={"user_ids": user_ids, "k": k})
+    assert response.status_code == 200
+    batch = {
+        line["user_id"]: line["recs"]
+        for line in map(json.loads, response.text.strip().splitlines())
+    }
+
+    # каждый пользователь пакета ранжирован той же моделью и из того же пула кандидатов
+    assert model.calls - calls == len(user_ids)
+    assert batch == single
+    assert all(len(recs) == k for recs in batch.values())
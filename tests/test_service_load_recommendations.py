@@ -0,0 +1,49 @@
+# /load_recommendations читает локальные файлы только из RECS_LOAD_DIR: запуск - python -m pytest -q tests
+
+import os
+import shutil
+import time
+
+import pytest
+
+
+def _wait(client, job):
+
+    while job["status"] not in ("done", "failed"):
+        time.sleep(0.05)
+        job = client.get(f"/load_recommendations/{job['job_id']}").json()
+
+    return job
+
+
+@pytest.mark.parametrize("file_path", ["/etc/passwd", "../top_popular.parquet", "a/../../top_popular.parquet"])
+def test_paths_outside_load_dir_rejected(client, file_path):
+
+    response = client.get("/load_recommendations", params={"rec_type": "default", "file_path": file_path})
+    assert response.status_code == 400
+
+
+def test_symlink_out_of_load_dir_rejected(service, client, tmp_path):
+
+    outside = tmp_path / "top_popular.parquet"
+    shutil.copyfile(os.path.join(os.environ["ARTIFACT_STORAGE_DIR"], "top_popular.parquet"), outside)
+    os.symlink(outside, os.path.join(service.RECS_LOAD_DIR, "link.parquet"))
+
+    response = client.get("/load_recommendations", params={"rec_type": "default", "file_path": "link.parquet"})
+    assert response.status_code == 400
+
+
+def test_local_file_in_load_dir_and_storage_key_loaded(service, client):
+
+    version = service.rec_store.version("default")
+    shutil.copyfile(
+        os.path.join(os.environ["ARTIFACT_STORAGE_DIR"], "top_popular.parquet"),
+        os.path.join(service.RECS_LOAD_DIR, "top.parquet"),
+    )
+
+    for file_path in ("top.parquet", "top_popular.parquet"):
+        response = client.get("/load_recommendations", params={"rec_type": "default", "file_path": file_path})
+        assert response.status_code == 200
+        assert _wait(client, response.json())["status"] == "done"
+
+    assert service.rec_store.version("default") == version + 2
@@ -0,0 +1,99 @@
+# Тесты оффлайн-расчёта похожих треков: запуск - python -m pytest -q tests
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from similar_items import build_similar, join_users, load_track_ids, part_path
+
+
+def _model(n_items=50, n_factors=8):
+
+    rng = np.random.default_rng(0)
+    item_factors = rng.normal(size=(n_items, n_factors)).astype(np.float32)
+    track_ids = np.arange(n_items, dtype=np.int64) * 10
+
+    return item_factors, track_ids
+
+
+def test_resume_skips_ready_parts(tmp_path):
+
+    item_factors, track_ids = _model()
+    out_dir = str(tmp_path / "similar")
+
+    assert build_similar(item_factors, track_ids, out_dir, N=3, part_size=20, n_jobs=1) == 50 * 3
+    # прерванный запуск: одной части нет
+    os.remove(part_path(out_dir, 1))
+    assert build_similar(item_factors, track_ids, out_dir, N=3, part_size=20, n_jobs=1) == 20 * 3
+
+    similar = pd.read_parquet(out_dir)
+    assert len(similar) == 50 * 3
+    assert sorted(similar["track_id"].unique()) == track_ids.tolist()
+    assert not [name for name in os.listdir(out_dir) if name.endswith(".tmp")]
+
+
+@pytest.mark.parametrize(
+    "changed",
+    [{"N": 4}, {"part_size": 10}, {"queries_enc": np.arange(10)}, {"factors_scale": 2}],
+)
+def test_resume_with_other_parameters_fails(tmp_path, changed):
+
+    item_factors, track_ids = _model()
+    out_dir = str(tmp_path / "similar")
+    build_similar(item_factors, track_ids, out_dir, N=3, part_size=20, n_jobs=1)
+
+    params = {"N": 3, "part_size": 20, "queries_enc": None, **changed}
+    factors = item_factors * params.pop("factors_scale", 1)
+    with pytest.raises(ValueError):
+        build_similar(factors, track_ids, out_dir, n_jobs=1, **params)
+
+
+def test_missing_encodings_not_written(tmp_path):
+
+    item_factors, track_ids = _model(n_items=12)
+    # track_id_enc без трека в items
+    track_ids[[2, 5, 7]] = -1
+    out_dir = str(tmp_path / "similar")
+
+    rows = build_similar(item_factors, track_ids, out_dir, N=10, part_size=5, n_jobs=1)
+
+    similar = pd.read_parquet(out_dir)
+    assert rows == len(similar) == 9 * 8
+    assert (similar[["track_id", "similar_track_id"]] >= 0).all().all()
+    assert np.isfinite(similar["score"]).all()
+    # у каждого трека все 8 других треков с rank подряд от 1
+    for _, group in similar.groupby("track_id"):
+        assert group["rank"].tolist() == list(range(1, 9))
+
+
+def test_load_track_ids_sized_by_model(tmp_path):
+
+    items_path = str(tmp_path / "items.parquet")
+    # в items нет последних track_id_enc модели и есть лишний трек вне её факторов
+    pd.DataFrame({"track_id": [10, 30, 90], "track_id_enc": [1, 3, 9]}).to_parquet(items_path)
+
+    track_ids = load_track_ids(items_path, n_items=6)
+    assert track_ids.tolist() == [-1, 10, -1, 30, -1, -1]
+
+
+def test_join_users_matches_candidates_input(tmp_path):
+
+    item_factors, track_ids = _model(n_items=20)
+    out_dir = str(tmp_path / "similar")
+    users_tracks = pd.DataFrame({"user_id": [1, 1, 2], "track_id": [0, 10, 10]})
+    build_similar(item_factors, track_ids, out_dir, N=3, queries_enc=[0, 1], n_jobs=1)
+
+    similar = pd.read_parquet(out_dir)
+    users_similar = join_users(similar, users_tracks)
+
+    assert users_similar.columns.tolist() == ["user_id", "track_id", "score"]
+    assert not users_similar.duplicated(["user_id", "track_id"]).any()
+    # у пользователя 2 - похожие треки его трека 10, у пользователя 1 - лучший score по обоим трекам
+    expected = similar[similar["track_id"] == 10].set_index("similar_track_id")["score"]
+    user_2 = users_similar[users_similar["user_id"] == 2].set_index("track_id")["score"]
+    assert user_2.sort_index().equals(expected.sort_index().rename_axis("track_id"))
+    best = similar.groupby("similar_track_id")["score"].max()
+    user_1 = users_similar[users_similar["user_id"] == 1].set_index("track_id")["score"]
+    assert user_1.sort_index().equals(best.sort_index().rename_axis("track_id"))
@@ -1,13 +1,35 @@
+import numpy as np
 import pandas as pd
 import logging
 
 import boto3
 from dotenv import load_dotenv
+import functools
+import json
 import os
-import io
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 from implicit.als import AlternatingLeastSquares
 
+from ann_index import IVFIndex, normalize_factors
+from metrics import stage_seconds
+from ranker import Ranker, UserFeatures
+from similar_items import exact_top_k
+from fold_in import FoldIn, gramian
+from event_store import DurableEventStore, EventStore
+from artifacts import (
+    ArtifactCache,
+    ArtifactGenerations,
+    LocalStorage,
+    S3Storage,
+    load_arrays,
+    save_arrays,
+)
+
 load_dotenv()
 
 # Получаем уже созданный логгер "uvicorn.error", чтобы через него можно было логировать собственные сообщения в тот же поток,
@@ -30,18 +52,687 @@ s3 = session.client(
 )
 
 
-# модель ALS для выдачи контентных онлайн-рекомендаций
-als_model = AlternatingLeastSquares(
-    factors=50, iterations=50, regularization=0.05, random_state=0
-)
-obj_als_model = s3.get_object(Bucket=BUCKET_NAME, Key=os.environ.get("KEY_ALS_MODEL"))
-als_model = als_model.load(io.BytesIO(obj_als_model["Body"].read()))
+# Артефакты скачиваются в локальный кэш (ARTIFACT_CACHE_DIR) и при повторных запусках берутся из него.
+# Если задан ARTIFACT_STORAGE_DIR, артефакты читаются из этой папки вместо S3
+ARTIFACT_CACHE_DIR = os.environ.get("ARTIFACT_CACHE_DIR", "artifact_cache")
+ARTIFACT_STORAGE_DIR = os.environ.get("ARTIFACT_STORAGE_DIR")
+if ARTIFACT_STORAGE_DIR:
+    artifact_storage = LocalStorage(ARTIFACT_STORAGE_DIR)
+else:
+    artifact_storage = S3Storage(s3, BUCKET_NAME)
+artifact_cache = ArtifactCache(artifact_storage, ARTIFACT_CACHE_DIR)
 
-# также понадобится items.parquet (для преобразования идентификаторов треков)
-obj_items_parquet = s3.get_object(
-    Bucket=BUCKET_NAME, Key=os.environ.get("KEY_ITEMS_PARQUET")
-)
-items = pd.read_parquet(io.BytesIO(obj_items_parquet["Body"].read()))
+# режим поиска похожих треков: exact - полный перебор всех треков, approx - приближённый поиск по IVF-индексу
+ALS_I2I_MODE = os.environ.get("ALS_I2I_MODE", "exact")
+# сколько кластеров IVF-индекса просматривать при приближённом поиске
+ALS_ANN_N_PROBE = int(os.environ.get("ALS_ANN_N_PROBE", 8))
+
+# персональные рекомендации ALS для пользователей без оффлайн-рекомендаций (fold-in по событиям из Event Store)
+ALS_FOLD_IN = os.environ.get("ALS_FOLD_IN", "0") == "1"
+
+# онлайн-ранжирование кандидатов моделью CatBoost включается, если задан ключ модели KEY_CB_MODEL
+RANKING_ENABLED = bool(os.environ.get("KEY_CB_MODEL"))
+
+
+class NameTable:
+    """
+    Компактная таблица строк: уникальные значения хранятся одним utf-8 буфером со смещениями,
+    а каждой строке исходной колонки соответствует только int32-код
+    """
+
+    def __init__(self, codes, offsets, data):
+
+        self.codes = codes  # код значения для каждой позиции
+        self.offsets = offsets  # границы уникальных значений в data
+        self.data = data  # уникальные значения, склеенные в один буфер байт
+
+    @classmethod
+    def from_values(cls, values):
+        """
+        Строит таблицу по последовательности строк (или списков строк - они склеиваются через ", ")
+        """
+
+        values = [", ".join(v) if not isinstance(v, str) else v for v in values]
+        categorical = pd.Categorical(values)
+        encoded = [name.encode("utf-8") for name in categorical.categories]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(name) for name in encoded])
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+        return cls(categorical.codes.astype(np.int32), offsets, data)
+
+    def lookup(self, positions):
+        """
+        Возвращает список строк для указанных позиций
+        """
+
+        names = []
+        for code in self.codes[positions]:
+            start, end = self.offsets[code], self.offsets[code + 1]
+            names.append(self.data[start:end].tobytes().decode("utf-8"))
+
+        return names
+
+
+# Индекс идентификаторов треков: строится один раз при загрузке items.parquet
+# и заменяет поиск по DataFrame (items.query) на векторные операции над массивами
+class ItemIndex:
+    """
+    Методы:
+
+    encode - переводит track_id в track_id_enc (для отсутствующих в каталоге треков возвращает -1).
+    decode - переводит track_id_enc обратно в track_id.
+    missing - маска track_id_enc без трека в каталоге (их нельзя выдавать рекомендациями).
+    names - возвращает названия треков и исполнителей по track_id.
+    """
+
+    def __init__(self, sorted_track_ids, sorted_track_ids_enc, enc_to_track_id, track_names, artist_names):
+
+        self._sorted_track_ids = sorted_track_ids  # отсортированные track_id
+        self._sorted_track_ids_enc = sorted_track_ids_enc  # track_id_enc в том же порядке
+        self._enc_to_track_id = enc_to_track_id  # плотная таблица track_id_enc -> track_id
+        self._track_names = track_names  # NameTable, позиция = track_id_enc
+        self._artist_names = artist_names  # NameTable, позиция = track_id_enc
+        self._missing = {}  # n_items -> маска missing (считается один раз)
+
+    @classmethod
+    def from_items(cls, items):
+        """
+        Строит индекс по датафрейму items (колонки track_id, track_id_enc, track_name, artist_name)
+        """
+
+        track_ids = items["track_id"].to_numpy(dtype=np.int64)
+        track_ids_enc = items["track_id_enc"].to_numpy(dtype=np.int64)
+
+        order = np.argsort(track_ids, kind="stable")
+
+        enc_to_track_id = np.full(track_ids_enc.max() + 1, -1, dtype=np.int64)
+        enc_to_track_id[track_ids_enc] = track_ids
+
+        # названия раскладываем по track_id_enc, чтобы искать их той же позицией, что и в факторах ALS
+        # (у незанятых track_id_enc - пустая строка)
+        track_names = np.full(len(enc_to_track_id), "", dtype=object)
+        track_names[track_ids_enc] = items["track_name"].to_numpy()
+        artist_names = np.full(len(enc_to_track_id), "", dtype=object)
+        artist_names[track_ids_enc] = items["artist_name"].to_numpy()
+        track_names = NameTable.from_values(track_names)
+        artist_names = NameTable.from_values(artist_names)
+
+        return cls(track_ids[order], track_ids_enc[order], enc_to_track_id, track_names, artist_names)
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        Собирает индекс из словаря массивов (см. to_arrays)
+        """
+
+        return cls(
+            arrays["sorted_track_ids"],
+            arrays["sorted_track_ids_enc"],
+            arrays["enc_to_track_id"],
+            NameTable(
+                arrays["track_names_codes"],
+                arrays["track_names_offsets"],
+                arrays["track_names_data"],
+            ),
+            NameTable(
+                arrays["artist_names_codes"],
+                arrays["artist_names_offsets"],
+                arrays["artist_names_data"],
+            ),
+        )
+
+    def to_arrays(self):
+        """
+        Возвращает все данные индекса в виде словаря плоских массивов (для сохранения в .npy)
+        """
+
+        arrays = {
+            "sorted_track_ids": self._sorted_track_ids,
+            "sorted_track_ids_enc": self._sorted_track_ids_enc,
+            "enc_to_track_id": self._enc_to_track_id,
+        }
+        for prefix, table in [
+            ("track_names", self._track_names),
+            ("artist_names", self._artist_names),
+        ]:
+            arrays[f"{prefix}_codes"] = table.codes
+            arrays[f"{prefix}_offsets"] = table.offsets
+            arrays[f"{prefix}_data"] = table.data
+
+        return arrays
+
+    def __len__(self):
+
+        return len(self._sorted_track_ids)
+
+    def encode(self, track_ids):
+        """
+        Возвращает массив track_id_enc для массива track_id (-1 для неизвестных треков)
+        """
+
+        track_ids = np.asarray(track_ids, dtype=np.int64)
+        if len(self._sorted_track_ids) == 0:
+            return np.full(track_ids.shape, -1, dtype=np.int64)
+
+        positions = np.searchsorted(self._sorted_track_ids, track_ids)
+        positions = np.minimum(positions, len(self._sorted_track_ids) - 1)
+        found = self._sorted_track_ids[positions] == track_ids
+
+        return np.where(found, self._sorted_track_ids_enc[positions], -1)
+
+    def decode(self, track_ids_enc):
+        """
+        Возвращает массив track_id для массива track_id_enc
+        """
+
+        return self._enc_to_track_id[np.asarray(track_ids_enc, dtype=np.int64)]
+
+    def missing(self, n_items):
+        """
+        Булева маска длины n_items (число строк факторов модели): True у track_id_enc, которые
+        не декодируются в трек (незанятые и лежащие за пределами каталога)
+        """
+
+        mask = self._missing.get(n_items)
+        if mask is None:
+            mask = np.ones(n_items, dtype=bool)
+            known = min(n_items, len(self._enc_to_track_id))
+            mask[:known] = self._enc_to_track_id[:known] < 0
+            self._missing[n_items] = mask
+
+        return mask
+
+    def names(self, track_ids):
+        """
+        Возвращает список пар (название трека, исполнитель) для известных треков из track_ids
+        """
+
+        track_ids_enc = self.encode(track_ids)
+        track_ids_enc = track_ids_enc[track_ids_enc >= 0]
+
+        return list(
+            zip(
+                self._track_names.lookup(track_ids_enc),
+                self._artist_names.lookup(track_ids_enc),
+            )
+        )
+
+
+def load_cb_model(arrays):
+    """
+    Собирает модель CatBoost из байтов файла модели (catboost нужен только при включённом ранжировании)
+    """
+
+    from catboost import CatBoostClassifier
+
+    cb_model = CatBoostClassifier()
+    cb_model.load_model(blob=np.asarray(arrays["model"]).tobytes())
+
+    return cb_model
+
+
+def load_als_model(arrays):
+    """
+    Собирает модель ALS из массивов npz-файла (как AlternatingLeastSquares.load, но факторы - memory map)
+    """
+
+    als_model = AlternatingLeastSquares()
+    for name, value in arrays.items():
+        if name == "dtype":
+            value = np.dtype(str(value))
+        elif value.shape == ():
+            value = value.item()
+        setattr(als_model, name, value)
+
+    return als_model
+
+
+# Тяжёлые артефакты сервиса загружаются лениво (при первом обращении) или все сразу параллельно (load_all).
+# Каждый артефакт берётся из локального кэша: при повторном запуске не нужно ни скачивать файлы,
+# ни заново строить производные массивы - они открываются через memory map
+class Artifacts:
+    """
+    Атрибуты:
+
+    als_model - модель ALS для выдачи контентных онлайн-рекомендаций.
+    als_gramian - YtY по факторам треков ALS (для расчёта векторов новых пользователей).
+    item_factors_normed - нормированные факторы треков (по ним ищутся похожие треки).
+    item_index - индекс track_id <-> track_id_enc и названия треков (из items.parquet).
+    ann_index - IVF-индекс для приближённого поиска похожих треков.
+    cb_model - модель CatBoost для онлайн-ранжирования кандидатов.
+    user_features - признаки пользователей для ранжирования (из get_user_features).
+    top_scores - отсортированные track_id ТОП-рекомендаций и их popularity_weighted (признак top_score).
+    ranker_params - параметры признаков модели CatBoost (als_max_score - нормировка als_score).
+    ranker - ранжирование кандидатов (собирается из четырёх артефактов выше).
+    """
+
+    NAMES = (
+        "als_model",
+        "als_gramian",
+        "item_factors_normed",
+        "item_index",
+        "ann_index",
+        "cb_model",
+        "user_features",
+        "top_scores",
+        "ranker_params",
+    )
+
+    # как собрать артефакт из его массивов
+    FROM_ARRAYS = {
+        "als_model": load_als_model,
+        "als_gramian": lambda arrays: arrays["gramian"],
+        "item_factors_normed": lambda arrays: arrays["item_factors_normed"],
+        "item_index": ItemIndex.from_arrays,
+        "ann_index": lambda arrays: IVFIndex(**arrays),
+        "cb_model": load_cb_model,
+        "user_features": UserFeatures.from_arrays,
+        "top_scores": lambda arrays: (arrays["track_ids"], arrays["scores"]),
+        "ranker_params": lambda arrays: {name: value.item() for name, value in arrays.items()},
+    }
+
+    def __init__(self, cache):
+
+        self._cache = cache
+        self._values = {}
+        self._locks = {name: threading.Lock() for name in self.NAMES}
+        self.load_seconds = {}  # время загрузки каждого артефакта
+        self.version = 0  # растёт при каждой подмене артефактов (attach)
+
+    def get(self, name):
+        """
+        Возвращает артефакт, загружая его при первом обращении
+        """
+
+        if name not in self._values:
+            with self._locks[name]:
+                if name not in self._values:
+                    start = time.perf_counter()
+                    self._values[name] = self.FROM_ARRAYS[name](self.arrays(name))
+                    self.load_seconds[name] = round(time.perf_counter() - start, 3)
+                    stage_seconds.observe(time.perf_counter() - start, stage="artifact_load")
+                    logger.info(f"Loaded {name} in {self.load_seconds[name]}s")
+
+        return self._values[name]
+
+    def load_all(self, names=None):
+        """
+        Параллельно загружает перечисленные артефакты (по умолчанию - все нужные в текущем режиме)
+        """
+
+        if names is None:
+            names = self.default_names()
+
+        with ThreadPoolExecutor(max_workers=len(names)) as executor:
+            list(executor.map(self.get, names))
+
+    def default_names(self):
+        """
+        Артефакты, которые нужны сервису в текущем режиме
+        """
+
+        names = ["item_factors_normed", "item_index"]
+        if ALS_I2I_MODE == "approx":
+            names.append("ann_index")
+        if ALS_FOLD_IN:
+            names.extend(["als_model", "als_gramian"])
+        if RANKING_ENABLED:
+            names.extend(["cb_model", "user_features", "top_scores", "ranker_params"])
+
+        return names
+
+    def arrays(self, name):
+        """
+        Массивы артефакта из локального кэша (строятся при первом обращении)
+        """
+
+        return getattr(self, f"_arrays_{name}")()
+
+    def attach(self, arrays):
+        """
+        Подменяет артефакты уже готовыми массивами (словарь name -> словарь массивов)
+        """
+
+        values = {name: self.FROM_ARRAYS[name](value) for name, value in arrays.items()}
+        self._values = {**self._values, **values}
+        self.version += 1
+        for name in values:
+            self.load_seconds.setdefault(name, 0.0)
+
+    def loaded(self):
+        """
+        Список уже загруженных артефактов
+        """
+
+        return [name for name in self.NAMES if name in self._values]
+
+    def _arrays_als_model(self):
+
+        return self._cache.arrays(
+            os.environ.get("KEY_ALS_MODEL"), "als_model", lambda path: dict(np.load(path))
+        )
+
+    def _arrays_als_gramian(self):
+
+        def build(path):
+            with np.load(path) as data:
+                return {"gramian": gramian(data["item_factors"])}
+
+        return self._cache.arrays(os.environ.get("KEY_ALS_MODEL"), "als_gramian", build)
+
+    def _arrays_item_factors_normed(self):
+
+        def build(path):
+            with np.load(path) as data:
+                return {"item_factors_normed": normalize_factors(data["item_factors"])}
+
+        return self._cache.arrays(os.environ.get("KEY_ALS_MODEL"), "item_factors_normed", build)
+
+    def _arrays_item_index(self):
+
+        # также понадобится items.parquet (для преобразования идентификаторов треков)
+        def build(path):
+            items = pd.read_parquet(
+                path, columns=["track_id", "track_id_enc", "track_name", "artist_name"]
+            )
+            return ItemIndex.from_items(items).to_arrays()
+
+        return self._cache.arrays(os.environ.get("KEY_ITEMS_PARQUET"), "item_index", build)
+
+    def _arrays_ann_index(self):
+
+        # готовый индекс из хранилища (KEY_ALS_ANN_INDEX) или построенный по модели
+        key_ann_index = os.environ.get("KEY_ALS_ANN_INDEX")
+        if key_ann_index:
+            return self._cache.arrays(
+                key_ann_index, "ann_index", lambda path: dict(np.load(path))
+            )
+
+        item_factors_normed = self.item_factors_normed
+
+        return self._cache.arrays(
+            os.environ.get("KEY_ALS_MODEL"),
+            "ann_index",
+            lambda path: IVFIndex.build(item_factors_normed).to_arrays(),
+        )
+
+    def _arrays_cb_model(self):
+
+        # файл модели храним как массив байтов - так он попадает и в общие поколения артефактов
+        return self._cache.arrays(
+            os.environ.get("KEY_CB_MODEL"),
+            "cb_model_bytes",
+            lambda path: {"model": np.fromfile(path, dtype=np.uint8)},
+        )
+
+    def _arrays_user_features(self):
+
+        # результат get_user_features из ноутбука (для пользователей, которым строятся рекомендации)
+        return self._cache.arrays(
+            os.environ.get("KEY_USER_FEATURES_PARQUET"),
+            "user_features",
+            lambda path: UserFeatures.from_frame(pd.read_parquet(path)).to_arrays(),
+        )
+
+    def _arrays_top_scores(self):
+
+        def build(path):
+            top_popular = pd.read_parquet(path, columns=["track_id", "popularity_weighted"])
+            top_popular = top_popular.drop_duplicates("track_id").sort_values("track_id")
+            return {
+                "track_ids": top_popular["track_id"].to_numpy(dtype=np.int64),
+                "scores": top_popular["popularity_weighted"].to_numpy(dtype=np.float32),
+            }
+
+        return self._cache.arrays(os.environ.get("KEY_TOP_POPULAR_PARQUET"), "top_scores", build)
+
+    def _arrays_ranker_params(self):
+
+        # сохраняется вместе с моделью CatBoost (ranker_params.json из candidates_pipeline.py)
+        def build(path):
+            with open(path) as f:
+                params = json.load(f)
+            return {"als_max_score": np.float64(params["als_max_score"])}
+
+        return self._cache.arrays(
+            os.environ.get("KEY_RANKER_PARAMS_JSON"), "ranker_params", build
+        )
+
+    @property
+    def als_model(self):
+        return self.get("als_model")
+
+    @property
+    def als_gramian(self):
+        return self.get("als_gramian")
+
+    @property
+    def fold_in_model(self):
+        als_model = self.als_model
+        return als_model.item_factors, self.als_gramian, als_model.regularization, als_model.alpha
+
+    @property
+    def item_factors_normed(self):
+        return self.get("item_factors_normed")
+
+    @property
+    def item_index(self):
+        return self.get("item_index")
+
+    @property
+    def ann_index(self):
+        return self.get("ann_index")
+
+    @property
+    def cb_model(self):
+        return self.get("cb_model")
+
+    @property
+    def user_features(self):
+        return self.get("user_features")
+
+    @property
+    def top_scores(self):
+        return self.get("top_scores")
+
+    @property
+    def ranker_params(self):
+        return self.get("ranker_params")
+
+    @property
+    def ranker(self):
+        top_track_ids, top_scores = self.top_scores
+        return Ranker(
+            self.cb_model,
+            self.user_features,
+            top_track_ids,
+            top_scores,
+            als_max_score=self.ranker_params["als_max_score"],
+        )
+
+
+artifacts = Artifacts(artifact_cache)
+
+
+# Персональные рекомендации в колоночном (CSR) виде: вместо датафрейма с индексом по user_id
+# храним отсортированный массив user_id, смещения и плоские массивы track_id / score.
+# Массивы сохраняются в .npy-файлы и открываются через memory map, поэтому не копируются в память процесса
+class CSRRecs:
+    """
+    Методы:
+
+    from_frame - строит хранилище по датафрейму с колонками user_id, track_id, score.
+    save / load - сохраняет массивы в папку и открывает их через memory map.
+    get - возвращает срезы track_id и score пользователя (без копирования) или None.
+    """
+
+    ARRAYS = ("user_ids", "offsets", "track_ids", "scores")
+
+    def __init__(self, user_ids, offsets, track_ids, scores):
+
+        self.user_ids = user_ids  # отсортированные user_id (int64)
+        self.offsets = offsets  # границы рекомендаций пользователя в track_ids / scores (int64)
+        self.track_ids = track_ids  # рекомендованные track_id (int32)
+        self.scores = scores  # scores рекомендаций (float32)
+
+    @classmethod
+    def from_frame(cls, recs):
+        """
+        Строит хранилище по датафрейму recs (порядок рекомендаций внутри пользователя сохраняется)
+        """
+
+        user_ids = recs["user_id"].to_numpy(dtype=np.int64)
+        order = np.argsort(user_ids, kind="stable")
+        unique_user_ids, counts = np.unique(user_ids[order], return_counts=True)
+
+        offsets = np.zeros(len(unique_user_ids) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+
+        track_ids = recs["track_id"].to_numpy()[order]
+        track_ids_dtype = np.int32 if track_ids.max(initial=0) < 2**31 else np.int64
+
+        return cls(
+            unique_user_ids,
+            offsets,
+            track_ids.astype(track_ids_dtype),
+            recs["score"].to_numpy()[order].astype(np.float32),
+        )
+
+    def to_arrays(self):
+        """
+        Возвращает словарь массивов (ключи совпадают с аргументами конструктора)
+        """
+
+        return {name: getattr(self, name) for name in self.ARRAYS}
+
+    def save(self, path):
+        """
+        Сохраняет массивы в папку path
+        """
+
+        save_arrays(self.to_arrays(), path)
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        """
+        Открывает массивы из папки path (по умолчанию через memory map, только для чтения)
+        """
+
+        arrays = load_arrays(path, mmap_mode=mmap_mode)
+
+        return cls(*[arrays[name] for name in cls.ARRAYS])
+
+    def __len__(self):
+
+        return len(self.user_ids)
+
+    def take(self, user_ids, k: int = 100):
+        """
+        Рекомендации сразу для нескольких пользователей (не больше k на пользователя)
+
+        Возвращает (found, lengths, track_ids, scores): найден ли пользователь, сколько у него рекомендаций
+        и плоские массивы рекомендаций и их score всех пользователей подряд
+        """
+
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        if len(self.user_ids) == 0:
+            # в пустом хранилище никого нет (offsets из одного элемента - обращаться по позиции нельзя)
+            return (
+                np.zeros(len(user_ids), dtype=bool),
+                np.zeros(len(user_ids), dtype=np.int64),
+                self.track_ids[:0],
+                self.scores[:0],
+            )
+
+        positions = np.searchsorted(self.user_ids, user_ids)
+        positions = np.minimum(positions, len(self.user_ids) - 1)
+        found = self.user_ids[positions] == user_ids
+
+        starts = self.offsets[positions]
+        lengths = np.where(
+            found, np.minimum(self.offsets[positions + 1] - starts, k), 0
+        )
+        flat = np.repeat(starts, lengths) + segment_positions(lengths)
+
+        return found, lengths, self.track_ids[flat], self.scores[flat]
+
+    def get(self, user_id: int):
+        """
+        Возвращает (track_ids, scores) пользователя - срезы без копирования, или None, если пользователя нет
+        """
+
+        position = np.searchsorted(self.user_ids, user_id)
+        if position == len(self.user_ids) or self.user_ids[position] != user_id:
+            return None
+
+        start, end = self.offsets[position], self.offsets[position + 1]
+
+        return self.track_ids[start:end], self.scores[start:end]
+
+
+# папка, в которой хранятся массивы персональных рекомендаций (открываются через memory map)
+RECS_CACHE_DIR = os.environ.get("RECS_CACHE_DIR", "recs_cache")
+
+
+def read_parquet(path, **kwargs):
+    """
+    Читает parquet из локального файла, если он существует, иначе - по ключу path из хранилища (через кэш)
+    """
+
+    if not os.path.exists(path):
+        path = artifact_cache.fetch(path)
+
+    return pd.read_parquet(path, **kwargs)
+
+
+def recs_arrays(type, path, progress=None, **kwargs):
+    """
+    Строит массивы рекомендаций указанного типа из файла path (локальный файл или ключ в S3):
+    для персональных - массивы CSRRecs, для ТОП-рекомендаций - track_ids
+    """
+
+    def report(stage, value):
+        if progress is not None:
+            progress(stage, value)
+
+    report("downloading", 0.1)
+    if not os.path.exists(path):
+        # каждая загрузка заново узнаёт версию ключа в хранилище - файл мог обновиться
+        artifact_cache.refresh(path)
+    if type == "personal" and not os.path.exists(path):
+        # массивы для версии файла в хранилище строятся один раз и берутся из кэша артефактов
+        def build(local_path):
+            report("building", 0.5)
+            return CSRRecs.from_frame(pd.read_parquet(local_path, **kwargs)).to_arrays()
+
+        return artifact_cache.arrays(path, "csr_recs", build)
+
+    recs = read_parquet(path, **kwargs)
+    report("building", 0.5)
+    if type == "personal":
+        return CSRRecs.from_frame(recs).to_arrays()
+
+    return {"track_ids": recs["track_id"].to_numpy(dtype=np.int64)}
+
+
+def rank_scores(n):
+    """
+    Score по рангу для рекомендаций без score: от 1 (первая) до 0 (последняя)
+    """
+
+    return np.linspace(1.0, 0.0, n) if n > 1 else np.ones(n)
+
+
+def recs_from_arrays(type, arrays):
+    """
+    Собирает рекомендации из массивов (см. recs_arrays)
+    """
+
+    if type == "personal":
+        return CSRRecs(**arrays)
+
+    return arrays["track_ids"]
 
 
 # Подключение готовых рекомендаций (в отдельном классе)
@@ -58,117 +749,589 @@ class Recommendations:
     def __init__(self):
 
         self._recs = {"personal": None, "default": None}
+        self._versions = {"personal": 0, "default": 0}
+        self._paths = {"personal": None, "default": None}
+        # загрузки выполняются по одной, чтение при этом не блокируется
+        self._load_lock = threading.Lock()
         self._stats = {
             "request_personal_count": 0,  # счетчик персональных рекомендаций
             "request_default_count": 0,  # счетчик топ-рекомендаций
+            "request_fallback_count": 0,  # счетчик рекомендаций fallback для пользователей без персональных
         }
 
-    def load(self, type, path, **kwargs):
+    def load(self, type, path, progress=None, **kwargs):
         """
-        Загружает рекомендации из файла
+        Загружает рекомендации из файла path (локальный файл или ключ в S3)
 
         type == "personal" - персональные (при помощи ALS)
         type == "default" - топ-рекомендации
+
+        Новая версия полностью собирается отдельно от текущей и подменяет её одним присваиванием,
+        поэтому параллельные запросы до подмены получают старую версию. Возвращает номер версии.
+        progress(stage, value) - необязательный callback для отчёта о ходе загрузки
         """
 
-        logger.info(f"Loading recommendations, type: {type}")
+        def report(stage, value):
+            if progress is not None:
+                progress(stage, value)
 
-        if type == "personal":
-            obj_personal_als_parquet = s3.get_object(
-                Bucket=BUCKET_NAME, Key=os.environ.get("KEY_PERSONAL_ALS_PARQUET")
-            )
-            self._recs[type] = pd.read_parquet(
-                io.BytesIO(obj_personal_als_parquet["Body"].read()), **kwargs
-            ).set_index("user_id")
-        else:
-            obj_top_popular_parquet = s3.get_object(
-                Bucket=BUCKET_NAME, Key=os.environ.get("KEY_TOP_POPULAR_PARQUET")
-            )
-            self._recs[type] = pd.read_parquet(
-                io.BytesIO(obj_top_popular_parquet["Body"].read()), **kwargs
-            )
+        with self._load_lock, stage_seconds.time(stage="reload"):
+            logger.info(f"Loading recommendations, type: {type}, path: {path}")
+            version = self._versions[type] + 1
+
+            recs_path = None
+            if type == "personal" and os.path.exists(path):
+                # локальный файл: сохраняем массивы на диск и открываем через memory map
+                recs_path = os.path.join(
+                    RECS_CACHE_DIR, f"{type}-{os.getpid()}-v{version}"
+                )
+                # папка могла остаться от прошлого запуска с тем же pid - save_arrays её бы не заменил
+                shutil.rmtree(recs_path, ignore_errors=True)
+                save_arrays(recs_arrays(type, path, progress, **kwargs), recs_path)
+                recs = CSRRecs.load(recs_path)
+            else:
+                recs = recs_from_arrays(type, recs_arrays(type, path, progress, **kwargs))
+
+            report("swapping", 0.9)
+            self._swap(type, recs, version, recs_path)
+
+            logger.info(f"Loaded, type: {type}, version: {version}")
+
+        return version
+
+    def _swap(self, type, recs, version, recs_path=None):
 
-        logger.info(f"Loaded")
+        previous_path = self._paths[type]
+        self._recs = {**self._recs, type: recs}
+        self._versions = {**self._versions, type: version}
+        self._paths[type] = recs_path
+
+        # файлы старой версии (созданные этим процессом) можно удалять: открытые memory map остаются валидными
+        if previous_path is not None:
+            shutil.rmtree(previous_path, ignore_errors=True)
+
+    def set(self, type, recs, version):
+        """
+        Подменяет рекомендации указанного типа уже готовыми (например, из общего поколения артефактов)
+        """
+
+        with self._load_lock:
+            self._swap(type, recs, version)
+            logger.info(f"Attached, type: {type}, version: {version}")
+
+    def version(self, type):
+        """
+        Возвращает номер текущей версии рекомендаций указанного типа
+        """
+
+        return self._versions[type]
 
     def get(self, user_id: int, k: int = 100):
         """
-        Возвращает список рекомендаций для пользователя
+        Возвращает массив рекомендаций для пользователя (срез хранилища, без копирования)
         """
 
-        try:
-            recs = self._recs["personal"].loc[user_id]
-            recs = recs["track_id"].to_list()[:k]
+        return self.get_scored(user_id, k)[0]
+
+    def get_scored(self, user_id: int, k: int = 100, fallback=None):
+        """
+        Возвращает (track_ids, scores, type) рекомендаций для пользователя: персональные или ТОП-рекомендации.
+        У ТОП-рекомендаций score нет - вместо него используется убывающий по рангу score от 1 до 0
+
+        fallback(user_ids, k) -> (lengths, track_ids, scores) - рекомендации для пользователей без персональных
+        (например, fold-in ALS по событиям); ТОП-рекомендации - если и fallback ничего не вернул
+        """
+
+        # берём ссылку на текущие версии один раз - подмена при перезагрузке на запрос не повлияет
+        current = self._recs
+        personal = current["personal"]
+        found = personal.get(user_id) if personal is not None else None
+        fallback_recs = None
+        if found is None and fallback is not None:
+            fallback_recs = fallback([user_id], k)
+        if found is not None:
+            recs, scores = found[0][:k], found[1][:k]
+            type = "personal"
             self._stats["request_personal_count"] += 1
-            logger.info(f"Found {len(recs)} personal recommendations!")
-        except:
-            recs = self._recs["default"]
-            recs = recs["track_id"].to_list()[:k]
+            logger.debug(f"Found {len(recs)} personal recommendations!")
+        elif fallback_recs is not None and fallback_recs[0][0] > 0:
+            _, recs, scores = fallback_recs
+            type = "fallback"
+            self._stats["request_fallback_count"] += 1
+            logger.debug(f"Found {len(recs)} fallback recommendations!")
+        else:
+            recs = current["default"][:k]
+            scores = rank_scores(len(recs))
+            type = "default"
             self._stats["request_default_count"] += 1
-            logger.info(f"Found {len(recs)} TOP-recommendations!")
+            logger.debug(f"Found {len(recs)} TOP-recommendations!")
 
-        if not recs:
+        if len(recs) == 0:
             logger.error("No recommendations found")
-            recs = []
 
-        return recs
+        return recs, scores, type
+
+    def get_many(self, user_ids, k: int = 100, fallback=None):
+        """
+        Рекомендации сразу для нескольких пользователей за один проход по хранилищу:
+        персональные, а для ненайденных пользователей - fallback (см. get_scored) или ТОП-рекомендации
+
+        Возвращает (lengths, track_ids, scores, types): число рекомендаций каждого пользователя, плоские массивы
+        рекомендаций и их score (у ТОП-рекомендаций - score по рангу, как в get_scored) и тип рекомендаций
+        каждого пользователя ("personal", "fallback" или "default", как в get_scored)
+        """
+
+        current = self._recs
+        default = np.asarray(current["default"][:k])
+        default_scores = rank_scores(len(default))
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+
+        if current["personal"] is not None:
+            found, lengths, personal, personal_scores = current["personal"].take(user_ids, k)
+        else:
+            found = np.zeros(len(user_ids), dtype=bool)
+            lengths = np.zeros(len(user_ids), dtype=np.int64)
+            personal = np.empty(0, dtype=np.int64)
+            personal_scores = np.empty(0, dtype=np.float32)
+
+        # ненайденным пользователям - рекомендации fallback одним вызовом для всех
+        fallback_lengths = np.zeros(len(user_ids), dtype=np.int64)
+        fallback_ids = np.empty(0, dtype=np.int64)
+        fallback_scores = np.empty(0, dtype=np.float32)
+        if fallback is not None and not found.all():
+            missing = np.flatnonzero(~found)
+            fallback_lengths[missing], fallback_ids, fallback_scores = fallback(user_ids[missing], k)
+        has_fallback = fallback_lengths > 0
+
+        self._stats["request_personal_count"] += int(found.sum())
+        self._stats["request_fallback_count"] += int(has_fallback.sum())
+        self._stats["request_default_count"] += int((~found & ~has_fallback).sum())
+
+        # остальным подставляем ТОП-рекомендации
+        lengths = np.where(found, lengths, np.where(has_fallback, fallback_lengths, len(default)))
+        segments = np.repeat(np.arange(len(user_ids)), lengths)
+        positions = segment_positions(lengths)
+        track_ids = np.empty(lengths.sum(), dtype=np.int64)
+        scores = np.empty(lengths.sum(), dtype=np.float64)
+        is_personal = found[segments]
+        is_fallback = has_fallback[segments]
+        is_default = ~is_personal & ~is_fallback
+        track_ids[is_personal] = personal
+        scores[is_personal] = personal_scores
+        track_ids[is_fallback] = fallback_ids
+        scores[is_fallback] = fallback_scores
+        track_ids[is_default] = default[positions[is_default]]
+        scores[is_default] = default_scores[positions[is_default]]
+
+        types = np.where(found, "personal", np.where(has_fallback, "fallback", "default"))
+
+        return lengths, track_ids, scores, types
+
+    def get_default(self, k: int = 100):
+        """
+        Возвращает ТОП-рекомендации (срез, без копирования)
+        """
+
+        return self._recs["default"][:k]
+
+    def get_default_scored(self, k: int = 100):
+        """
+        Возвращает ТОП-рекомендации и их score по рангу (см. get_scored)
+        """
+
+        recs = self._recs["default"][:k]
+
+        return recs, rank_scores(len(recs))
+
+    def sizes(self):
+        """
+        Размеры текущих версий: число пользователей с персональными рекомендациями и длина ТОП-рекомендаций
+        """
+
+        current = self._recs
+
+        return {
+            "recs_personal_users": len(current["personal"]) if current["personal"] is not None else 0,
+            "recs_default_items": len(current["default"]) if current["default"] is not None else 0,
+        }
 
     def stats(self):
 
-        logger.info("Stats for recommendations")
+        logger.debug("Stats for recommendations")
         for name, value in self._stats.items():
-            logger.info(f"{name:<30} {value} ")
-        print(self._stats)
+            logger.debug(f"{name:<30} {value} ")
         return self._stats
 
 
-# Класс Event Store - компонент, умеющий сохранять и выдавать последние события пользователя
-class EventStore:
-    def __init__(self, max_events_per_user=10):
+# Фоновая перезагрузка оффлайн-рекомендаций: загрузка выполняется в отдельном потоке,
+# а ход выполнения можно узнать по идентификатору задачи
+class RecommendationsReloader:
+    """
+    Методы:
 
-        self.events = {}
-        self.max_events_per_user = max_events_per_user
+    submit - ставит загрузку рекомендаций в очередь и возвращает описание задачи.
+    get - возвращает описание задачи по её идентификатору (или None).
+    """
 
-    def put(self, user_id, item_id):
+    def __init__(self, rec_store, max_jobs=100):
+
+        self._rec_store = rec_store  # Recommendations или SharedArtifacts (нужен метод load)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reload")
+        self._jobs = {}
+        self._max_jobs = max_jobs  # сколько последних задач хранить
+
+    def submit(self, rec_type, path, **kwargs):
         """
-        Сохраняет событие
+        Ставит загрузку в очередь
         """
 
-        user_events = self.events.get(user_id, [])
-        self.events[user_id] = [item_id] + user_events[: self.max_events_per_user]
+        job_id = uuid.uuid4().hex
+        self._jobs[job_id] = {
+            "job_id": job_id,
+            "rec_type": rec_type,
+            "path": path,
+            "status": "queued",
+            "progress": 0.0,
+            "version": None,
+            "error": None,
+        }
+        # забываем самые старые задачи
+        while len(self._jobs) > self._max_jobs:
+            self._jobs.pop(next(iter(self._jobs)))
 
-    def get(self, user_id, k):
+        self._executor.submit(self._run, job_id, rec_type, path, **kwargs)
+
+        return dict(self._jobs[job_id])
+
+    def _run(self, job_id, rec_type, path, **kwargs):
+
+        job = self._jobs[job_id]
+
+        def progress(stage, value):
+            job["status"] = stage
+            job["progress"] = value
+
+        try:
+            job["version"] = self._rec_store.load(
+                type=rec_type, path=path, progress=progress, **kwargs
+            )
+            job["status"] = "done"
+            job["progress"] = 1.0
+        except Exception as e:
+            logger.exception(f"Failed to load recommendations, job: {job_id}")
+            job["status"] = "failed"
+            job["error"] = str(e)
+
+    def get(self, job_id):
         """
-        Возвращает события для пользователя
+        Возвращает описание задачи
         """
-        user_events = self.events.get(user_id, [])
 
-        return user_events
+        job = self._jobs.get(job_id)
+
+        return dict(job) if job is not None else None
+
+
+# Общие для всех воркеров артефакты: модель, индекс треков и оффлайн-рекомендации один раз материализуются
+# в поколение плоских .npy-файлов, а каждый процесс открывает их через memory map без копирования
+class SharedArtifacts:
+    """
+    Методы:
+
+    publish_initial - материализует артефакты и рекомендации в первое поколение (если его ещё нет).
+    attach - подключает процесс к поколению: подменяет артефакты и рекомендации его массивами.
+    start - при запуске воркера: публикует первое поколение при необходимости, подключается к нему и следит за новыми.
+    load - перезагружает рекомендации: публикует новое поколение и подключается к нему (для RecommendationsReloader).
+    """
+
+    def __init__(self, generations, artifacts, rec_store, poll_interval=1.0):
+
+        self._generations = generations
+        self._artifacts = artifacts
+        self._rec_store = rec_store
+        self.poll_interval = poll_interval  # как часто проверять, не появилось ли новое поколение, секунд
+        self.generation = None  # поколение, к которому подключён процесс
+        self._attach_lock = threading.Lock()
+        self._watcher = None
+
+    def publish_initial(self, sources, force=False):
+        """
+        sources - откуда брать оффлайн-рекомендации: {type: (path, kwargs)}.
+        force - опубликовать новое поколение, даже если оно уже есть
+        """
+
+        arrays = {
+            name: functools.partial(self._artifacts.arrays, name)
+            for name in self._artifacts.default_names()
+        }
+        for type, (path, kwargs) in sources.items():
+            arrays[type] = functools.partial(recs_arrays, type, path, **kwargs)
+
+        return self._generations.publish(arrays, if_missing=not force)
+
+    def attach(self, gen):
+
+        with self._attach_lock:
+            if self.generation is not None and gen <= self.generation:
+                return
+
+            arrays = self._generations.attach(gen)
+            self._artifacts.attach(
+                {name: value for name, value in arrays.items() if name in Artifacts.NAMES}
+            )
+            for type in ("personal", "default"):
+                if type in arrays:
+                    self._rec_store.set(type, recs_from_arrays(type, arrays[type]), version=gen)
+            self.generation = gen
+
+        logger.info(f"Attached artifacts generation {gen}")
+
+    def start(self, sources):
+
+        self.attach(self.publish_initial(sources))
+        if self._watcher is None:
+            self._watcher = threading.Thread(
+                target=self._watch, name="shared-artifacts", daemon=True
+            )
+            self._watcher.start()
+
+    def _watch(self):
+
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                gen = self._generations.current()
+                if gen is not None and gen != self.generation:
+                    self.attach(gen)
+            except Exception:
+                logger.exception("Failed to attach artifacts generation")
+
+    def load(self, type, path, progress=None, **kwargs):
+        """
+        Публикует новое поколение с рекомендациями из path, остальные артефакты переносятся из текущего.
+        Возвращает номер поколения (он же - версия рекомендаций во всех воркерах)
+        """
+
+        with stage_seconds.time(stage="reload"):
+            gen = self._generations.publish(
+                {type: functools.partial(recs_arrays, type, path, progress, **kwargs)}
+            )
+        if progress is not None:
+            progress("swapping", 0.9)
+        self.attach(gen)
+
+        return gen
 
 
 # загрузка готовых оффлайн-рекомендаций
 rec_store = Recommendations()
 
-# Event Store
-events_store = EventStore()
+# если задан SHARED_ARTIFACTS_DIR, артефакты и рекомендации берутся из общих для воркеров поколений
+# в этой папке (новое поколение воркеры замечают раз в SHARED_ARTIFACTS_POLL секунд)
+shared_artifacts = None
+if os.environ.get("SHARED_ARTIFACTS_DIR"):
+    shared_artifacts = SharedArtifacts(
+        ArtifactGenerations(os.environ["SHARED_ARTIFACTS_DIR"]),
+        artifacts,
+        rec_store,
+        poll_interval=float(os.environ.get("SHARED_ARTIFACTS_POLL", 1.0)),
+    )
+
+# перезагрузка оффлайн-рекомендаций в фоне
+rec_reloader = RecommendationsReloader(shared_artifacts or rec_store)
+
+# Event Store: не больше EVENTS_MAX_PER_USER событий на пользователя, пользователи без обращений дольше
+# EVENTS_TTL секунд удаляются, при превышении EVENTS_MEMORY_BUDGET байт удаляются давно не обращавшиеся
+events_store = EventStore(
+    max_events_per_user=int(os.environ.get("EVENTS_MAX_PER_USER", 10)),
+    ttl=float(os.environ["EVENTS_TTL"]) if os.environ.get("EVENTS_TTL") else None,
+    memory_budget=int(os.environ.get("EVENTS_MEMORY_BUDGET", 256 * 1024**2)),
+)
+# если задан EVENTS_LOG_DIR, события пишутся в журнал в этой папке: переживают перезапуск
+# и общие для всех воркеров на хосте
+if os.environ.get("EVENTS_LOG_DIR"):
+    events_store = DurableEventStore(
+        os.environ["EVENTS_LOG_DIR"],
+        store=events_store,
+        flush_interval=float(os.environ.get("EVENTS_FLUSH_INTERVAL", 0.01)),
+        snapshot_bytes=int(os.environ.get("EVENTS_SNAPSHOT_BYTES", 64 * 1024**2)),
+        fsync=os.environ.get("EVENTS_FSYNC", "0") == "1",
+    )
+
+
+# векторы пользователей для fold-in кэшируются до следующего события пользователя
+# (не больше ALS_FOLD_IN_CACHE_SIZE пользователей)
+fold_in = FoldIn(max_size=int(os.environ.get("ALS_FOLD_IN_CACHE_SIZE", 100_000)))
 
 
-async def get_als_i2i(track_id: int, N: int = 1):
+def get_fold_in_recs(user_ids, k: int = 100):
+    """
+    Персональные рекомендации ALS по событиям пользователей из Event Store (fallback для Recommendations):
+    вектор пользователя считается по его трекам при неизменных факторах треков, уже прослушанные треки
+    в выдачу не попадают. У пользователей без известных модели событий рекомендаций нет (длина 0)
+
+    Возвращает (lengths, track_ids, scores): число рекомендаций каждого пользователя и плоские массивы
+    """
+
+    item_index = artifacts.item_index
+    # seq читаем до событий: если событие придёт между ними, вектор пересчитается при следующем запросе;
+    # метка seq не повторяется и после вытеснения пользователя из events_store, поэтому старый вектор не вернётся
+    keys = [(events_store.seq(user_id), artifacts.version) for user_id in user_ids]
+    items_per_user = []
+    for user_id in user_ids:
+        track_ids_enc = item_index.encode(
+            np.asarray(events_store.get(user_id, events_store.max_events_per_user), dtype=np.int64)
+        )
+        items_per_user.append(track_ids_enc[track_ids_enc >= 0])
+
+    known = [row for row, items in enumerate(items_per_user) if len(items) > 0]
+    lengths = np.zeros(len(user_ids), dtype=np.int64)
+    if not known:
+        return lengths, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+    with stage_seconds.time(stage="fold_in"):
+        known_lengths, ids, scores = fold_in.recommend(
+            artifacts.fold_in_model,
+            [user_ids[row] for row in known],
+            [items_per_user[row] for row in known],
+            [keys[row] for row in known],
+            k,
+        )
+
+    # track_id_enc без трека в каталоге (track_id = -1) в выдачу не попадают
+    track_ids = item_index.decode(ids)
+    found = track_ids >= 0
+    segments = np.repeat(np.arange(len(known)), known_lengths)
+    lengths[known] = np.bincount(segments[found], minlength=len(known))
+
+    return lengths, track_ids[found], scores[found]
+
+
+async def get_als_i2i(track_id: int, N: int = 1, mode: str = None):
     """
     Выводит список идентификаторов похожих треков по track_id
+
+    mode == "exact" - полный перебор, mode == "approx" - поиск по IVF-индексу (по умолчанию ALS_I2I_MODE)
+    """
+
+    return get_als_i2i_batch([track_id], N=N, mode=mode)
+
+
+# ограничение памяти на матрицу scores при точном поиске похожих треков: запросы обрабатываются частями
+I2I_CHUNK_BYTES = int(os.environ.get("I2I_CHUNK_BYTES", 256 * 1024**2))
+
+
+def als_similar_items(track_ids_enc, N: int = 1, mode: str = None):
+    """
+    Для массива track_id_enc матричным произведением находит по N-1 похожих треков
+    (как similar_items(N=N) без первого элемента - самого трека). Треки без записи в каталоге
+    (см. ItemIndex.missing) в выдачу не попадают
+
+    mode == "exact" - полный перебор, mode == "approx" - поиск по IVF-индексу (по умолчанию ALS_I2I_MODE)
+
+    Возвращает матрицы track_id_enc и scores размером len(track_ids_enc) x (N-1),
+    строки отсортированы по убыванию score (недостающие элементы: -1 в режиме approx, -inf в scores)
     """
 
-    track_id_enc = items.query("track_id == @track_id")["track_id_enc"].to_list()[0]
-    similar_items = als_model.similar_items(track_id_enc, N=N)
-    similar_tracks_enc = similar_items[0].tolist()[1 : N + 1]
-    similar_tracks_scores = similar_items[1].tolist()[1 : N + 1]
+    track_ids_enc = np.asarray(track_ids_enc, dtype=np.int64)
+    item_factors_normed = artifacts.item_factors_normed
+    n_items = item_factors_normed.shape[0]
+    n_neighbours = min(N - 1, n_items - 1)
+    if len(track_ids_enc) == 0 or n_neighbours <= 0:
+        empty = np.empty((len(track_ids_enc), 0))
+        return empty.astype(np.int64), empty.astype(np.float32)
 
-    similar_tracks = []
-    for i_enc in similar_tracks_enc:
-        similar_tracks.append(
-            items.query("track_id_enc == @i_enc")["track_id"].to_list()[0]
+    missing = artifacts.item_index.missing(n_items)
+    if (mode or ALS_I2I_MODE) == "approx":
+        return artifacts.ann_index.search(
+            item_factors_normed[track_ids_enc],
+            n_neighbours,
+            n_probe=ALS_ANN_N_PROBE,
+            exclude=track_ids_enc,
+            exclude_items=missing,
         )
 
-    return similar_tracks, similar_tracks_scores
+    # полный перебор частями: матрица scores одной части не больше I2I_CHUNK_BYTES
+    return exact_top_k(
+        item_factors_normed, track_ids_enc, n_neighbours, I2I_CHUNK_BYTES, exclude_enc=missing
+    )
+
+
+def segment_positions(lengths):
+    """
+    Для плоского массива, составленного из сегментов длины lengths, возвращает позицию
+    каждого элемента внутри своего сегмента
+    """
+
+    lengths = np.asarray(lengths, dtype=np.int64)
+    starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+    return np.arange(lengths.sum()) - starts
+
+
+def get_als_i2i_users(events_per_user, N: int = 1, mode: str = None):
+    """
+    Онлайн-рекомендации сразу для нескольких пользователей: похожие треки на события всех пользователей
+    считаются одним пакетом, затем внутри каждого пользователя сортируются по убыванию score и дедублицируются
+
+    events_per_user - список списков track_id (события каждого пользователя)
+    Возвращает плоские массивы (segments, track_ids, scores), где segments - номер пользователя в events_per_user
+    """
+
+    item_index = artifacts.item_index
+    lengths = np.array([len(events) for events in events_per_user], dtype=np.int64)
+    events = np.fromiter(
+        (track_id for user_events in events_per_user for track_id in user_events),
+        dtype=np.int64,
+        count=lengths.sum(),
+    )
+    segments = np.repeat(np.arange(len(events_per_user)), lengths)
+
+    track_ids_enc = item_index.encode(events)
+    known = track_ids_enc >= 0
+
+    similar_tracks_enc, similar_tracks_scores = als_similar_items(
+        track_ids_enc[known], N=N, mode=mode
+    )
+    segments = np.repeat(segments[known], similar_tracks_enc.shape[1])
+    similar_tracks_enc = similar_tracks_enc.ravel()
+    similar_tracks_scores = similar_tracks_scores.ravel()
+
+    # недостающие соседи: -1 в режиме approx, -inf в scores (если исключённых треков не хватило обойти)
+    found = (similar_tracks_enc >= 0) & np.isfinite(similar_tracks_scores)
+    segments = segments[found]
+    similar_tracks_enc = similar_tracks_enc[found]
+    similar_tracks_scores = similar_tracks_scores[found]
+
+    # сортировка по пользователю, затем по убыванию score; lexsort устойчив и сохраняет порядок событий
+    order = np.lexsort((-similar_tracks_scores, segments))
+    segments = segments[order]
+    similar_tracks_enc = similar_tracks_enc[order]
+    similar_tracks_scores = similar_tracks_scores[order]
+
+    # оставляем только первое (лучшее) вхождение каждого трека у каждого пользователя
+    keys = segments * (similar_tracks_enc.max(initial=0) + 1) + similar_tracks_enc
+    _, first = np.unique(keys, return_index=True)
+    first = np.sort(first)
+
+    # track_id_enc без трека в каталоге (track_id = -1) в выдачу не попадают
+    track_ids = item_index.decode(similar_tracks_enc[first])
+    found = track_ids >= 0
+
+    return segments[first][found], track_ids[found], similar_tracks_scores[first][found]
+
+
+def get_als_i2i_batch(track_ids, N: int = 1, mode: str = None):
+    """
+    Выводит список идентификаторов похожих треков сразу для нескольких track_ids:
+    похожие треки всех событий объединяются, сортируются по убыванию score и дедублицируются
+    """
+
+    _, similar_tracks, similar_tracks_scores = get_als_i2i_users(
+        [track_ids], N=N, mode=mode
+    )
+
+    return similar_tracks.tolist(), similar_tracks_scores.tolist()
 
 
 def dedup_ids(ids):